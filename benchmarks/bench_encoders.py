@@ -0,0 +1,120 @@
+""" Compare the registered codecs on a full year of rankings.
+
+Reports the encoded size, encode/decode time and peak memory of every codec,
+for the 365 ranking files of a year and for the movie files built from them.
+
+Usage: python -m benchmarks.bench_encoders
+"""
+import time
+import random
+import tracemalloc
+from datetime import date, timedelta
+
+from src.record import DailyRecord, Movie
+from src.encoders import ENCODERS, get_encoder
+
+MOVIES_PER_DAY = 45
+
+
+def make_year(year: int = 2023, seed: int = 7) -> dict[date, list[Movie]]:
+    """Synthetic rankings of every day of year, movies stay ~60 days on the chart"""
+    rng = random.Random(seed)
+    first = date(year, 1, 1)
+    releases = [
+        (f"rl{1077904129 + i * 7919}", f"Movie {i}", first + timedelta(days=i // 2))
+        for i in range(800)
+    ]
+
+    rankings = dict()
+    for n in range(365):
+        d = first + timedelta(days=n)
+        showing = [r for r in releases if 0 <= (d - r[2]).days < 60][:MOVIES_PER_DAY]
+        rankings[d] = []
+        for rank, (id, title, release) in enumerate(showing):
+            record = DailyRecord(rank + 1, rng.randint(1000, 9**7))
+            revenues = {(d - release).days + 1: record}
+            rankings[d].append(Movie(id=id, title=title, revenues=revenues))
+    return rankings
+
+
+def make_movies(rankings: dict[date, list[Movie]]) -> list[Movie]:
+    movies = dict()
+    for d, ranking in rankings.items():
+        for movie in ranking:
+            if movie.id not in movies:
+                nth_day = next(iter(movie.revenues))
+                movies[movie.id] = Movie(
+                    id=movie.id,
+                    title=movie.title,
+                    release_date=d - timedelta(days=nth_day - 1),
+                    distributor="Warner Bros.",
+                    num_of_theaters=4000,
+                )
+            movies[movie.id].merge_records(movie.revenues)
+    return list(movies.values())
+
+
+def measure(fn, items):
+    """Run fn over items, return (results, seconds, peak bytes)
+
+    Time and memory are measured in separate runs, tracemalloc slows down
+    every allocation.
+    """
+    items = list(items)
+    started = time.perf_counter()
+    results = [fn(item) for item in items]
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    [fn(item) for item in items]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, elapsed, peak
+
+
+def bench_codec(extension: str, rankings, movies) -> dict:
+    encoder = get_encoder(extension)
+
+    ranking_files, ranking_encode, ranking_encode_peak = measure(
+        encoder.encode_ranking, rankings.values()
+    )
+    _, ranking_decode, ranking_decode_peak = measure(
+        encoder.decode_ranking, ranking_files
+    )
+    movie_files, movie_encode, movie_encode_peak = measure(
+        encoder.encode_movie, movies
+    )
+    _, movie_decode, movie_decode_peak = measure(encoder.decode_movie, movie_files)
+
+    return {
+        "codec": extension,
+        "ranking_bytes": sum(len(f) for f in ranking_files),
+        "ranking_encode_ms": ranking_encode * 1000,
+        "ranking_decode_ms": ranking_decode * 1000,
+        "ranking_peak_kib": max(ranking_encode_peak, ranking_decode_peak) / 1024,
+        "movie_bytes": sum(len(f) for f in movie_files),
+        "movie_encode_ms": movie_encode * 1000,
+        "movie_decode_ms": movie_decode * 1000,
+        "movie_peak_kib": max(movie_encode_peak, movie_decode_peak) / 1024,
+    }
+
+
+def main():
+    rankings = make_year()
+    movies = make_movies(rankings)
+    print(f"{len(rankings)} ranking files, {len(movies)} movie files")
+
+    results = [bench_codec(extension, rankings, movies) for extension in ENCODERS]
+    columns = list(results[0])
+    print(" ".join(f"{c:>18}" for c in columns))
+    for result in results:
+        print(
+            " ".join(
+                f"{v:>18.1f}" if isinstance(v, float) else f"{v:>18}"
+                for v in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+""" Offline benchmark suite of the crawl, codec and handler hot paths.
+
+Every case runs on the pages recorded in tests/fixtures, including the known
+edge cases (rankings with missing theater counts, "Release Date (Wide)"
+detail pages), so results are comparable between runs and machines need no
+network nor AWS:
+
+    parse/{parser}/...      parse_daily_ranking / parse_movie_detail
+    crawl/...               crawl_daily_ranking / crawl_movie_detail, and
+                            two weeks of rankings crawled by threads or by
+                            the fetch/parse pipeline, with fetch() answered
+                            from the recorded pages
+    codec/{extension}/...   encode_* / decode_* of every registered codec
+    record/...              Movie.merge_records
+    archive/...             a month of rankings read from its shard or from
+                            the daily files, on the in-memory backend so
+                            without the latency of the requests saved
+    handler/...             full ranking_handler and movie_handler runs on
+                            an emptied in-memory backend, and runs skipping
+                            the content stored already
+
+Results can be saved as a named baseline in benchmarks/baselines/ and later
+runs compared against it, the comparison exits with 1 when a case got slower
+than the threshold.
+
+Usage:
+    python -m benchmarks.bench_suite [--filter codec/] [--repeat 5]
+    python -m benchmarks.bench_suite --save NAME
+    python -m benchmarks.bench_suite --compare NAME [--threshold 1.25]
+"""
+import io
+import os
+import re
+import sys
+import json
+import timeit
+import pathlib
+import platform
+import argparse
+import contextlib
+import statistics
+from datetime import date
+from unittest import mock
+
+from src import archive, crawler, pipeline
+from src.record import Movie
+from src.parsers import PARSERS, get_parser
+from src.encoders import ENCODERS, get_encoder
+from src.backends import get_storage
+from src.backends.memory import MemoryObjectStore
+
+ROOT = pathlib.Path(__file__).parent.parent
+FIXTURES = ROOT / "tests" / "fixtures"
+BASELINES = pathlib.Path(__file__).parent / "baselines"
+EXAMPLE_INPUT = ROOT / "example_input.json"
+
+RANKING_DATES = ["2023-08-17", "2023-08-10"]  # 08-10 misses theater counts
+MOVIE_IDS = ["rl1077904129", "rl1592820481", "rl1930593025"]  # wide release
+
+# the handlers read their configuration at import
+HANDLER_ENV = {
+    "storage_backend": "memory",
+    "ranking_folder_prefix": "ranking",
+    "movies_folder_prefix": "movies",
+    "sqs_ranking_queue_url": "memory://ranking",
+    "sqs_movies_queue_url": "memory://movies",
+    "file_extension": "json",
+    "uuid_ns_base": "6ba7b810-9dad-11d1-80b4-00c04fd430c8",
+}
+
+# a timed run lasts at least this long, short cases are called in a loop
+MIN_RUN_SECONDS = 0.05
+
+
+def recorded_page(url: str, **kwargs) -> str:
+    """Stand-in of fetch(), dates without a recording get the 2023-08-17 page"""
+    match = re.search(r"/date/(\d{4}-\d{2}-\d{2})", url)
+    if match:
+        path = FIXTURES / f"date_{match.group(1)}.html"
+        if not path.exists():
+            path = FIXTURES / "date_2023-08-17.html"
+        return path.read_text(encoding="utf-8")
+
+    match = re.search(r"/release/(\w+)", url)
+    return (FIXTURES / f"release_{match.group(1)}.html").read_text(encoding="utf-8")
+
+
+def load_handlers():
+    """Import the handlers against the in-memory backend"""
+    for name, value in HANDLER_ENV.items():
+        os.environ.setdefault(name, value)
+    if os.environ["storage_backend"] != "memory":
+        raise RuntimeError("handler cases only run on the memory backend")
+
+    import ranking_handler
+    import movie_handler
+
+    return ranking_handler, movie_handler
+
+
+def load_empty_handlers():
+    """Like load_handlers(), with every stored object deleted so that a run
+    does the full work instead of skipping what the previous one stored
+    """
+    handlers = load_handlers()
+    storage = get_storage()
+    storage.delete(storage.list_keys(""))
+    return handlers
+
+
+def make_cases() -> dict:
+    """Benchmark name => function without arguments"""
+    cases = dict()
+
+    pages = {d: recorded_page(f"/date/{d}") for d in RANKING_DATES}
+    details = {id: recorded_page(f"/release/{id}") for id in MOVIE_IDS}
+
+    for name in PARSERS:
+        parser = get_parser(name)
+        for d, html in pages.items():
+            cases[f"parse/{name}/ranking_{d}"] = (
+                lambda parser=parser, html=html, d=date.fromisoformat(d): (
+                    parser.parse_daily_ranking(html, d)
+                )
+            )
+        for id, html in details.items():
+            cases[f"parse/{name}/detail_{id}"] = (
+                lambda parser=parser, html=html, id=id: parser.parse_movie_detail(
+                    html, id
+                )
+            )
+
+    # refreshing a long run stored up to its second to last day
+    html = details[MOVIE_IDS[0]]
+    cases[f"parse/stream/detail_incremental_{MOVIE_IDS[0]}"] = lambda: (
+        get_parser("stream").parse_movie_detail(html, MOVIE_IDS[0], 125)
+    )
+
+    for d in RANKING_DATES:
+        cases[f"crawl/daily_ranking_{d}"] = (
+            lambda d=date.fromisoformat(d): crawler.crawl_daily_ranking(d)
+        )
+    for id in MOVIE_IDS:
+        cases[f"crawl/movie_detail_{id}"] = lambda id=id: crawler.crawl_movie_detail(
+            id
+        )
+
+    # a bulk backfill, downloads and parsing in the same threads or in stages
+    first, last = date(2023, 8, 1), date(2023, 8, 14)
+    cases["crawl/daily_rankings_14_days"] = lambda: list(
+        crawler.crawl_daily_rankings(first, last)
+    )
+    cases["crawl/pipeline_rankings_14_days"] = lambda: list(
+        pipeline.pipeline_daily_rankings(first, last)
+    )
+
+    parser = get_parser()
+    ranking = parser.parse_daily_ranking(pages["2023-08-17"], date(2023, 8, 17))
+    movie = parser.parse_movie_detail(details[MOVIE_IDS[0]], MOVIE_IDS[0])
+    for extension in ENCODERS:
+        encoder = get_encoder(extension)
+        ranking_file = encoder.encode_ranking(ranking)
+        movie_file = encoder.encode_movie(movie)
+        cases[f"codec/{extension}/encode_ranking"] = (
+            lambda encoder=encoder: encoder.encode_ranking(ranking)
+        )
+        cases[f"codec/{extension}/decode_ranking"] = (
+            lambda encoder=encoder, readable=ranking_file: encoder.decode_ranking(
+                readable
+            )
+        )
+        cases[f"codec/{extension}/encode_movie"] = (
+            lambda encoder=encoder: encoder.encode_movie(movie)
+        )
+        cases[f"codec/{extension}/decode_movie"] = (
+            lambda encoder=encoder, readable=movie_file: encoder.decode_movie(readable)
+        )
+
+    # merging the same records again overwrites them, every call does the same
+    # work as merging a day of new records into a stored movie
+    target = Movie(id=movie.id, title=movie.title, revenues=dict(movie.revenues))
+    cases["record/merge_records"] = lambda: target.merge_records(movie.revenues)
+
+    # august 2023 stored as daily files, and packed
+    shards, daily = MemoryObjectStore(), MemoryObjectStore()
+    writable = get_encoder("json").encode_ranking(ranking)
+    for day in range(1, 32):
+        for storage in [shards, daily]:
+            storage.put(f"ranking/2023-08-{day:02}.json", writable)
+    archive.pack(shards, "ranking", "archive", "2023-08")
+    for name, storage in [("shard", shards), ("daily", daily)]:
+        cases[f"archive/read_month_{name}"] = lambda storage=storage: list(
+            archive.read_rankings(
+                storage, "ranking", "archive", date(2023, 8, 1), date(2023, 8, 31)
+            )
+        )
+
+    event = json.loads(EXAMPLE_INPUT.read_text())
+
+    def movie_event(**kwargs):
+        bodies = [json.dumps({"id": id, **kwargs}) for id in MOVIE_IDS]
+        return {
+            "Records": [
+                {"messageId": str(n), "receiptHandle": str(n), "body": body}
+                for n, body in enumerate(bodies)
+            ]
+        }
+
+    cases["handler/ranking"] = lambda: load_empty_handlers()[0].lambda_handler(
+        event, None
+    )
+    # the same ranking delivered again, on what the previous case stored
+    cases["handler/ranking_unchanged"] = lambda: load_handlers()[0].lambda_handler(
+        event, None
+    )
+    # full crawls, and refreshes of movies that are already up to date
+    full, refresh = movie_event(full=True), movie_event()
+    cases["handler/movie"] = lambda: load_empty_handlers()[1].lambda_handler(
+        full, None
+    )
+    cases["handler/movie_refresh"] = lambda: load_handlers()[1].lambda_handler(
+        refresh, None
+    )
+
+    return cases
+
+
+def time_case(fn, repeat: int) -> dict:
+    """Per call timings of fn in milliseconds, over repeat runs"""
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < MIN_RUN_SECONDS and number < 10**6:
+        number *= 2
+    runs = [t / number * 1000 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_ms": statistics.median(runs),
+        "min_ms": min(runs),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run(name_filter: str = "", repeat: int = 5) -> dict:
+    """Run every case whose name contains name_filter
+    Returns:
+        case name => timings, see time_case().
+    """
+    results = dict()
+    cases = {n: fn for n, fn in make_cases().items() if name_filter in n}
+    # handlers print their progress, keep the report readable
+    with mock.patch.object(crawler, "fetch", recorded_page):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, fn in cases.items():
+                results[name] = time_case(fn, repeat)
+    return results
+
+
+def save(name: str, results: dict) -> pathlib.Path:
+    BASELINES.mkdir(exist_ok=True)
+    path = BASELINES / f"{name}.json"
+    document = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    path.write_text(json.dumps(document, indent=2, sort_keys=True) + "\n")
+    return path
+
+
+def compare(baseline: dict, results: dict, threshold: float = 1.25) -> list[dict]:
+    """Compare median timings against a baseline
+    Returns:
+        One row per case, status is "slower" when current / baseline exceeds
+        threshold, "faster" below its inverse, "new" without a baseline.
+    """
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        row = {"case": name, "baseline_ms": None, "current_ms": result["median_ms"]}
+        if before is None:
+            row.update(ratio=None, status="new")
+        else:
+            ratio = result["median_ms"] / before["median_ms"]
+            status = "ok"
+            if ratio > threshold:
+                status = "slower"
+            elif ratio < 1 / threshold:
+                status = "faster"
+            row.update(baseline_ms=before["median_ms"], ratio=ratio, status=status)
+        rows.append(row)
+    return rows
+
+
+def print_results(results: dict):
+    width = max(len(name) for name in results)
+    print(f"{'case':<{width}} {'median_ms':>12} {'min_ms':>12} {'calls':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<{width}} {result['median_ms']:>12.4f} {result['min_ms']:>12.4f}"
+            f" {result['number']:>8}"
+        )
+
+
+def print_comparison(rows: list[dict]):
+    width = max(len(row["case"]) for row in rows)
+    print(f"{'case':<{width}} {'baseline_ms':>12} {'current_ms':>12} {'ratio':>7}")
+    for row in rows:
+        baseline = "-" if row["baseline_ms"] is None else f"{row['baseline_ms']:.4f}"
+        ratio = "-" if row["ratio"] is None else f"{row['ratio']:.2f}"
+        print(
+            f"{row['case']:<{width}} {baseline:>12} {row['current_ms']:>12.4f}"
+            f" {ratio:>7}  {row['status']}"
+        )
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="offline benchmark suite")
+    parser.add_argument("--filter", default="", help="only cases containing it")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="NAME", help="save as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare to a baseline")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.repeat)
+
+    if args.save:
+        print(f"saved {save(args.save, results)}")
+
+    if not args.compare:
+        print_results(results)
+        return 0
+
+    baseline = json.loads((BASELINES / f"{args.compare}.json").read_text())
+    rows = compare(baseline["results"], results, args.threshold)
+    print_comparison(rows)
+    return 1 if any(row["status"] == "slower" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
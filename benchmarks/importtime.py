@@ -0,0 +1,84 @@
+""" Import time profile of the handlers, i.e. the module part of a cold start.
+
+Every handler is imported in a fresh interpreter under "python -X importtime",
+configured like production (S3 backend, json files) but without touching AWS.
+Reports the total init time and the modules costing the most, by their own
+import time and grouped by top level package.
+
+Usage: python -m benchmarks.importtime [handler ...] [--top 15]
+"""
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+from benchmarks.bench_suite import ROOT, HANDLER_ENV
+
+HANDLERS = ["ranking_handler", "movie_handler", "compaction_handler"]
+
+# the handlers only read these at import, no client is built before a call
+PRODUCTION_ENV = {
+    **HANDLER_ENV,
+    "storage_backend": "s3",
+    "bucket_name": "movie-etl",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """Parse the "-X importtime" report
+    Returns:
+        (module, self us, cumulative us) of every imported module.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def profile(handler: str) -> list[tuple[str, int, int]]:
+    env = {**PRODUCTION_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {handler}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def report(handler: str, modules: list[tuple[str, int, int]], top: int):
+    # top level entries of the report are the ones with no indentation
+    total = sum(cumulative for name, _, cumulative in modules if name == handler)
+    print(f"{handler}: {total / 1000:.1f} ms, {len(modules)} modules")
+
+    packages = defaultdict(int)
+    for name, self_us, _ in modules:
+        packages[name.split(".")[0]] += self_us
+    print("  by package (self ms)")
+    for package, us in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"    {package:<32} {us / 1000:>8.2f}")
+
+    print("  by module (self ms)")
+    for name, self_us, _ in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f"    {name:<32} {self_us / 1000:>8.2f}")
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="import time of the handlers")
+    parser.add_argument("handlers", nargs="*", default=HANDLERS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    for handler in args.handlers:
+        report(handler, profile(handler), args.top)
+
+
+if __name__ == "__main__":
+    main()
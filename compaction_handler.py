@@ -0,0 +1,57 @@
+import os
+from datetime import date
+
+from src import metrics
+from src.backends import get_storage, NoSuchKey, PreconditionFailed
+from src.backends.metered import MeteredObjectStore
+from src.deltas import list_movies_with_deltas, compact_movie
+from src.archive import pack_closed
+from src.manifest import Manifest, ManifestEntry
+
+RANKING_FOLDER = os.environ["ranking_folder_prefix"]
+MOVIES_FOLDER = os.environ["movies_folder_prefix"]
+FILE_EXTENSION = os.environ["file_extension"]
+MANIFEST_KEY = os.environ.get("manifest_key", "manifest.json")
+DELTAS_FOLDER = os.environ.get("deltas_folder_prefix", "deltas")
+ARCHIVE_FOLDER = os.environ.get("archive_folder_prefix", "archive")
+
+# object storage picked by env "storage_backend", calls are timed
+storage = MeteredObjectStore(get_storage())
+
+# kept across invocations of a warm container
+manifest = Manifest(storage, MANIFEST_KEY)
+
+
+@metrics.invocation("compaction_handler")
+def lambda_handler(event, context):
+    """Fold the revenue deltas written by ranking_handler (in "delta" mode)
+    into the movie objects and pack the rankings of finished months into
+    shards, meant to be triggered by a schedule.
+    """
+    manifest.refresh()
+    manifest_changes = dict()
+
+    for movie_id in list_movies_with_deltas(storage, DELTAS_FOLDER):
+        file_name = f"{MOVIES_FOLDER}/{movie_id}.{FILE_EXTENSION}"
+        try:
+            movie, etag = compact_movie(storage, file_name, DELTAS_FOLDER, movie_id)
+        except (PreconditionFailed, NoSuchKey) as err:
+            # the movie was rewritten in between or is not crawled yet,
+            # retried next time
+            print(f"Failed to compact {movie_id}, {err=}")
+            continue
+
+        if movie is not None:
+            manifest_changes[movie_id] = ManifestEntry(
+                newest_nth_day=movie.newest_nth_day(),
+                release_date=movie.release_date.isoformat(),
+                etag=etag,
+            )
+            print(f"Compacted {movie_id}")
+
+    manifest.update(manifest_changes)
+
+    for period in pack_closed(storage, RANKING_FOLDER, ARCHIVE_FOLDER, date.today()):
+        print(f"Packed the rankings of {period}")
+
+    return {"statusCode": 200}
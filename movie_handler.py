@@ -1,45 +1,218 @@
 import os
 import json
-import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from src import metrics, profiling
 from src.crawler import crawl_movie_detail
-from src.encoders.json_encoder import encode_movie
+from src.backends import get_storage, NoSuchKey
+from src.backends.metered import MeteredObjectStore
+from src.encoders import get_encoder
+from src.encoders.compression import compress, content_encoding
+from src.manifest import Manifest, ManifestEntry
+from src.record import content_hash
+from src.indexes import MovieIndex, IndexEntry
 
-BUCKET_NAME = os.environ["bucket_name"]
 MOVIES_FOLDER = os.environ["movies_folder_prefix"]
 FILE_EXTENSION = os.environ["file_extension"]
+MANIFEST_KEY = os.environ.get("manifest_key", "manifest.json")
+INDEX_KEY = os.environ.get("index_key", "indexes/movies.json")
+# number of movies crawled and stored at the same time
+MOVIE_WORKERS = int(os.environ.get("movie_workers", "10"))
+# codec of the stored files, picked by FILE_EXTENSION
+encoder = get_encoder(FILE_EXTENSION)
 
+# object storage picked by env "storage_backend", calls are timed.
+# S3 clients are thread safe, size the connection pool for the workers
+storage = MeteredObjectStore(get_storage(max_pool_connections=MOVIE_WORKERS))
 
-def lambda_handler(event, context):
-    s3_client: boto3.S3.Client = boto3.client("s3")
+# kept across invocations of a warm container
+manifest = Manifest(storage, MANIFEST_KEY)
+# title, distributor and release date lookups, see src/indexes.py
+index = MovieIndex(storage, INDEX_KEY)
 
-    records = event["Records"]
-    for record in records:
-        request_body = json.loads(record["body"])
 
-        # use for constructing target URL
-        movie_id = request_body["id"]
+@metrics.invocation("movie_handler")
+@profiling.profiled("movie_handler", storage)
+def lambda_handler(event, context):
+    """Crawl and store the movies requested by the SQS records
 
-        print(f"start crawling movie with id {movie_id}")
+    Movies are processed concurrently, a movie requested by several records is
+    crawled once. Records of failed movies are returned as batchItemFailures
+    so that SQS only retries those (the event source mapping needs
+    ReportBatchItemFailures).
 
-        # use movie id to fetch detail from boxofficedojo.com
-        movie = crawl_movie_detail(movie_id)
+    Movies already stored are refreshed with their new days only, unless a
+    record body has "full": true.
+    """
+    failures = []
 
-        # convert Movie object into writable bytes in {FILE_EXTENSION} format
-        writable = encode_movie(movie)
+    # message ids of the records requesting each movie
+    requested_by = dict()
+    full = set()
+    for record in event["Records"]:
+        try:
+            request_body = json.loads(record["body"])
+            # use for constructing target URL
+            movie_id = request_body["id"]
+        except (ValueError, KeyError, TypeError) as err:
+            print(f"Malformed message {record['messageId']}, {err=}")
+            failures.append(record["messageId"])
+            continue
+        requested_by.setdefault(movie_id, []).append(record["messageId"])
+        if request_body.get("full") is True:
+            full.add(movie_id)
 
-        file_name = f"{MOVIES_FOLDER}/{movie_id}.{FILE_EXTENSION}"
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=file_name,
-            Body=writable,
-            ContentLanguage="en-US",
-            ContentLength=len(writable),
-            Metadata={"newest-nth-day": str(movie.newest_nth_day())},
-        )
+    manifest.refresh()
 
-        print(f"Complete crawling {movie_id}")
+    manifest_changes, index_changes = dict(), dict()
+    with ThreadPoolExecutor(max_workers=MOVIE_WORKERS) as executor:
+        futures = {
+            executor.submit(store_movie, movie_id, movie_id in full): movie_id
+            for movie_id in requested_by
+        }
+        for future in as_completed(futures):
+            movie_id = futures[future]
+            try:
+                manifest_changes[movie_id], index_changes[movie_id] = future.result()
+            except Exception as err:
+                print(f"Failed crawling {movie_id}, {err=}")
+                metrics.count("movies.failed")
+                failures.extend(requested_by[movie_id])
+                continue
+            print(f"Complete crawling {movie_id}")
+
+    # one conditional write of the manifest for the whole batch. The movies
+    # are stored already, a movie missing from the manifest is looked up by
+    # ranking_handler in S3, so a failure here is not worth crawling again
+    try:
+        manifest.update(manifest_changes)
+    except Exception as err:
+        print(f"Failed updating the manifest, {err=}")
+    # same for the index, rebuilt from the stored movies by run_local.py index
+    try:
+        index.update(index_changes)
+    except Exception as err:
+        print(f"Failed updating the index, {err=}")
 
     return {
         "statusCode": 200,
+        "batchItemFailures": [{"itemIdentifier": id} for id in failures],
     }
+
+
+def store_movie(movie_id: str, full: bool = False) -> tuple[ManifestEntry, IndexEntry]:
+    """Crawl movie_id and put it in S3, a movie in the manifest is refreshed
+    Args:
+        full: crawl and store the whole history even if the movie is stored.
+    Returns:
+        The manifest entry and the index entry of the stored movie.
+    """
+    entry = None if full else manifest.get(movie_id)
+    if entry is not None:
+        try:
+            return refresh_movie(movie_id, entry)
+        except NoSuchKey:
+            print(f"{movie_id} is in the manifest but not in S3, crawl it again")
+
+    print(f"start crawling movie with id {movie_id}")
+
+    # use movie id to fetch detail from boxofficedojo.com
+    movie = crawl_movie_detail(movie_id)
+    entry = ManifestEntry(
+        newest_nth_day=movie.newest_nth_day(),
+        release_date=movie.release_date.isoformat(),
+    )
+
+    # a full crawl of a movie stored with the same rows writes nothing
+    file_name = f"{MOVIES_FOLDER}/{movie_id}.{FILE_EXTENSION}"
+    digest = content_hash([movie])
+    try:
+        head = storage.head(file_name)
+        if head.metadata.get("content-hash") == digest:
+            metrics.count("movies.unchanged")
+            entry.etag = head.etag
+            return entry, IndexEntry.of(movie)
+    except NoSuchKey:
+        pass
+
+    # convert Movie object into writable bytes in {FILE_EXTENSION} format
+    with metrics.span("encode"):
+        writable = compress(encoder.encode_movie(movie))
+
+    entry.etag = storage.put(
+        file_name,
+        writable,
+        metadata={
+            "newest-nth-day": str(movie.newest_nth_day()),
+            "content-hash": digest,
+        },
+        content_encoding=content_encoding(),
+    )
+    metrics.count("movies.stored")
+    return entry, IndexEntry.of(movie)
+
+
+def refresh_movie(
+    movie_id: str, entry: ManifestEntry
+) -> tuple[ManifestEntry, IndexEntry]:
+    """Merge the days of movie_id after entry.newest_nth_day into its stored
+    object, only the new rows of the release page are parsed
+    Returns:
+        The new manifest entry, entry itself when nothing is new, and the
+        index entry of the movie.
+    Raises:
+        NoSuchKey if the movie is not stored.
+    """
+    print(f"start refreshing movie with id {movie_id} after {entry.newest_nth_day}")
+
+    movie = crawl_movie_detail(movie_id, since_nth_day=entry.newest_nth_day)
+    if len(movie.revenues) == 0:
+        metrics.count("movies.up_to_date")
+        return entry, IndexEntry.of(movie)
+
+    file_name = f"{MOVIES_FOLDER}/{movie_id}.{FILE_EXTENSION}"
+    obj = storage.get(file_name)
+    with metrics.span("decode"):
+        stored = encoder.decode_movie(obj.body)
+
+    stored.merge_records(movie.revenues)
+    # the widest release is still growing while the movie is showing
+    stored.num_of_theaters = movie.num_of_theaters
+
+    # the manifest was behind the object, which has these days already
+    digest = content_hash([stored])
+    if obj.metadata.get("content-hash") == digest:
+        metrics.count("movies.up_to_date")
+        return (
+            ManifestEntry(
+                newest_nth_day=stored.newest_nth_day(),
+                release_date=stored.release_date.isoformat(),
+                etag=obj.etag,
+            ),
+            IndexEntry.of(movie),
+        )
+
+    with metrics.span("encode"):
+        writable = compress(encoder.encode_movie(stored))
+
+    # conditional on the object read, a concurrent merge by ranking_handler
+    # fails this record instead of being overwritten, and SQS retries it
+    etag = storage.put(
+        file_name,
+        writable,
+        metadata={
+            "newest-nth-day": str(stored.newest_nth_day()),
+            "content-hash": digest,
+        },
+        content_encoding=content_encoding(),
+        if_match=obj.etag,
+    )
+    metrics.count("movies.refreshed")
+    return (
+        ManifestEntry(
+            newest_nth_day=stored.newest_nth_day(),
+            release_date=stored.release_date.isoformat(),
+            etag=etag,
+        ),
+        IndexEntry.of(movie),
+    )
@@ -1,94 +1,138 @@
-import boto3
-import botocore
 import os
 import json
 import uuid
-from datetime import date, timedelta
-from src.crawler import crawl_daily_ranking
-from src.encoders.json_encoder import encode_ranking, encode_movie, decode_movie
+from datetime import date
+from functools import partial
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+from src import metrics, profiling
+from src.crawler import crawl_daily_ranking, crawl_daily_rankings
+from src.backends import get_storage, get_queue, conditional_update, NoSuchKey
+from src.backends.metered import MeteredObjectStore, MeteredQueue
+from src.encoders import get_encoder
+from src.encoders.compression import compress, content_encoding
+from src.manifest import Manifest, ManifestEntry
+from src.record import content_hash
+from src.deltas import new_batch_id, write_delta
+from src.scheduler import BackfillScheduler
+from src.archive import invalidate
+from src.aggregates import Aggregates
 
 
 # some global variables
-BUCKET_NAME = os.environ["bucket_name"]
 RANKING_FOLDER = os.environ["ranking_folder_prefix"]
 MOVIES_FOLDER = os.environ["movies_folder_prefix"]
 SQS_RANKING_QUEUE_URL = os.environ["sqs_ranking_queue_url"]
 SQS_MOVIES_QUEUE_URL = os.environ["sqs_movies_queue_url"]
 FILE_EXTENSION = os.environ["file_extension"]
 UUID_NS_BASE = uuid.UUID(os.environ["uuid_ns_base"])
+# codec of the stored files, picked by FILE_EXTENSION
+encoder = get_encoder(FILE_EXTENSION)
+MANIFEST_KEY = os.environ.get("manifest_key", "manifest.json")
+DELTAS_FOLDER = os.environ.get("deltas_folder_prefix", "deltas")
+# "merge": read-modify-write the movie object, "delta": append a delta object
+MOVIE_UPDATE_MODE = os.environ.get("movie_update_mode", "merge")
 
 # sqs batch request allow maximum of 10 requests at the same time.
 SQS_BATCH_LIMIT = 10
 
+# number of movies reconciled with S3 at the same time
+RECONCILE_WORKERS = int(os.environ.get("reconcile_workers", "16"))
+
+# backfill of the rankings before today, see src/scheduler.py
+BACKFILL_START = date.fromisoformat(os.environ.get("backfill_start", "2002-01-01"))
+# days per work unit, and work units in flight i.e. busy consumers
+BACKFILL_CHUNK_DAYS = int(os.environ.get("backfill_chunk_days", "7"))
+BACKFILL_CONCURRENCY = int(os.environ.get("backfill_concurrency", "4"))
+BACKFILL_LEASE_SECONDS = int(os.environ.get("backfill_lease_seconds", "3600"))
+CHECKPOINT_KEY = os.environ.get("checkpoint_key", "scheduler/checkpoint.json")
+# a date whose page is missing or unparseable is crawled this many times
+BACKFILL_MAX_ATTEMPTS = int(os.environ.get("backfill_max_attempts", "3"))
+# pages of a work unit downloaded at the same time
+CRAWL_CONCURRENCY = int(os.environ.get("crawl_concurrency", "4"))
+# monthly and yearly shards of the rankings, see src/archive.py
+ARCHIVE_FOLDER = os.environ.get("archive_folder_prefix", "archive")
+# yearly leaderboards and distributor totals, see src/aggregates.py
+AGGREGATES_FOLDER = os.environ.get("aggregates_folder_prefix", "aggregates")
+AGGREGATES_TOP_N = int(os.environ.get("aggregates_top_n", "100"))
+
 # Debugging
 DEBUG = False
 
-s3_client = boto3.client("s3")
-sqs_clent = boto3.client("sqs")
-
-# this value stores the oldest/smallest date has been seen/parsed.
-# so the next date sent to SQS will be (next_date_to_crawl - timedelta(days=1))
-next_date_to_crawl = None
-
-
+# object storage and message queue, picked by env "storage_backend", with
+# every call timed into the metrics of the invocation.
+# S3 clients are thread safe, size the connection pool for the workers
+storage = MeteredObjectStore(get_storage(max_pool_connections=RECONCILE_WORKERS))
+queue = MeteredQueue(get_queue())
+
+# kept across invocations of a warm container, refreshed by conditional GET
+manifest = Manifest(storage, MANIFEST_KEY)
+
+# kept across invocations of a warm container, refreshed by conditional GET
+aggregates = Aggregates(storage, AGGREGATES_FOLDER, top_n=AGGREGATES_TOP_N)
+
+# hands out the missing dates as work units, its checkpoint lives in storage
+# so any container can pick up the backfill
+scheduler = BackfillScheduler(
+    storage,
+    RANKING_FOLDER,
+    CHECKPOINT_KEY,
+    earliest=BACKFILL_START,
+    chunk_days=BACKFILL_CHUNK_DAYS,
+    concurrency=BACKFILL_CONCURRENCY,
+    lease_seconds=BACKFILL_LEASE_SECONDS,
+    max_attempts=BACKFILL_MAX_ATTEMPTS,
+)
+
+
+@metrics.invocation("ranking_handler")
+@profiling.profiled("ranking_handler", storage)
 def lambda_handler(event, context):
-    global next_date_to_crawl, s3_client, sqs_clent
-    if next_date_to_crawl == None:
-        # a larger number here will always converge to the current date after comparison
-        next_date_to_crawl = date.fromisoformat("2024-01-01")
-
-    print(f"next_date_to_crawl = {next_date_to_crawl.isoformat()}")
-
-    # Messages other than sent by EventBridge cron job are recurrent messages,
-    # This will decide how many new messages will send to SQS.
-    recurrent_messages = 0
-
     # merge all movie records by combining there revenues reocrd
     movies_seen = dict()
+    # every ranking crawled, re-crawled dates are skipped by the aggregates
+    crawled = dict()
     message_deletion_request_entries = []
 
+    # dates of the backfill units whose page is missing or unparseable
+    failed = []
     message_list = event["Records"]
 
     # iterate through all crawl ranking requests
     for record in message_list:
         request_body = json.loads(record["body"])
 
-        if "daily_ranking" not in request_body:
-            # only message sent by EventBridge contains this field
-            recurrent_messages += 1
-
-        # parse paramter "date" to a date object
-        d = date.fromisoformat(request_body["date"])
-
-        # compare d with next_date_to_crawl
-        if d < next_date_to_crawl:
-            next_date_to_crawl = d
-
-        print(f"start crawling move ranking on {d.isoformat()}")
-
-        # use date as agrument to crawl the ranking
-        movies = crawl_daily_ranking(d)
-
-        my_print(f"Save rankings in S3 as {d.isoformat()}.{FILE_EXTENSION}")
-        # convert List[Movie] to writable bytes in {FILE_EXTENSION} format
-        writable = encode_ranking(movies)
-
-        # Save to S3
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{RANKING_FOLDER}/{d.isoformat()}.{FILE_EXTENSION}",
-            Body=writable,
-            ContentLanguage="en-US",
-            ContentLength=len(writable),
-        )
-        print(f"Complete upload {d.isoformat()}.{FILE_EXTENSION}")
-
-        # merge movies into movies_seen
-        for movie in movies:
-            if movie.id not in movies_seen:
-                movies_seen[movie.id] = movie
-            else:
-                movies_seen[movie.id].merge_records(movie.revenues)
+        if "start" in request_body:
+            # a backfill work unit, a range of dates crawled concurrently
+            start = date.fromisoformat(request_body["start"])
+            end = date.fromisoformat(request_body["end"])
+            print(f"start crawling move rankings from {start} to {end}")
+            rankings = crawl_daily_rankings(
+                start, end, concurrency=CRAWL_CONCURRENCY, failed=failed
+            )
+        else:
+            # parse paramter "date" to a date object
+            d = date.fromisoformat(request_body["date"])
+            print(f"start crawling move ranking on {d.isoformat()}")
+            # use date as agrument to crawl the ranking
+            rankings = [(d, crawl_daily_ranking(d))]
+
+        for d, movies in rankings:
+            crawled[d] = movies
+            # an unchanged ranking is not written again, but its movies are
+            # still reconciled: a redelivered batch may have stored it and
+            # failed before the merges (see below). Settled movies are
+            # manifest hits
+            store_ranking(d, movies)
+
+            # merge movies into movies_seen, a copy keeps the ranking as crawled
+            for movie in movies:
+                if movie.id not in movies_seen:
+                    movies_seen[movie.id] = replace(
+                        movie, revenues=dict(movie.revenues)
+                    )
+                else:
+                    movies_seen[movie.id].merge_records(movie.revenues)
 
         # Use date as Id for deleting message in batch
         message_deletion_request = {
@@ -97,81 +141,70 @@ def lambda_handler(event, context):
         }
         message_deletion_request_entries.append(message_deletion_request)
 
-    sqs_clent.delete_message_batch(
-        QueueUrl=SQS_RANKING_QUEUE_URL, Entries=message_deletion_request_entries
-    )
+    # released from their lease, so that they do not hold up the backfill
+    for d, err in failed:
+        print(f"ranking of {d.isoformat()} failed permanently: {err}")
+    scheduler.record_failures([d for d, _ in failed])
 
-    # Now, for each movie in movies_seen, check if {movie.id}.json existence by
-    # examine the object header in S3 using list_objects_v2()
+    # the messages are deleted once the rankings are fully applied, a failure
+    # until then retries the batch: the dates already in the aggregates are
+    # skipped and the movies merged already are manifest hits
+    aggregates.ingest(crawled)
+
+    # Now, for each movie in movies_seen, look up {movie.id} in the manifest,
+    # falling back to the object header in S3 for movies not in it yet.
     #
-    # If not exists (determined by S3.Client.exceptions.NoSuchKey exception),
+    # If not exists (determined by NoSuchKey exception),
     # simply create a new SQS message to fetch the full record of the movie
     #
-    # If exists, compare the  metadata "newest_nth_day" with crawled movie's
+    # If exists, compare the "newest_nth_day" with crawled movie's
     # largest nth_day. If lesser, no further operation is needed. Otherwise,
-    # get the movie object, merge with new records, and put back to S3.
-    sqs_movies_requests = []
-
-    for movie in movies_seen.values():
-        try:
-            file_name = f"{MOVIES_FOLDER}/{movie.id}.{FILE_EXTENSION}"
+    # get the movie object, merge with new records, and put back to S3. In
+    # "delta" mode, the new records are appended as a delta object instead.
+    #
+    # Movies are independent of each other, so they are reconciled on a thread
+    # pool. Logs of each movie are buffered and printed in the original order.
+    manifest.refresh()
 
-            # retrieve object's metadata
-            object_head_response = s3_client.head_object(
-                Bucket=BUCKET_NAME, Key=file_name
-            )
+    sqs_movies_requests = []
+    manifest_changes = dict()
+    failed_movies = []
 
-            nth_day = int(object_head_response["Metadata"]["newest-nth-day"])
-            if nth_day >= movie.newest_nth_day():
-                # no need to update the movie
-                continue
+    # all deltas of this invocation share the same batch id
+    reconcile = partial(reconcile_movie, batch_id=new_batch_id())
 
-            # fetch file from S3
-            object_response = s3_client.get_object(Bucket=BUCKET_NAME, Key=file_name)
+    with ThreadPoolExecutor(max_workers=RECONCILE_WORKERS) as executor:
+        results = executor.map(reconcile, movies_seen.values())
+        for movie, (request, entry, logs, ok) in zip(movies_seen.values(), results):
+            for line in logs:
+                print(line)
+            if not ok:
+                failed_movies.append(movie.id)
+            if request is not None:
+                sqs_movies_requests.append(request)
+            if entry is not None:
+                manifest_changes[movie.id] = entry
 
-            # deserialize json into a Movie object
-            movie_obj = decode_movie(object_response["Body"].read())
+    manifest.update(manifest_changes)
 
-            # combine with crawled movie
-            movie_obj.merge_records(movie.revenues)
+    if failed_movies:
+        # left in the queue, SQS redelivers the batch
+        raise RuntimeError(f"failed to reconcile movies {', '.join(failed_movies)}")
 
-            # put movie_obj back to S3
-            writable = encode_movie(movie_obj)
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=file_name,
-                Body=writable,
-                ContentLanguage="en-US",
-                ContentLength=len(writable),
-            )
-
-        except botocore.exceptions.ClientError:
-            # Movie {movie.title} does not exist in S3 yet,
-            # construct a SQS request for crawl the detail
-            my_print(
-                f"Movie {movie.title} does not exist in S3, prepare new crawler job"
-            )
-
-            # prepare SQS message, with 0 second delay
-            request = {
-                "Id": movie.id,
-                "MessageBody": json.dumps({"id": movie.id}),
-            }
-            sqs_movies_requests.append(request)
-
-        except Exception as err:
-            print(f"Unexpected {err=}, {type(err)=}")
+    queue.delete_batch(SQS_RANKING_QUEUE_URL, message_deletion_request_entries)
 
     # send_sqs_requests(SQS_MOVIES_QUEUE_URL, sqs_movies_requests)
 
-    # handle recurrent requests for older day's ranking
+    # top up the backfill work units in flight, each in its own message group
+    # so that the consumers of the FIFO queue take them in parallel
     sqs_ranking_requests = []
-    for i in range(recurrent_messages):
-        next_date = next_date_to_crawl - timedelta(days=i + 1)
+    for start, end in scheduler.schedule():
         request = {
-            "Id": next_date.isoformat(),
-            "MessageBody": json.dumps({"date": next_date.isoformat()}),
-            "MessageGroupId": "movie-etl",
+            "Id": f"{start.isoformat()}_{end.isoformat()}",
+            "MessageBody": json.dumps(
+                {"start": start.isoformat(), "end": end.isoformat()}
+            ),
+            "MessageGroupId": f"movie-etl-{start.isoformat()}",
             # default delay is 15 minutes
         }
         sqs_ranking_requests.append(request)
@@ -185,23 +218,152 @@ def lambda_handler(event, context):
     return {"statusCode": 200}
 
 
+def store_ranking(d: date, movies: list) -> bool:
+    """Put the ranking of d in S3, unless the stored one has the same rows
+    Returns:
+        False if the ranking is unchanged and nothing was written.
+    """
+    file_name = f"{RANKING_FOLDER}/{d.isoformat()}.{FILE_EXTENSION}"
+    digest = content_hash(movies)
+    try:
+        if storage.head(file_name).metadata.get("content-hash") == digest:
+            print(f"{d.isoformat()}.{FILE_EXTENSION} is unchanged")
+            metrics.count("rankings.unchanged")
+            return False
+    except NoSuchKey:
+        pass
+
+    my_print(f"Save rankings in S3 as {d.isoformat()}.{FILE_EXTENSION}")
+    # convert List[Movie] to writable bytes in {FILE_EXTENSION} format
+    with metrics.span("encode"):
+        writable = compress(encoder.encode_ranking(movies))
+
+    # Save to S3
+    storage.put(
+        file_name,
+        writable,
+        metadata={"content-hash": digest},
+        content_encoding=content_encoding(),
+    )
+    metrics.count("rankings.stored")
+    print(f"Complete upload {d.isoformat()}.{FILE_EXTENSION}")
+
+    # shards only exist for finished months, packed again without this day
+    today = date.today()
+    if (d.year, d.month) < (today.year, today.month):
+        invalidate(storage, ARCHIVE_FOLDER, d)
+    return True
+
+
+@metrics.timed("reconcile")
+def reconcile_movie(movie, batch_id):
+    """Bring {movie.id} in S3 up to date with the crawled records of movie
+    Returns:
+        (SQS request for crawling the detail or None,
+         new ManifestEntry of the movie or None if unchanged,
+         list of log lines,
+         False if the movie failed, the error is logged)
+    """
+    logs = []
+    try:
+        file_name = f"{MOVIES_FOLDER}/{movie.id}.{FILE_EXTENSION}"
+
+        entry = manifest.get(movie.id)
+
+        # movies not in the manifest yet fall back to the object's metadata,
+        # the entry found this way is then recorded into the manifest
+        found = None
+        if entry is None:
+            object_head = storage.head(file_name)
+            nth_day = int(object_head.metadata["newest-nth-day"])
+            entry = found = ManifestEntry(newest_nth_day=nth_day, etag=object_head.etag)
+
+        if entry.newest_nth_day >= movie.newest_nth_day():
+            # no need to update the movie
+            metrics.count("movies.unchanged")
+            return None, found, logs, True
+
+        if MOVIE_UPDATE_MODE == "delta":
+            # the compaction handler folds it into the movie object later
+            write_delta(storage, DELTAS_FOLDER, FILE_EXTENSION, movie, batch_id)
+            entry = ManifestEntry(
+                newest_nth_day=movie.newest_nth_day(),
+                release_date=entry.release_date,
+                etag=entry.etag,
+            )
+            metrics.count("movies.delta_written")
+            return None, entry, logs, True
+
+        movie_obj = None
+
+        def merge(body: bytes) -> tuple[bytes, dict]:
+            # read again when the PUT loses against a concurrent write, e.g. a
+            # refresh by movie_handler, whose days would be overwritten
+            nonlocal movie_obj
+            if body is None:
+                raise NoSuchKey(file_name)
+
+            # deserialize into a Movie object
+            with metrics.span("decode"):
+                movie_obj = encoder.decode_movie(body)
+
+            # combine with crawled movie
+            movie_obj.merge_records(movie.revenues)
+
+            with metrics.span("encode"):
+                writable = compress(encoder.encode_movie(movie_obj))
+            metadata = {
+                "newest-nth-day": str(movie_obj.newest_nth_day()),
+                "content-hash": content_hash([movie_obj]),
+            }
+            return writable, metadata
+
+        # put movie_obj back to S3, conditional on the object read
+        etag = conditional_update(
+            storage, file_name, merge, content_encoding=content_encoding()
+        )
+        entry = ManifestEntry(
+            newest_nth_day=movie_obj.newest_nth_day(),
+            release_date=movie_obj.release_date.isoformat(),
+            etag=etag,
+        )
+        metrics.count("movies.merged")
+
+    except NoSuchKey:
+        # Movie {movie.title} does not exist in S3 yet,
+        # construct a SQS request for crawl the detail
+        if DEBUG:
+            logs.append(
+                f"Movie {movie.title} does not exist in S3, prepare new crawler job"
+            )
+
+        # prepare SQS message, with 0 second delay
+        metrics.count("movies.new")
+        request = {
+            "Id": movie.id,
+            "MessageBody": json.dumps({"id": movie.id}),
+        }
+        return request, None, logs, True
+
+    except Exception as err:
+        metrics.count("movies.failed")
+        logs.append(f"Unexpected {err=}, {type(err)=} for movie {movie.id}")
+        return None, None, logs, False
+
+    return None, entry, logs, True
+
+
 # A wrapper for sending sqs requests
 def send_sqs_requests(url, requests):
-    global sqs_clent
-
     if len(requests) > 0:
         for n in range(0, len(requests), SQS_BATCH_LIMIT):
             entries = requests[n : n + SQS_BATCH_LIMIT]
 
-            # response is dict type
-            response = sqs_clent.send_message_batch(
-                QueueUrl=url,
-                Entries=entries,
-            )
+            failed = queue.send_batch(url, entries)
 
             # handle response result
-            if "Failed" in response:
-                for failed_message in response["Failed"]:
+            if len(failed) > 0:
+                for failed_message in failed:
                     print(
                         f"requesst id={failed_message['Id']} failed, \
                             code={failed_message['Code']}, \
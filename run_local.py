@@ -0,0 +1,245 @@
+""" Run the handlers on a laptop, without AWS.
+
+The objects and queues live in env "local_storage_dir" (default .local), see
+src/backends/local.py. Usage:
+
+    python run_local.py ranking [event.json]    defaults to example_input.json
+    python run_local.py movies                  drain the local movies queue
+    python run_local.py compaction
+    python run_local.py index                   rebuild the movie index from
+                                                the stored movies
+    python run_local.py serve [PORT]            query API, see src/server.py
+    python run_local.py backfill START END      crawl and store the rankings of
+                                                a date range on every core
+    python run_local.py reprocess START END     rebuild the stored movies
+                        [--fresh]               ranked in a date range from the
+                                                stored rankings, the movies not
+                                                stored are queued for a crawl
+    python run_local.py aggregates START END    apply the stored rankings of a
+                                                date range to the aggregates
+"""
+import os
+import sys
+import json
+
+# defaults of the Lambda configuration, any already set env wins
+LOCAL_ENV = {
+    "storage_backend": "local",
+    "local_storage_dir": ".local",
+    "ranking_folder_prefix": "ranking",
+    "movies_folder_prefix": "movies",
+    "sqs_ranking_queue_url": "local://queues/ranking",
+    "sqs_movies_queue_url": "local://queues/movies",
+    "file_extension": "json",
+    "uuid_ns_base": "6ba7b810-9dad-11d1-80b4-00c04fd430c8",
+}
+
+# rankings applied to the yearly aggregates at once, one conditional PUT each
+AGGREGATES_BATCH_DAYS = 31
+
+
+def ingest_in_batches(aggregates, rankings) -> int:
+    """Apply (date, movies) to the aggregates AGGREGATES_BATCH_DAYS at a time
+    Returns:
+        The number of rankings.
+    """
+    count, batch = 0, dict()
+    for d, movies in rankings:
+        batch[d] = movies
+        count += 1
+        if len(batch) >= AGGREGATES_BATCH_DAYS:
+            aggregates.ingest(batch)
+            batch = dict()
+    aggregates.ingest(batch)
+    return count
+
+
+def run_ranking(event_file: str = "example_input.json"):
+    import ranking_handler
+
+    with open(event_file, "r", encoding="utf-8") as f:
+        event = json.load(f)
+    return ranking_handler.lambda_handler(event, None)
+
+
+def run_movies():
+    """Feed the pending messages of the movies queue to movie_handler, in
+    batches of 10 like the SQS trigger, deleting the handled messages.
+    """
+    import movie_handler
+    from src.backends import get_queue
+
+    queue = get_queue()
+    url = os.environ["sqs_movies_queue_url"]
+    while True:
+        records = queue.receive(url, max_messages=10)
+        if len(records) == 0:
+            break
+        response = movie_handler.lambda_handler({"Records": records}, None)
+
+        # like SQS, failed messages stay in the queue to be retried
+        failed = {item["itemIdentifier"] for item in response["batchItemFailures"]}
+        queue.delete_batch(
+            url,
+            [
+                {"Id": record["messageId"], "ReceiptHandle": record["receiptHandle"]}
+                for record in records
+                if record["messageId"] not in failed
+            ],
+        )
+        if len(failed) == len(records):
+            print(f"{len(failed)} messages keep failing, stop")
+            break
+
+
+def run_backfill(start: str, end: str):
+    """Store the rankings from start to end, newest first, the pages are parsed
+    by a process pool, see src/pipeline.py
+    """
+    from datetime import date
+
+    import ranking_handler
+    from src.pipeline import pipeline_daily_rankings
+
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+
+    def stored():
+        for d, movies in pipeline_daily_rankings(max(start, end), min(start, end)):
+            ranking_handler.store_ranking(d, movies)
+            yield d, movies
+
+    # the scheduler never crawls the stored dates again, nor ingests them
+    ingest_in_batches(ranking_handler.aggregates, stored())
+
+
+def run_reprocess(start: str, end: str, *flags: str):
+    """Rebuild the movies from the stored rankings on every core, see
+    src/reprocess.py, and queue the movies ranked but not stored
+    """
+    from datetime import date
+
+    from src.backends import get_storage, get_queue
+    from src.manifest import Manifest
+    from src.indexes import MovieIndex
+    from src.reprocess import reprocess_movies
+
+    storage = get_storage()
+    counts, missing = reprocess_movies(
+        storage,
+        os.environ["ranking_folder_prefix"],
+        os.environ.get("archive_folder_prefix", "archive"),
+        os.environ["movies_folder_prefix"],
+        os.environ["file_extension"],
+        date.fromisoformat(start),
+        date.fromisoformat(end),
+        manifest=Manifest(storage, os.environ.get("manifest_key", "manifest.json")),
+        index=MovieIndex(storage, os.environ.get("index_key", "indexes/movies.json")),
+        fresh="--fresh" in flags,
+    )
+
+    # sqs batch requests allow 10 messages at most
+    queue = get_queue()
+    for n in range(0, len(missing), 10):
+        queue.send_batch(
+            os.environ["sqs_movies_queue_url"],
+            [
+                {"Id": id, "MessageBody": json.dumps({"id": id})}
+                for id in missing[n : n + 10]
+            ],
+        )
+    return f"rebuilt movies {counts}, {len(missing)} not stored are queued"
+
+
+def run_aggregates(start: str, end: str):
+    """Apply the stored rankings from start to end to the yearly aggregates,
+    e.g. for dates stored before the aggregates existed. Dates applied already
+    are skipped, see src/aggregates.py
+    """
+    from datetime import date
+
+    from src import archive
+    from src.backends import get_storage
+    from src.aggregates import Aggregates
+
+    storage = get_storage()
+    aggregates = Aggregates(
+        storage,
+        os.environ.get("aggregates_folder_prefix", "aggregates"),
+        top_n=int(os.environ.get("aggregates_top_n", "100")),
+    )
+    rankings = archive.read_rankings(
+        storage,
+        os.environ["ranking_folder_prefix"],
+        os.environ.get("archive_folder_prefix", "archive"),
+        date.fromisoformat(start),
+        date.fromisoformat(end),
+    )
+    return f"applied {ingest_in_batches(aggregates, rankings)} rankings"
+
+
+def run_index():
+    from src.backends import get_storage
+    from src.indexes import rebuild
+
+    key = os.environ.get("index_key", "indexes/movies.json")
+    count = rebuild(get_storage(), os.environ["movies_folder_prefix"], key)
+    return f"indexed {count} movies in {key}"
+
+
+def run_serve(port: str = "8080"):
+    from src.backends import get_storage
+    from src.query import QueryService, ObjectCache
+    from src.server import make_server
+
+    storage = get_storage()
+    cache = ObjectCache(
+        storage,
+        max_bytes=int(os.environ.get("query_cache_bytes", str(64 << 20))),
+        revalidate_seconds=float(os.environ.get("query_revalidate_seconds", "30")),
+    )
+    deltas_prefix = None
+    if os.environ.get("movie_update_mode", "merge") == "delta":
+        deltas_prefix = os.environ.get("deltas_folder_prefix", "deltas")
+    service = QueryService(
+        storage,
+        os.environ["ranking_folder_prefix"],
+        os.environ["movies_folder_prefix"],
+        os.environ.get("archive_folder_prefix", "archive"),
+        os.environ["file_extension"],
+        cache=cache,
+        deltas_prefix=deltas_prefix,
+    )
+    server = make_server(service, port=int(port))
+    print(f"serving on http://127.0.0.1:{port}/")
+    server.serve_forever()
+
+
+def run_compaction():
+    import compaction_handler
+
+    return compaction_handler.lambda_handler({}, None)
+
+
+if __name__ == "__main__":
+    for name, value in LOCAL_ENV.items():
+        os.environ.setdefault(name, value)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "ranking"
+    if command == "ranking":
+        print(run_ranking(*sys.argv[2:3]))
+    elif command == "movies":
+        run_movies()
+    elif command == "backfill" and len(sys.argv) == 4:
+        run_backfill(*sys.argv[2:4])
+    elif command == "compaction":
+        print(run_compaction())
+    elif command == "index":
+        print(run_index())
+    elif command == "aggregates" and len(sys.argv) == 4:
+        print(run_aggregates(*sys.argv[2:4]))
+    elif command == "reprocess" and len(sys.argv) >= 4:
+        print(run_reprocess(*sys.argv[2:]))
+    elif command == "serve":
+        run_serve(*sys.argv[2:3])
+    else:
+        sys.exit(__doc__)
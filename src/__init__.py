@@ -1 +1 @@
-__all__ = ["crawler", "record", "encoders"]
\ No newline at end of file
+__all__ = ["crawler", "record", "columnar", "encoders", "parsers"]
\ No newline at end of file
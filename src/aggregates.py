@@ -0,0 +1,224 @@
+""" Materialized aggregates of the daily rankings, maintained at ingest.
+
+One json object per year, {prefix}/{year}.json, answers the usual questions
+with a single GET instead of loading every movie:
+    {
+        "days": {"2023-08-17": {"hash": "...", "revenues": {id: 3875814}}},
+        "movies": {id: {"title", "distributor", "gross", "days"}},
+        "distributors": {name: {"daily": {"2023-08-17": ...},
+                                "monthly": {"2023-08": ...}}},
+        "top": [{"id", "title", "distributor", "gross"}, ...]
+    }
+
+Totals add up the daily revenues of the rankings, i.e. the days a movie was
+in the daily chart. "days" is the ledger of what every date contributed, so
+ingesting a date again is idempotent: an unchanged ranking (same content
+hash) is skipped, a changed one has its previous contribution subtracted
+before the new one is added.
+
+Objects are cached with their etag by the warm container, refreshed with a
+conditional GET and written with a conditional PUT, retried on conflicts like
+the manifest.
+"""
+import json
+import threading
+from datetime import date
+
+from src import metrics
+from src.record import Movie, content_hash
+from src.backends import ObjectStore, get_if_changed, conditional_update
+
+# movies without a distributor in the ranking, which the parsers mark "None"
+UNKNOWN_DISTRIBUTOR = "unknown"
+MISSING_DISTRIBUTORS = (None, "", "None")
+
+
+def empty_document() -> dict:
+    return {"days": dict(), "movies": dict(), "distributors": dict(), "top": []}
+
+
+def apply_day(document: dict, d: date, movies: list[Movie], digest: str) -> bool:
+    """Replace the contribution of date d in a year document by movies
+    Returns:
+        False if d was ingested with the same content hash already.
+    """
+    day, month = d.isoformat(), d.strftime("%Y-%m")
+    previous = document["days"].get(day)
+    if previous is not None and previous["hash"] == digest:
+        return False
+
+    if previous is not None:
+        for movie_id, revenue in previous["revenues"].items():
+            totals = document["movies"][movie_id]
+            totals["gross"] -= revenue
+            totals["days"] -= 1
+            if totals["days"] == 0:
+                del document["movies"][movie_id]
+        for name in list(document["distributors"]):
+            sums = document["distributors"][name]
+            revenue = sums["daily"].pop(day, None)
+            if revenue is None:
+                continue
+            sums["monthly"][month] -= revenue
+            if sums["monthly"][month] == 0:
+                del sums["monthly"][month]
+            if len(sums["daily"]) == 0:
+                del document["distributors"][name]
+
+    revenues = dict()
+    for movie in movies:
+        revenue = sum(r.revenue for r in movie.revenues.values())
+
+        totals = document["movies"].setdefault(movie.id, {"gross": 0, "days": 0})
+        totals["title"] = movie.title
+        totals["distributor"] = movie.distributor
+        totals["gross"] += revenue
+        if movie.id not in revenues:
+            totals["days"] += 1
+        revenues[movie.id] = revenues.get(movie.id, 0) + revenue
+
+        name = movie.distributor
+        if name in MISSING_DISTRIBUTORS:
+            name = UNKNOWN_DISTRIBUTOR
+        sums = document["distributors"].setdefault(
+            name, {"daily": dict(), "monthly": dict()}
+        )
+        sums["daily"][day] = sums["daily"].get(day, 0) + revenue
+        sums["monthly"][month] = sums["monthly"].get(month, 0) + revenue
+
+    document["days"][day] = {"hash": digest, "revenues": revenues}
+    return True
+
+
+def rank_top(document: dict, n: int) -> list[dict]:
+    """The n movies of a year document with the highest gross"""
+    ranked = sorted(
+        document["movies"].items(), key=lambda item: (-item[1]["gross"], item[0])
+    )
+    return [
+        {
+            "id": movie_id,
+            "title": totals["title"],
+            "distributor": totals["distributor"],
+            "gross": totals["gross"],
+        }
+        for movie_id, totals in ranked[:n]
+    ]
+
+
+class Aggregates:
+    """The yearly aggregate objects under prefix
+    Args:
+        storage: where the objects are stored.
+        prefix: folder of the objects, {prefix}/{year}.json.
+        top_n: length of the leaderboard of every year.
+    """
+
+    def __init__(self, storage: ObjectStore, prefix: str, top_n: int = 100):
+        self.storage = storage
+        self.prefix = prefix
+        self.top_n = top_n
+
+        # year => (body, etag) of the objects read so far
+        self.cache: dict[int, tuple[bytes, str]] = dict()
+        self.lock = threading.Lock()
+
+    def key(self, year: int) -> str:
+        return f"{self.prefix}/{year}.json"
+
+    def load(self, year: int) -> tuple[dict, str]:
+        """Read the document of year, a no-op 304 when it did not change
+        Returns:
+            (document, etag or None if the object does not exist)
+        """
+        with self.lock:
+            body, etag = self.cache.get(year, (None, None))
+        loaded = get_if_changed(self.storage, self.key(year), etag)
+        if loaded is not None:
+            body, etag = loaded
+
+        with self.lock:
+            if etag is None:
+                self.cache.pop(year, None)
+            else:
+                self.cache[year] = (body, etag)
+        # parsed on every call, callers are free to modify it
+        return (json.loads(body) if body else empty_document()), etag
+
+    def ingest(self, rankings: dict[date, list[Movie]]) -> list[int]:
+        """Apply the rankings of several dates, one conditional PUT per year
+        whose document changed
+        Returns:
+            The years updated.
+        """
+        years = dict()
+        for d, movies in rankings.items():
+            years.setdefault(d.year, dict())[d] = movies
+
+        updated = []
+        for year, days in sorted(years.items()):
+            digests = {d: content_hash(movies) for d, movies in days.items()}
+            if self.update(year, days, digests):
+                updated.append(year)
+        return updated
+
+    def update(self, year: int, days: dict, digests: dict) -> bool:
+        writable, changed = None, []
+
+        def mutate(document: dict) -> bytes:
+            # applied again on the write of another handler after a conflict
+            nonlocal writable, changed
+            changed = [
+                d for d in sorted(days) if apply_day(document, d, days[d], digests[d])
+            ]
+            if len(changed) == 0:
+                return None
+            document["top"] = rank_top(document, self.top_n)
+            writable = json.dumps(document, separators=(",", ":")).encode("utf-8")
+            return writable
+
+        new_etag = conditional_update(
+            self.storage, self.key(year), mutate, lambda conflict: self.load(year)
+        )
+        if new_etag is None:
+            metrics.count("aggregates.unchanged")
+            return False
+
+        with self.lock:
+            self.cache[year] = (writable, new_etag)
+        metrics.count("aggregates.days", len(changed))
+        return True
+
+    def top(self, year: int, n: int = None) -> list[dict]:
+        """Leaderboard of year, {"id", "title", "distributor", "gross"}"""
+        document, _ = self.load(year)
+        return document["top"][:n]
+
+    def distributor_totals(self, year: int, month: int = None) -> dict[str, int]:
+        """Gross of every distributor in year, or in one month of it"""
+        document, _ = self.load(year)
+        totals = dict()
+        for name, sums in document["distributors"].items():
+            if month is None:
+                total = sum(sums["monthly"].values())
+            else:
+                total = sums["monthly"].get(f"{year}-{month:02}", 0)
+            if total != 0:
+                totals[name] = total
+        return totals
+
+    def market_share(self, year: int, month: int = None) -> dict[str, float]:
+        """Share of the gross of every distributor in year or one month"""
+        totals = self.distributor_totals(year, month)
+        gross = sum(totals.values())
+        return {name: total / gross for name, total in totals.items()} if gross else {}
+
+    def movie_gross(self, movie_id: str, years: list[int]) -> int:
+        """Cumulative gross of movie_id over years, e.g. its release year and
+        the next one
+        """
+        gross = 0
+        for year in years:
+            document, _ = self.load(year)
+            gross += document["movies"].get(movie_id, {}).get("gross", 0)
+        return gross
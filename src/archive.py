@@ -0,0 +1,284 @@
+""" Monthly and yearly shards of the daily ranking files, for range reads.
+
+ranking_handler keeps writing one file per day, {ranking_prefix}/{date}.{ext}.
+pack_closed() rolls the days of every finished month and year into a shard,
+{archive_prefix}/2023-08.shard and {archive_prefix}/2023.shard, made of:
+
+    b"MSHD" | index length (4 bytes, big endian) | index json | daily files
+
+The index maps each date to the [offset, length, extension, etag] of its
+file after the index, days are in date order. The daily files are copied as they
+are stored, so they are decoded (and decompressed) by their own codec.
+
+read_rankings() reads any date range with two ranged reads per shard: the
+head of the shard with its index, then the contiguous bytes of the dates
+asked for. Days without a shard, e.g. the current month, are read from their
+daily file.
+
+Writing a daily file of a packed period deletes its shards (invalidate()),
+the next pack_closed() packs them again. A day rewritten while its period is
+being packed may be invalidated before the shard exists, so pack() checks
+the etags of the daily files it packed once the shard is written, and
+deletes the shard if one changed.
+"""
+import json
+import struct
+from datetime import date, timedelta
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from src import metrics
+from src.record import Movie
+from src.backends import ObjectStore, NoSuchKey
+from src.encoders import get_encoder
+from src.scheduler import DATE_PATTERN
+
+MAGIC = b"MSHD"
+HEADER = struct.Struct(">4sI")
+
+# first ranged read of a shard, enough for the index of a yearly shard
+HEAD_BYTES = 32 * 1024
+
+# daily files read at the same time while packing
+PACK_WORKERS = 16
+
+
+def build_shard(days: dict[date, tuple[bytes, str, str]]) -> bytes:
+    """Pack daily files into a shard
+    Args:
+        days: date => (stored bytes, file extension, etag).
+    """
+    index, offset = dict(), 0
+    for d in sorted(days):
+        body, extension, etag = days[d]
+        index[d.isoformat()] = [offset, len(body), extension, etag]
+        offset += len(body)
+
+    writable = json.dumps({"days": index}, separators=(",", ":")).encode("utf-8")
+    parts = [HEADER.pack(MAGIC, len(writable)), writable]
+    parts.extend(days[d][0] for d in sorted(days))
+    return b"".join(parts)
+
+
+def shard_key(archive_prefix: str, period: str) -> str:
+    """Key of the shard of a period, "2023-08" or "2023" """
+    return f"{archive_prefix}/{period}.shard"
+
+
+def read_index(storage: ObjectStore, key: str) -> tuple[dict, int, bytes]:
+    """Read the index of the shard at key
+    Returns:
+        (date => [offset, length, extension, etag], offset of the first
+         daily file,
+         the bytes read so far from that offset)
+    Raises:
+        NoSuchKey.
+    """
+    head = storage.get(key, byte_range=(0, HEAD_BYTES - 1)).body
+    magic, length = HEADER.unpack_from(head)
+    if magic != MAGIC:
+        raise ValueError(f"{key} is not a ranking shard")
+
+    start = HEADER.size + length
+    if len(head) < start:
+        head += storage.get(key, byte_range=(len(head), start - 1)).body
+    index = json.loads(head[HEADER.size : start])["days"]
+    return index, start, head[start:]
+
+
+def read_shard(
+    storage: ObjectStore, key: str, start: date, end: date
+) -> dict[date, list[Movie]]:
+    """Rankings of the dates from start to end found in the shard at key
+    Raises:
+        NoSuchKey if there is no shard.
+    """
+    index, data_start, read = read_index(storage, key)
+    wanted = [
+        (date.fromisoformat(d), entry)
+        for d, entry in index.items()
+        if start.isoformat() <= d <= end.isoformat()
+    ]
+    if len(wanted) == 0:
+        return dict()
+
+    # days are in date order, the range is one contiguous read. The bytes
+    # after the index in the first read are used when they go far enough
+    first = min(entry[0] for _, entry in wanted)
+    last = max(entry[0] + entry[1] for _, entry in wanted)
+    base = 0
+    if last > len(read):
+        if first >= len(read):
+            read, base = b"", first
+        body = storage.get(
+            key, byte_range=(data_start + base + len(read), data_start + last - 1)
+        ).body
+        read += body
+
+    rankings = dict()
+    for d, (offset, length, extension, *_) in wanted:
+        with metrics.span("decode"):
+            rankings[d] = get_encoder(extension).decode_ranking(
+                read[offset - base : offset - base + length]
+            )
+    return rankings
+
+
+def read_rankings(
+    storage: ObjectStore,
+    ranking_prefix: str,
+    archive_prefix: str,
+    start: date,
+    end: date,
+) -> Iterator[tuple[date, list[Movie]]]:
+    """Rankings of every stored date from start to end, both inclusive
+    Yields:
+        (date, list[Movie]) in date order, dates not stored are skipped.
+    """
+    d = start
+    while d <= end:
+        # the yearly shard when more than a month of the year is read
+        year_end = min(end, date(d.year, 12, 31))
+        if d.month != year_end.month:
+            period, period_end = str(d.year), year_end
+        else:
+            period, period_end = d.strftime("%Y-%m"), min(end, month_end(d))
+
+        try:
+            key = shard_key(archive_prefix, period)
+            found = read_shard(storage, key, d, period_end)
+        except NoSuchKey:
+            found = dict()
+        if len(found) == 0 and len(period) == 4:
+            # no yearly shard yet, try the months
+            period_end = min(end, month_end(d))
+            try:
+                key = shard_key(archive_prefix, d.strftime("%Y-%m"))
+                found = read_shard(storage, key, d, period_end)
+            except NoSuchKey:
+                found = dict()
+
+        daily = None
+        while d <= period_end:
+            if d in found:
+                yield d, found[d]
+            else:
+                if daily is None:
+                    daily = daily_keys(storage, ranking_prefix, d, period_end)
+                if d in daily:
+                    obj = storage.get(daily[d])
+                    with metrics.span("decode"):
+                        encoder = get_encoder(daily[d].rsplit(".", 1)[-1])
+                        yield d, encoder.decode_ranking(obj.body)
+            d += timedelta(days=1)
+
+
+def daily_keys(
+    storage: ObjectStore, ranking_prefix: str, start: date, end: date
+) -> dict[date, str]:
+    """Keys of the daily files from start to end, listed once per month"""
+    keys = dict()
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        for key in storage.list_keys(f"{ranking_prefix}/{month.strftime('%Y-%m')}"):
+            match = DATE_PATTERN.search(key)
+            if match:
+                keys[date.fromisoformat(match.group(1))] = key
+        month = month_end(month) + timedelta(days=1)
+    return keys
+
+
+def month_end(d: date) -> date:
+    following = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+    return following - timedelta(days=1)
+
+
+def pack(
+    storage: ObjectStore, ranking_prefix: str, archive_prefix: str, period: str
+) -> bool:
+    """Write the shard of period ("2023-08" or "2023") from its daily files
+    Returns:
+        False if the period has no daily file, or a daily file changed while
+        packing and the shard was deleted.
+    """
+    keys = [
+        key
+        for key in storage.list_keys(f"{ranking_prefix}/{period}")
+        if DATE_PATTERN.search(key)
+    ]
+    if len(keys) == 0:
+        return False
+
+    with ThreadPoolExecutor(max_workers=PACK_WORKERS) as executor:
+        objects = list(executor.map(storage.get, keys))
+
+    days = {
+        date.fromisoformat(DATE_PATTERN.search(obj.key).group(1)): (
+            obj.body,
+            obj.key.rsplit(".", 1)[-1],
+            obj.etag,
+        )
+        for obj in objects
+    }
+    key = shard_key(archive_prefix, period)
+    storage.put(key, build_shard(days))
+
+    # a day rewritten after it was read may have been invalidated before the
+    # shard was written, only the etags tell
+    def etag(daily_key: str) -> str:
+        try:
+            return storage.head(daily_key).etag
+        except NoSuchKey:
+            return None
+
+    with ThreadPoolExecutor(max_workers=PACK_WORKERS) as executor:
+        etags = list(executor.map(etag, keys))
+    if etags != [obj.etag for obj in objects]:
+        storage.delete([key])
+        metrics.count("archive.pack_conflicts")
+        return False
+    metrics.count("archive.packed")
+    return True
+
+
+
+def pack_closed(
+    storage: ObjectStore, ranking_prefix: str, archive_prefix: str, today: date = None
+) -> list[str]:
+    """Pack every month and year before today that has daily files but no
+    shard, see invalidate()
+    Returns:
+        The periods whose shard was written.
+    """
+    today = today if today is not None else date.today()
+    periods = set()
+    for key in storage.list_keys(f"{ranking_prefix}/"):
+        match = DATE_PATTERN.search(key)
+        if match is None:
+            continue
+        d = date.fromisoformat(match.group(1))
+        if (d.year, d.month) < (today.year, today.month):
+            periods.add(d.strftime("%Y-%m"))
+        if d.year < today.year:
+            periods.add(str(d.year))
+
+    packed = set(storage.list_keys(f"{archive_prefix}/"))
+    return [
+        period
+        for period in sorted(periods)
+        if shard_key(archive_prefix, period) not in packed
+        and pack(storage, ranking_prefix, archive_prefix, period)
+    ]
+
+
+def invalidate(storage: ObjectStore, archive_prefix: str, d: date):
+    """Delete the shards holding d, after its daily file was written. They
+    are packed again by the next pack_closed(), reads use the daily files
+    meanwhile
+    """
+    storage.delete(
+        [
+            shard_key(archive_prefix, d.strftime("%Y-%m")),
+            shard_key(archive_prefix, str(d.year)),
+        ]
+    )
@@ -0,0 +1,78 @@
+""" Storage and queue backends of the handlers.
+
+env "storage_backend" picks the implementation:
+    s3      S3 bucket "bucket_name" and SQS (default)
+    local   a directory "local_storage_dir", see local.py
+    memory  process wide in-memory objects and queues, see memory.py
+"""
+import os
+
+from .base import (
+    ObjectStore,
+    MessageQueue,
+    StoredObject,
+    NoSuchKey,
+    NotModified,
+    PreconditionFailed,
+)
+from .conditional import UPDATE_RETRIES, get_if_changed, conditional_update
+
+__all__ = ["base", "s3", "local", "memory"]
+
+BACKENDS = ("s3", "local", "memory")
+
+# the memory backend is shared by every handler of the process
+_memory_storage = None
+_memory_queue = None
+
+
+def _backend(backend: str) -> str:
+    if backend is None:
+        backend = os.environ.get("storage_backend", "s3")
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend}, expect one of {BACKENDS}")
+    return backend
+
+
+def get_storage(backend: str = None, **kwargs) -> ObjectStore:
+    """Build the ObjectStore of backend, defaults to env "storage_backend"
+    kwargs are passed to the S3ObjectStore, e.g. max_pool_connections.
+    """
+    global _memory_storage
+    backend = _backend(backend)
+
+    if backend == "s3":
+        from .s3 import S3ObjectStore
+
+        return S3ObjectStore(os.environ["bucket_name"], **kwargs)
+    if backend == "local":
+        from .local import LocalObjectStore
+
+        return LocalObjectStore(os.environ.get("local_storage_dir", ".local"))
+
+    from .memory import MemoryObjectStore
+
+    if _memory_storage is None:
+        _memory_storage = MemoryObjectStore()
+    return _memory_storage
+
+
+def get_queue(backend: str = None) -> MessageQueue:
+    """Build the MessageQueue of backend, defaults to env "storage_backend" """
+    global _memory_queue
+    backend = _backend(backend)
+
+    if backend == "s3":
+        from .s3 import SQSQueue
+
+        return SQSQueue()
+    if backend == "local":
+        from .local import LocalQueue
+
+        return LocalQueue(os.environ.get("local_storage_dir", ".local"))
+
+    from .memory import MemoryQueue
+
+    if _memory_queue is None:
+        _memory_queue = MemoryQueue()
+    return _memory_queue
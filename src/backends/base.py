@@ -0,0 +1,109 @@
+""" Interfaces of the object storage and the message queue used by the handlers """
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+
+class NoSuchKey(Exception):
+    """The object does not exist"""
+
+
+class NotModified(Exception):
+    """A conditional get found the object unchanged"""
+
+
+class PreconditionFailed(Exception):
+    """A conditional put lost against a concurrent writer"""
+
+
+@dataclass
+class StoredObject:
+    key: str
+    etag: str
+    size: int
+    metadata: dict = field(default_factory=dict)
+    content_encoding: str = None
+    body: bytes = None  # None for the result of head(), only the range if any
+
+
+class ObjectStore(ABC):
+    """A flat key => bytes storage, S3 semantics"""
+
+    @abstractmethod
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        metadata: dict = None,
+        content_encoding: str = None,
+        if_match: str = None,
+        if_none_match: str = None,
+    ) -> str:
+        """Write body at key
+        Args:
+            if_match: only write if the current etag is this one.
+            if_none_match: "*" to only write if the key does not exist.
+        Returns:
+            The etag of the new object.
+        Raises:
+            PreconditionFailed if a condition does not hold.
+        """
+
+    @abstractmethod
+    def get(
+        self, key: str, if_none_match: str = None, byte_range: tuple = None
+    ) -> StoredObject:
+        """Read the object at key
+        Args:
+            byte_range: (first, last) to only read these bytes, both inclusive
+                like an HTTP Range. size is still the size of the whole object.
+        Raises:
+            NoSuchKey, or NotModified if its etag is if_none_match.
+        """
+
+    @abstractmethod
+    def head(self, key: str) -> StoredObject:
+        """Read the object at key without its body
+        Raises:
+            NoSuchKey.
+        """
+
+    @abstractmethod
+    def list_keys(self, prefix: str) -> list[str]:
+        """Every key starting with prefix, in lexicographic order"""
+
+    def list_prefixes(self, prefix: str, delimiter: str = "/") -> list[str]:
+        """The distinct "folders" right under prefix, like "deltas/rl1/" """
+        folders = dict()
+        for key in self.list_keys(prefix):
+            i = key.find(delimiter, len(prefix))
+            if i >= 0:
+                folders[key[: i + 1]] = None
+        return list(folders)
+
+    @abstractmethod
+    def delete(self, keys: list[str]):
+        """Delete every key, missing keys are ignored"""
+
+
+class MessageQueue(ABC):
+    """Message queues addressed by url, SQS semantics"""
+
+    @abstractmethod
+    def send_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        """Send entries like {"Id": ..., "MessageBody": ...}
+        Returns:
+            The failed entries, {"Id", "Code", "Message"}.
+        """
+
+    @abstractmethod
+    def delete_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        """Delete received messages, entries like {"Id": ..., "ReceiptHandle": ...}
+        Returns:
+            The failed entries, {"Id", "Code", "Message"}.
+        """
+
+    @abstractmethod
+    def receive(self, url: str, max_messages: int = 10) -> list[dict]:
+        """Receive messages in the shape of the records of a Lambda SQS event,
+        {"messageId", "receiptHandle", "body"}
+        """
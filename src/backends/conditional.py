@@ -0,0 +1,76 @@
+""" Read-modify-write of a single object with conditional requests.
+
+The manifest, the movie index, the yearly aggregates and the backfill
+checkpoint are single objects updated by several containers at once. They are
+read with their etag, changed in memory and written back with If-Match on that
+etag (If-None-Match: * if the object did not exist), so that a concurrent
+writer makes the PUT fail with PreconditionFailed instead of being
+overwritten. The update is then applied again on the new version.
+"""
+from .base import ObjectStore, NoSuchKey, NotModified, PreconditionFailed
+
+# how many times a conflicting update is retried
+UPDATE_RETRIES = 5
+
+
+def get_if_changed(
+    storage: ObjectStore, key: str, etag: str = None
+) -> tuple[bytes, str]:
+    """Read key, a no-op 304 when its etag is still etag
+    Returns:
+        (body, etag), (None, None) if the object does not exist, None if it is
+        unchanged.
+    """
+    try:
+        obj = storage.get(key, if_none_match=etag)
+    except NotModified:
+        return None
+    except NoSuchKey:
+        return None, None
+    return obj.body, obj.etag
+
+
+def conditional_update(
+    storage: ObjectStore, key: str, mutate, load=None, content_encoding: str = None
+) -> str:
+    """Apply mutate to the object at key, retried while concurrent writers win
+    Args:
+        mutate: called with the current version, returns the bytes to write,
+            or (bytes, metadata of the object), None to leave the object as it
+            is.
+        load: called with conflict=True after a lost PUT, False before the
+            first one, returns (current version, its etag or None if absent).
+            Callers keeping the object in memory refresh it there, defaults to
+            a GET of the body.
+    Returns:
+        The etag written, None if mutate returned None.
+    Raises:
+        RuntimeError after UPDATE_RETRIES conflicts.
+    """
+
+    def get(conflict: bool) -> tuple[bytes, str]:
+        return get_if_changed(storage, key)
+
+    load = get if load is None else load
+    for attempt in range(UPDATE_RETRIES):
+        current, etag = load(attempt > 0)
+        writable = mutate(current)
+        if writable is None:
+            return None
+        metadata = None
+        if isinstance(writable, tuple):
+            writable, metadata = writable
+        try:
+            return storage.put(
+                key,
+                writable,
+                metadata=metadata,
+                content_encoding=content_encoding,
+                if_match=etag,
+                if_none_match="*" if etag is None else None,
+            )
+        except PreconditionFailed:
+            # someone else updated the object in between
+            continue
+
+    raise RuntimeError(f"failed to update {key} after retries")
@@ -0,0 +1,176 @@
+""" ObjectStore and MessageQueue on a local directory, to run the handlers on a
+laptop without AWS.
+
+Layout under the root directory:
+    objects/{key}           object bodies
+    meta/{key}.json         etag, metadata and content encoding of the object
+    queues/{name}.json      pending messages of the queue, name is the last
+                            path segment of the queue url
+
+Conditional writes are only atomic within one process.
+"""
+import os
+import json
+import uuid
+import tempfile
+import threading
+
+from .base import (
+    ObjectStore,
+    MessageQueue,
+    StoredObject,
+    NoSuchKey,
+    NotModified,
+)
+from .memory import make_etag, check_preconditions
+
+
+def write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class LocalObjectStore(ObjectStore):
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.root, "objects", *key.split("/"))
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.root, "meta", *key.split("/")) + ".json"
+
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        metadata: dict = None,
+        content_encoding: str = None,
+        if_match: str = None,
+        if_none_match: str = None,
+    ) -> str:
+        body = bytes(body)
+        etag = make_etag(body)
+        meta = {
+            "etag": etag,
+            "metadata": dict(metadata or {}),
+            "content_encoding": content_encoding,
+        }
+        with self.lock:
+            if if_match is not None or if_none_match is not None:
+                try:
+                    current = self.head(key)
+                except NoSuchKey:
+                    current = None
+                check_preconditions(current, if_match, if_none_match)
+
+            write_atomic(self._object_path(key), body)
+            write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+        return etag
+
+    def head(self, key: str) -> StoredObject:
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            size = os.path.getsize(self._object_path(key))
+        except FileNotFoundError:
+            raise NoSuchKey(key)
+
+        return StoredObject(
+            key=key,
+            etag=meta["etag"],
+            size=size,
+            metadata=meta["metadata"],
+            content_encoding=meta["content_encoding"],
+        )
+
+    def get(
+        self, key: str, if_none_match: str = None, byte_range: tuple = None
+    ) -> StoredObject:
+        obj = self.head(key)
+        if if_none_match is not None and obj.etag == if_none_match:
+            raise NotModified(key)
+
+        try:
+            with open(self._object_path(key), "rb") as f:
+                if byte_range is None:
+                    obj.body = f.read()
+                else:
+                    f.seek(byte_range[0])
+                    obj.body = f.read(byte_range[1] - byte_range[0] + 1)
+        except FileNotFoundError:
+            raise NoSuchKey(key)
+        return obj
+
+    def list_keys(self, prefix: str) -> list[str]:
+        base = os.path.join(self.root, "objects")
+        keys = []
+        for directory, _, files in os.walk(base):
+            relative = os.path.relpath(directory, base)
+            for name in files:
+                key = name if relative == "." else f"{relative}/{name}"
+                key = key.replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, keys: list[str]):
+        with self.lock:
+            for key in keys:
+                for path in (self._object_path(key), self._meta_path(key)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+
+class LocalQueue(MessageQueue):
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        return os.path.join(self.root, "queues", f"{name}.json")
+
+    def _load(self, url: str) -> list[dict]:
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save(self, url: str, messages: list[dict]):
+        write_atomic(self._path(url), json.dumps(messages, indent=2).encode("utf-8"))
+
+    def send_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        with self.lock:
+            messages = self._load(url)
+            for entry in entries:
+                message_id = str(uuid.uuid4())
+                messages.append(
+                    {
+                        "messageId": message_id,
+                        "receiptHandle": message_id,
+                        "body": entry["MessageBody"],
+                    }
+                )
+            self._save(url, messages)
+        return []
+
+    def delete_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        handles = {entry["ReceiptHandle"] for entry in entries}
+        with self.lock:
+            messages = self._load(url)
+            remaining = [m for m in messages if m["receiptHandle"] not in handles]
+            if len(remaining) != len(messages):
+                self._save(url, remaining)
+        return []
+
+    def receive(self, url: str, max_messages: int = 10) -> list[dict]:
+        # there is no visibility timeout, messages stay until deleted
+        return self._load(url)[:max_messages]
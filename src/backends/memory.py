@@ -0,0 +1,112 @@
+""" In-memory ObjectStore and MessageQueue, for tests and load testing """
+import uuid
+import hashlib
+import threading
+from dataclasses import replace
+
+from .base import (
+    ObjectStore,
+    MessageQueue,
+    StoredObject,
+    NoSuchKey,
+    NotModified,
+    PreconditionFailed,
+)
+
+
+def make_etag(body: bytes) -> str:
+    """Same as S3 for a single part upload, the quoted md5 of the body"""
+    return '"' + hashlib.md5(body).hexdigest() + '"'
+
+
+def check_preconditions(current: StoredObject, if_match: str, if_none_match: str):
+    if if_match is not None and (current is None or current.etag != if_match):
+        raise PreconditionFailed(if_match)
+    if if_none_match == "*" and current is not None:
+        raise PreconditionFailed(if_none_match)
+
+
+class MemoryObjectStore(ObjectStore):
+    def __init__(self):
+        self.objects: dict[str, StoredObject] = dict()
+        self.lock = threading.Lock()
+
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        metadata: dict = None,
+        content_encoding: str = None,
+        if_match: str = None,
+        if_none_match: str = None,
+    ) -> str:
+        body = bytes(body)
+        obj = StoredObject(
+            key=key,
+            etag=make_etag(body),
+            size=len(body),
+            metadata=dict(metadata or {}),
+            content_encoding=content_encoding,
+            body=body,
+        )
+        with self.lock:
+            check_preconditions(self.objects.get(key), if_match, if_none_match)
+            self.objects[key] = obj
+        return obj.etag
+
+    def get(
+        self, key: str, if_none_match: str = None, byte_range: tuple = None
+    ) -> StoredObject:
+        obj = self.objects.get(key)
+        if obj is None:
+            raise NoSuchKey(key)
+        if if_none_match is not None and obj.etag == if_none_match:
+            raise NotModified(key)
+        if byte_range is not None:
+            return replace(obj, body=obj.body[byte_range[0] : byte_range[1] + 1])
+        return obj
+
+    def head(self, key: str) -> StoredObject:
+        return replace(self.get(key), body=None)
+
+    def list_keys(self, prefix: str) -> list[str]:
+        return sorted(key for key in list(self.objects) if key.startswith(prefix))
+
+    def delete(self, keys: list[str]):
+        with self.lock:
+            for key in keys:
+                self.objects.pop(key, None)
+
+
+class MemoryQueue(MessageQueue):
+    def __init__(self):
+        self.messages: dict[str, list[dict]] = dict()  # url => messages
+        self.lock = threading.Lock()
+
+    def send_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        with self.lock:
+            queue = self.messages.setdefault(url, [])
+            for entry in entries:
+                message_id = str(uuid.uuid4())
+                queue.append(
+                    {
+                        "messageId": message_id,
+                        "receiptHandle": message_id,
+                        "body": entry["MessageBody"],
+                    }
+                )
+        return []
+
+    def delete_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        handles = {entry["ReceiptHandle"] for entry in entries}
+        with self.lock:
+            self.messages[url] = [
+                message
+                for message in self.messages.get(url, [])
+                if message["receiptHandle"] not in handles
+            ]
+        return []
+
+    def receive(self, url: str, max_messages: int = 10) -> list[dict]:
+        # there is no visibility timeout, messages stay until deleted
+        return list(self.messages.get(url, [])[:max_messages])
@@ -0,0 +1,68 @@
+""" Wrappers timing every storage and queue call into src.metrics """
+from src import metrics
+from .base import ObjectStore, MessageQueue, StoredObject
+
+
+class MeteredObjectStore(ObjectStore):
+    """Times the calls of storage as "storage.{method}" and counts the bytes
+    read and written
+    """
+
+    def __init__(self, storage: ObjectStore):
+        self.storage = storage
+
+    def put(self, key: str, body: bytes, **kwargs) -> str:
+        with metrics.span("storage.put"):
+            etag = self.storage.put(key, body, **kwargs)
+        metrics.count("storage.bytes_written", len(body), "Bytes")
+        return etag
+
+    def get(
+        self, key: str, if_none_match: str = None, byte_range: tuple = None
+    ) -> StoredObject:
+        with metrics.span("storage.get"):
+            obj = self.storage.get(
+                key, if_none_match=if_none_match, byte_range=byte_range
+            )
+        metrics.count("storage.bytes_read", len(obj.body), "Bytes")
+        return obj
+
+    def head(self, key: str) -> StoredObject:
+        with metrics.span("storage.head"):
+            return self.storage.head(key)
+
+    def list_keys(self, prefix: str) -> list[str]:
+        with metrics.span("storage.list"):
+            return self.storage.list_keys(prefix)
+
+    def list_prefixes(self, prefix: str, delimiter: str = "/") -> list[str]:
+        with metrics.span("storage.list"):
+            return self.storage.list_prefixes(prefix, delimiter)
+
+    def delete(self, keys: list[str]):
+        with metrics.span("storage.delete"):
+            self.storage.delete(keys)
+
+
+class MeteredQueue(MessageQueue):
+    """Times the calls of queue as "queue.{method}" and counts the messages"""
+
+    def __init__(self, queue: MessageQueue):
+        self.queue = queue
+
+    def send_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        with metrics.span("queue.send"):
+            failed = self.queue.send_batch(url, entries)
+        metrics.count("queue.messages_sent", len(entries) - len(failed))
+        metrics.count("queue.send_failures", len(failed))
+        return failed
+
+    def delete_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        with metrics.span("queue.delete"):
+            failed = self.queue.delete_batch(url, entries)
+        metrics.count("queue.messages_deleted", len(entries) - len(failed))
+        return failed
+
+    def receive(self, url: str, max_messages: int = 10) -> list[dict]:
+        with metrics.span("queue.receive"):
+            return self.queue.receive(url, max_messages)
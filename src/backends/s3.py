@@ -0,0 +1,191 @@
+""" ObjectStore on S3 and MessageQueue on SQS.
+
+boto3 takes longer to import than the rest of a handler, it is only imported
+when the first client is built so that it stays out of the Lambda init.
+"""
+from .base import (
+    ObjectStore,
+    MessageQueue,
+    StoredObject,
+    NoSuchKey,
+    NotModified,
+    PreconditionFailed,
+)
+
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_LIMIT = 1000
+
+
+def client_error() -> type:
+    """botocore's ClientError, for except clauses"""
+    import botocore.exceptions
+
+    return botocore.exceptions.ClientError
+
+
+def error_code(err: Exception) -> str:
+    return err.response.get("Error", {}).get("Code", "")
+
+
+def translate(err: Exception, key: str):
+    """Map a ClientError to the backend exceptions, otherwise re-raise it"""
+    code = error_code(err)
+    if code in ("NoSuchKey", "404", "NotFound"):
+        raise NoSuchKey(key) from err
+    if code in ("304", "NotModified"):
+        raise NotModified(key) from err
+    if code in ("PreconditionFailed", "412", "ConditionalRequestConflict"):
+        raise PreconditionFailed(key) from err
+    raise err
+
+
+class S3ObjectStore(ObjectStore):
+    def __init__(self, bucket: str, max_pool_connections: int = 10):
+        self.bucket = bucket
+        self.max_pool_connections = max_pool_connections
+        self._client = None
+
+    @property
+    def client(self):
+        # boto3 clients are thread safe, created on first use
+        if self._client is None:
+            import boto3
+            import botocore.config
+
+            self._client = boto3.client(
+                "s3",
+                config=botocore.config.Config(
+                    max_pool_connections=self.max_pool_connections
+                ),
+            )
+        return self._client
+
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        metadata: dict = None,
+        content_encoding: str = None,
+        if_match: str = None,
+        if_none_match: str = None,
+    ) -> str:
+        kwargs = {
+            "Bucket": self.bucket,
+            "Key": key,
+            "Body": body,
+            "ContentLanguage": "en-US",
+            "ContentLength": len(body),
+        }
+        if metadata:
+            kwargs["Metadata"] = metadata
+        if content_encoding:
+            kwargs["ContentEncoding"] = content_encoding
+        if if_match:
+            kwargs["IfMatch"] = if_match
+        if if_none_match:
+            kwargs["IfNoneMatch"] = if_none_match
+
+        try:
+            return self.client.put_object(**kwargs)["ETag"]
+        except client_error() as err:
+            translate(err, key)
+
+    def get(
+        self, key: str, if_none_match: str = None, byte_range: tuple = None
+    ) -> StoredObject:
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if if_none_match:
+            kwargs["IfNoneMatch"] = if_none_match
+        if byte_range is not None:
+            kwargs["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+
+        try:
+            response = self.client.get_object(**kwargs)
+        except client_error() as err:
+            translate(err, key)
+
+        size = response["ContentLength"]
+        if "ContentRange" in response:
+            # "bytes 0-99/1234" for a ranged read
+            size = int(response["ContentRange"].rsplit("/", 1)[1])
+
+        return StoredObject(
+            key=key,
+            etag=response["ETag"],
+            size=size,
+            metadata=response.get("Metadata", {}),
+            content_encoding=response.get("ContentEncoding"),
+            body=response["Body"].read(),
+        )
+
+    def head(self, key: str) -> StoredObject:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except client_error() as err:
+            translate(err, key)
+
+        return StoredObject(
+            key=key,
+            etag=response["ETag"],
+            size=response["ContentLength"],
+            metadata=response.get("Metadata", {}),
+            content_encoding=response.get("ContentEncoding"),
+        )
+
+    def list_keys(self, prefix: str) -> list[str]:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+    def list_prefixes(self, prefix: str, delimiter: str = "/") -> list[str]:
+        folders = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, Delimiter=delimiter
+        )
+        for page in pages:
+            folders.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+        return folders
+
+    def delete(self, keys: list[str]):
+        for n in range(0, len(keys), DELETE_BATCH_LIMIT):
+            objects = [{"Key": key} for key in keys[n : n + DELETE_BATCH_LIMIT]]
+            self.client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+            )
+
+
+class SQSQueue(MessageQueue):
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("sqs")
+        return self._client
+
+    def send_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        response = self.client.send_message_batch(QueueUrl=url, Entries=entries)
+        return response.get("Failed", [])
+
+    def delete_batch(self, url: str, entries: list[dict]) -> list[dict]:
+        response = self.client.delete_message_batch(QueueUrl=url, Entries=entries)
+        return response.get("Failed", [])
+
+    def receive(self, url: str, max_messages: int = 10) -> list[dict]:
+        response = self.client.receive_message(
+            QueueUrl=url, MaxNumberOfMessages=max_messages
+        )
+        return [
+            {
+                "messageId": message["MessageId"],
+                "receiptHandle": message["ReceiptHandle"],
+                "body": message["Body"],
+            }
+            for message in response.get("Messages", [])
+        ]
@@ -0,0 +1,183 @@
+""" On-disk HTTP response cache of the crawler.
+
+Layout under the cache directory:
+    objects/{sha256 of body}    content-addressed page bodies
+    entries/{sha256 of url}     json entry: url, body digest, validators, times
+
+The modification time of an entry file is its last access, which drives the
+LRU eviction once the total size of the bodies exceeds max_bytes.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from dataclasses import dataclass, asdict
+from datetime import date
+
+# ranking pages older than this many days never change anymore
+IMMUTABLE_AFTER_DAYS = int(os.environ.get("crawler_cache_immutable_days", "30"))
+# seconds before a page that may still change has to be revalidated
+DEFAULT_MAX_AGE = int(os.environ.get("crawler_cache_ttl", "3600"))
+
+
+def max_age_for(d: date, today: date = None):
+    """Cache policy of the page of date d
+    Returns:
+        None if the page is immutable, otherwise its max age in seconds.
+    """
+    today = today if today is not None else date.today()
+    if (today - d).days > IMMUTABLE_AFTER_DAYS:
+        return None
+    return DEFAULT_MAX_AGE
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    digest: str  # sha256 of the body, also the file name under objects/
+    size: int
+    fetched_at: float  # last time the body was confirmed by the server
+    etag: str = None
+    last_modified: str = None
+
+    def is_fresh(self, max_age) -> bool:
+        """max_age None means the page is immutable"""
+        return max_age is None or time.time() - self.fetched_at < max_age
+
+    def validators(self) -> dict:
+        """Headers of a conditional GET revalidating this entry"""
+        headers = dict()
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "entries"), exist_ok=True)
+        self.total_bytes = sum(
+            entry.stat().st_size
+            for entry in os.scandir(os.path.join(directory, "objects"))
+        )
+
+    def _entry_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "entries", key)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest)
+
+    def lookup(self, url: str) -> CacheEntry:
+        """Return the entry of url, or None if it is not cached"""
+        try:
+            with open(self._entry_path(url), "r", encoding="utf-8") as f:
+                entry = CacheEntry(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+        if not os.path.exists(self._object_path(entry.digest)):
+            return None
+        return entry
+
+    def read(self, entry: CacheEntry) -> str:
+        """Read the body of entry and mark it as recently used
+        Returns:
+            The body, None if it was evicted since lookup().
+        """
+        try:
+            with open(self._object_path(entry.digest), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(entry)
+        return body.decode("utf-8")
+
+    def revalidated(self, entry: CacheEntry):
+        """The server answered 304, the entry is fresh again"""
+        entry.fetched_at = time.time()
+        self._write_entry(entry)
+
+    def store(self, url: str, body: str, etag: str = None, last_modified: str = None):
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, data)
+            with self.lock:
+                self.total_bytes += len(data)
+
+        entry = CacheEntry(
+            url=url,
+            digest=digest,
+            size=len(data),
+            fetched_at=time.time(),
+            etag=etag,
+            last_modified=last_modified,
+        )
+        self._write_entry(entry)
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries until under max_bytes, then
+        remove the bodies no entry refers to anymore
+        """
+        with self.lock:
+            entries = []
+            for f in os.scandir(os.path.join(self.directory, "entries")):
+                try:
+                    with open(f.path, "r", encoding="utf-8") as fp:
+                        entries.append((f.stat().st_mtime, f.path, json.load(fp)))
+                except (FileNotFoundError, ValueError):
+                    continue
+            entries.sort(key=lambda e: e[0])
+
+            # bytes referenced by the remaining entries, shared bodies counted once
+            sizes = {e[2]["digest"]: e[2]["size"] for e in entries}
+            total = sum(sizes.values())
+            referenced = dict()
+            for _, _, entry in entries:
+                referenced[entry["digest"]] = referenced.get(entry["digest"], 0) + 1
+
+            # evict down to 90%, so that the next store does not evict again
+            for _, path, entry in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                os.remove(path)
+                referenced[entry["digest"]] -= 1
+                if referenced[entry["digest"]] == 0:
+                    total -= entry["size"]
+
+            self.total_bytes = 0
+            for f in os.scandir(os.path.join(self.directory, "objects")):
+                if referenced.get(f.name, 0) > 0:
+                    self.total_bytes += f.stat().st_size
+                else:
+                    os.remove(f.path)
+
+    def _touch(self, entry: CacheEntry):
+        try:
+            os.utime(self._entry_path(entry.url))
+        except FileNotFoundError:
+            pass
+
+    def _write_entry(self, entry: CacheEntry):
+        data = json.dumps(asdict(entry)).encode("utf-8")
+        self._write_atomic(self._entry_path(entry.url), data)
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
@@ -0,0 +1,149 @@
+""" Column-backed variant of Movie for analytics over many movies.
+
+Movie.revenues is a dict of nth_day => DailyRecord. MovieColumns keeps the
+same information as dense columns indexed by nth_day - 1:
+    rankings: array("i")    ranking of the day
+    revenues: array("q")    revenue of the day, 0 when absent
+    present:  bytearray     1 if the movie has a record for the day
+
+Aggregates run over the columns with builtins (sum, accumulate, map), so the
+loop stays in C instead of going through a DailyRecord per day.
+"""
+from array import array
+from datetime import date
+from itertools import accumulate, compress
+
+from src.record import DailyRecord, Movie
+
+
+class MovieColumns:
+    __slots__ = (
+        "id",
+        "title",
+        "release_date",
+        "num_of_theaters",
+        "distributor",
+        "rankings",
+        "revenues",
+        "present",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        title: str,
+        release_date: date = None,
+        num_of_theaters: int = -1,
+        distributor: str = None,
+    ):
+        self.id = id
+        self.title = title
+        self.release_date = release_date
+        self.num_of_theaters = num_of_theaters
+        self.distributor = distributor
+
+        self.rankings = array("i")
+        self.revenues = array("q")
+        self.present = bytearray()
+
+    @classmethod
+    def from_movie(cls, movie: Movie) -> "MovieColumns":
+        columns = cls(
+            id=movie.id,
+            title=movie.title,
+            release_date=movie.release_date,
+            num_of_theaters=movie.num_of_theaters,
+            distributor=movie.distributor,
+        )
+        columns.merge_records(movie.revenues)
+        return columns
+
+    def to_movie(self) -> Movie:
+        revenues = {
+            i + 1: DailyRecord(self.rankings[i], self.revenues[i])
+            for i in compress(range(len(self.present)), self.present)
+        }
+        return Movie(
+            id=self.id,
+            title=self.title,
+            release_date=self.release_date,
+            revenues=revenues,
+            num_of_theaters=self.num_of_theaters,
+            distributor=self.distributor,
+        )
+
+    def __len__(self):
+        """Number of days with a record"""
+        return self.present.count(1)
+
+    def _grow(self, days: int):
+        """Make the columns at least days long"""
+        missing = days - len(self.present)
+        if missing > 0:
+            self.rankings.extend(array("i", bytes(4 * missing)))
+            self.revenues.extend(array("q", bytes(8 * missing)))
+            self.present.extend(bytes(missing))
+
+    def merge_records(self, revenues: dict[DailyRecord]):
+        """Usage: add revenues from other day's to this, same as Movie"""
+        if len(revenues) == 0:
+            return
+        self._grow(max(int(nth_day) for nth_day in revenues))
+        for nth_day, record in revenues.items():
+            i = int(nth_day) - 1
+            self.rankings[i] = record.ranking
+            self.revenues[i] = record.revenue
+            self.present[i] = 1
+
+    def merge(self, other: "MovieColumns"):
+        """Bulk merge, days present in other overwrite the days of this"""
+        self._grow(len(other.present))
+        n = len(other.present)
+        if other.present.count(1) == n:
+            # other is dense, copy whole slices
+            self.rankings[:n] = other.rankings
+            self.revenues[:n] = other.revenues
+            self.present[:n] = other.present
+            return
+        for i in compress(range(n), other.present):
+            self.rankings[i] = other.rankings[i]
+            self.revenues[i] = other.revenues[i]
+            self.present[i] = 1
+
+    def newest_nth_day(self) -> int:
+        return self.present.rindex(1) + 1
+
+    def gross_revenue(self) -> int:
+        # absent days are stored as 0
+        return sum(self.revenues)
+
+    def cumulative_revenues(self) -> array:
+        """Running total of revenue at the end of every nth day"""
+        return array("q", accumulate(self.revenues))
+
+    def week_over_week_drop(self) -> list:
+        """Change of revenue relative to the same weekday one week earlier,
+        indexed by nth_day - 1. None when either day is absent or zero.
+        """
+        drops = [None] * min(7, len(self.revenues))
+        drops.extend(
+            map(
+                _drop,
+                self.revenues[:-7],
+                self.revenues[7:],
+                self.present[:-7],
+                self.present[7:],
+            )
+        )
+        return drops
+
+
+def _drop(prev: int, current: int, prev_present: int, present: int):
+    if not prev_present or not present or prev == 0:
+        return None
+    return (current - prev) / prev
+
+
+def gross_revenues(movies: list[MovieColumns]) -> dict[str, int]:
+    """Gross revenue of every movie, by id"""
+    return {movie.id: sum(movie.revenues) for movie in movies}
@@ -0,0 +1,120 @@
+""" Append-only revenue deltas of stored movies.
+
+Instead of a read-modify-write of {MOVIES_FOLDER}/{id}.{FILE_EXTENSION} for
+every new day, a ranking batch writes the new daily records of a movie as a
+small delta object:
+    {DELTAS_FOLDER}/{id}/{batch_id}.{FILE_EXTENSION}
+
+A delta has the same layout as a ranking file, one entry per nth day, and
+every object is decoded by the codec of its file extension. Delta keys sort
+in the order they were written, so that folding them in key order lets newer
+records win. compact_movie() folds the deltas into the base movie object and
+removes them; readers combine both with load_movie().
+"""
+import time
+import uuid
+
+from src import metrics
+from src.record import Movie, content_hash
+from src.backends import ObjectStore
+from src.encoders import get_encoder, get_encoder_for_key
+from src.encoders.compression import compress, content_encoding
+
+
+def new_batch_id() -> str:
+    """A delta key that sorts after every key written before it"""
+    return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+
+def write_delta(
+    storage: ObjectStore, prefix: str, extension: str, movie: Movie, batch_id: str
+) -> str:
+    """Write the revenues of movie as a delta
+    Returns:
+        The key of the delta object.
+    """
+    days = [
+        Movie(id=movie.id, title=movie.title, revenues={nth_day: record})
+        for nth_day, record in sorted(movie.revenues.items())
+    ]
+    with metrics.span("encode"):
+        writable = compress(get_encoder(extension).encode_ranking(days))
+
+    key = f"{prefix}/{movie.id}/{batch_id}.{extension}"
+    storage.put(key, writable, content_encoding=content_encoding())
+    return key
+
+
+def list_deltas(storage: ObjectStore, prefix: str, movie_id: str) -> list[str]:
+    """Keys of the deltas of movie_id, oldest first"""
+    return sorted(storage.list_keys(f"{prefix}/{movie_id}/"))
+
+
+def list_movies_with_deltas(storage: ObjectStore, prefix: str) -> list[str]:
+    """Ids of every movie having at least one delta"""
+    return [
+        folder[len(prefix) + 1 :].rstrip("/")
+        for folder in storage.list_prefixes(f"{prefix}/")
+    ]
+
+
+def apply_deltas(storage: ObjectStore, movie: Movie, keys: list[str]) -> Movie:
+    """Merge the deltas at keys into movie, in key order"""
+    for key in keys:
+        readable = storage.get(key).body
+        with metrics.span("decode"):
+            days = get_encoder_for_key(key).decode_ranking(readable)
+        for day in days:
+            movie.merge_records(day.revenues)
+    return movie
+
+
+def load_movie(
+    storage: ObjectStore, movie_key: str, prefix: str, movie_id: str
+) -> Movie:
+    """Read a movie as the combination of its base object and its deltas"""
+    readable = storage.get(movie_key).body
+    with metrics.span("decode"):
+        movie = get_encoder_for_key(movie_key).decode_movie(readable)
+    return apply_deltas(storage, movie, list_deltas(storage, prefix, movie_id))
+
+
+def compact_movie(
+    storage: ObjectStore, movie_key: str, prefix: str, movie_id: str
+) -> tuple[Movie, str]:
+    """Fold the deltas of movie_id into its base object
+
+    The base object is written conditionally on its etag, so a concurrent
+    rewrite of the movie makes the compaction fail instead of losing it.
+    Deltas written after the listing are left for the next compaction.
+    Returns:
+        (the compacted movie, etag of the new base object), or (None, None)
+        when there is nothing to compact.
+    Raises:
+        PreconditionFailed if the base object changed during the compaction.
+    """
+    keys = list_deltas(storage, prefix, movie_id)
+    if len(keys) == 0:
+        return None, None
+
+    obj = storage.get(movie_key)
+    encoder = get_encoder_for_key(movie_key)
+    with metrics.span("decode"):
+        movie = encoder.decode_movie(obj.body)
+    apply_deltas(storage, movie, keys)
+
+    with metrics.span("encode"):
+        writable = compress(encoder.encode_movie(movie))
+    etag = storage.put(
+        movie_key,
+        writable,
+        metadata={
+            "newest-nth-day": str(movie.newest_nth_day()),
+            "content-hash": content_hash([movie]),
+        },
+        content_encoding=content_encoding(),
+        if_match=obj.etag,
+    )
+
+    storage.delete(keys)
+    return movie, etag
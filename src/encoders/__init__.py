@@ -0,0 +1,33 @@
+""" Codecs of the stored ranking and movie files, registered by file extension.
+
+Every codec module exposes the same four functions:
+    encode_ranking(movies: list[Movie]) -> bytes
+    decode_ranking(readable: bytes) -> list[Movie]
+    encode_movie(movie: Movie) -> bytes
+    decode_movie(readable: bytes) -> Movie
+
+Decoders accept the output of compression.compress() as well.
+"""
+import importlib
+
+__all__ = ["json_encoder", "columnar_encoder", "compression"]
+
+# file extension => module name, modules are imported on first use
+ENCODERS = {
+    "json": "json_encoder",
+    "col": "columnar_encoder",
+}
+
+
+def get_encoder(extension: str):
+    """Return the codec module of files ending with .{extension}"""
+    if extension not in ENCODERS:
+        raise ValueError(
+            f"no encoder for extension {extension}, expect one of {list(ENCODERS)}"
+        )
+    return importlib.import_module(f".{ENCODERS[extension]}", __name__)
+
+
+def get_encoder_for_key(key: str):
+    """Return the codec module of an object key like "movies/rl1.json" """
+    return get_encoder(key.rsplit(".", 1)[-1])
@@ -0,0 +1,153 @@
+""" Responsible for encode/decode object into a struct-packed columnar layout
+
+All integers are little-endian. A file starts with a header:
+    magic b"MCOL" | version u8 | kind u8 (KIND_RANKING or KIND_MOVIE)
+
+A ranking file holds one row per movie, stored column by column:
+    count u32
+    nth_day u32[count] | ranking i32[count] | revenue i64[count]
+    ids strings | titles strings
+
+A movie file holds the movie fields, then its revenues as columns sorted
+by nth_day:
+    id string | title string | distributor string
+    release_date i32 (date ordinal, 0 if unknown) | num_of_theaters i32
+    count u32 | nth_day u32[count] | ranking i32[count] | revenue i64[count]
+
+A string column is the u32 byte length of every value (0xFFFFFFFF for None)
+followed by the concatenated utf-8 bytes.
+"""
+import struct
+from datetime import date
+
+from src.record import DailyRecord, Movie
+from src.encoders.compression import decompress
+
+MAGIC = b"MCOL"
+VERSION = 1
+KIND_RANKING = 1
+KIND_MOVIE = 2
+
+HEADER = struct.Struct("<4sBB")
+NONE_LENGTH = 0xFFFFFFFF
+
+
+def _pack_strings(values: list[str]) -> bytes:
+    encoded = [v.encode("utf-8") if v is not None else None for v in values]
+    lengths = [len(v) if v is not None else NONE_LENGTH for v in encoded]
+    return struct.pack(f"<{len(lengths)}I", *lengths) + b"".join(
+        v for v in encoded if v is not None
+    )
+
+
+def _unpack_strings(readable: bytes, offset: int, count: int):
+    lengths = struct.unpack_from(f"<{count}I", readable, offset)
+    offset += 4 * count
+
+    values = []
+    for length in lengths:
+        if length == NONE_LENGTH:
+            values.append(None)
+            continue
+        values.append(readable[offset : offset + length].decode("utf-8"))
+        offset += length
+    return values, offset
+
+
+def _pack_days(nth_days: list[int], rankings: list[int], revenues: list[int]):
+    n = len(nth_days)
+    return struct.pack(f"<I{n}I{n}i{n}q", n, *nth_days, *rankings, *revenues)
+
+
+def _unpack_days(readable: bytes, offset: int):
+    (n,) = struct.unpack_from("<I", readable, offset)
+    offset += 4
+    columns = struct.unpack_from(f"<{n}I{n}i{n}q", readable, offset)
+    offset += 16 * n
+    return columns[:n], columns[n : 2 * n], columns[2 * n :], offset
+
+
+def _check_header(readable: bytes, kind: int) -> int:
+    magic, version, actual_kind = HEADER.unpack_from(readable, 0)
+    if magic != MAGIC or version != VERSION or actual_kind != kind:
+        raise ValueError(f"not a version {VERSION} columnar file of kind {kind}")
+    return HEADER.size
+
+
+""" Movie Ranking Encoder/Decoder. """
+
+
+def encode_ranking(movies: list[Movie]) -> bytes:
+    # there should only be 1 entry in obj.revenues. So just retrieve it
+    nth_days = [next(iter(movie.revenues)) for movie in movies]
+    records = [movie.revenues[n] for movie, n in zip(movies, nth_days)]
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, VERSION, KIND_RANKING),
+            _pack_days(
+                nth_days,
+                [r.ranking for r in records],
+                [r.revenue for r in records],
+            ),
+            _pack_strings([movie.id for movie in movies]),
+            _pack_strings([movie.title for movie in movies]),
+        ]
+    )
+
+
+def decode_ranking(readable: bytes) -> list[Movie]:
+    readable = decompress(readable)
+    offset = _check_header(readable, KIND_RANKING)
+    nth_days, rankings, revenues, offset = _unpack_days(readable, offset)
+    ids, offset = _unpack_strings(readable, offset, len(nth_days))
+    titles, offset = _unpack_strings(readable, offset, len(nth_days))
+
+    return [
+        Movie(id=id, title=title, revenues={n: DailyRecord(ranking, revenue)})
+        for id, title, n, ranking, revenue in zip(
+            ids, titles, nth_days, rankings, revenues
+        )
+    ]
+
+
+""" Movie Encoder/Decoder. """
+
+
+def encode_movie(movie: Movie) -> bytes:
+    nth_days = sorted(movie.revenues)
+    records = [movie.revenues[n] for n in nth_days]
+    release_date = movie.release_date.toordinal() if movie.release_date else 0
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, VERSION, KIND_MOVIE),
+            _pack_strings([movie.id, movie.title, movie.distributor]),
+            struct.pack("<ii", release_date, movie.num_of_theaters),
+            _pack_days(
+                nth_days,
+                [r.ranking for r in records],
+                [r.revenue for r in records],
+            ),
+        ]
+    )
+
+
+def decode_movie(readable: bytes) -> Movie:
+    readable = decompress(readable)
+    offset = _check_header(readable, KIND_MOVIE)
+    (id, title, distributor), offset = _unpack_strings(readable, offset, 3)
+    release_date, num_of_theaters = struct.unpack_from("<ii", readable, offset)
+    nth_days, rankings, revenues, _ = _unpack_days(readable, offset + 8)
+
+    return Movie(
+        id=id,
+        title=title,
+        release_date=date.fromordinal(release_date) if release_date else None,
+        revenues={
+            n: DailyRecord(ranking, revenue)
+            for n, ranking, revenue in zip(nth_days, rankings, revenues)
+        },
+        num_of_theaters=num_of_theaters,
+        distributor=distributor,
+    )
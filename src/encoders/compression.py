@@ -0,0 +1,72 @@
+""" Optional compression stage between the codecs and the storage calls.
+
+The handlers compress the encoded bytes with the codec picked by env
+"compression" (identity, gzip, zstd or lz4) at env "compression_level", and
+store the name as the object's Content-Encoding. zstd and lz4 need the
+optional packages zstandard and lz4.
+
+Reading never depends on the metadata: decompress() recognizes each format by
+its magic number and returns anything else unchanged, so the decoders accept
+compressed and uncompressed objects alike.
+"""
+import os
+import gzip
+
+COMPRESSION = os.environ.get("compression", "identity")
+LEVEL = os.environ.get("compression_level")
+LEVEL = int(LEVEL) if LEVEL is not None else None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+
+def compress(data: bytes, encoding: str = None, level: int = None) -> bytes:
+    """Compress data
+    Args:
+        encoding: identity, gzip, zstd or lz4, defaults to env "compression".
+        level: compression level, defaults to env "compression_level" and
+            then to the library default.
+    """
+    encoding = encoding if encoding is not None else COMPRESSION
+    level = level if level is not None else LEVEL
+
+    if encoding == "identity":
+        return data
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical for identical data
+        level = level if level is not None else 6
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "zstd":
+        import zstandard
+
+        level = level if level is not None else 3
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == "lz4":
+        import lz4.frame
+
+        level = level if level is not None else 0
+        return lz4.frame.compress(data, compression_level=level)
+    raise ValueError(f"unknown compression {encoding}")
+
+
+def content_encoding(encoding: str = None):
+    """The Content-Encoding of compress(data, encoding), None for identity"""
+    encoding = encoding if encoding is not None else COMPRESSION
+    return None if encoding == "identity" else encoding
+
+
+def decompress(readable: bytes) -> bytes:
+    """Undo compress(), whatever the encoding was"""
+    if readable[:2] == GZIP_MAGIC:
+        return gzip.decompress(readable)
+    if readable[:4] == ZSTD_MAGIC:
+        import zstandard
+
+        # frames written by ZstdCompressor.compress() carry the content size
+        return zstandard.ZstdDecompressor().decompress(readable)
+    if readable[:4] == LZ4_MAGIC:
+        import lz4.frame
+
+        return lz4.frame.decompress(readable)
+    return readable
@@ -3,6 +3,7 @@ import json
 from datetime import date
 
 from src.record import DailyRecord, Movie
+from src.encoders.compression import decompress
 
 """ Movie Ranking Encoder/Decoder. """
 
@@ -37,7 +38,7 @@ class MovieRankingDecoder(json.JSONDecoder):
 
 
 def decode_ranking(readable: bytes) -> list[Movie]:
-    return json.loads(readable, cls=MovieRankingDecoder)
+    return json.loads(decompress(readable), cls=MovieRankingDecoder)
 
 
 """ Movie Encoder/Decoder. """
@@ -84,4 +85,4 @@ class MovieDecoder(json.JSONDecoder):
 
 
 def decode_movie(readable: bytes) -> Movie:
-    return json.loads(readable, cls=MovieDecoder)
+    return json.loads(decompress(readable), cls=MovieDecoder)
@@ -0,0 +1,313 @@
+""" Shared HTTP layer of the crawler.
+
+All requests to boxofficemojo go through fetch(), which reuses keep-alive
+connections from one pooled requests.Session and waits on a TokenBucket so
+that concurrent crawls stay under a requests-per-second limit. When env
+"crawler_cache_dir" is set, responses are kept in an on-disk ResponseCache
+and revalidated with conditional GETs.
+
+A throttled or failing site is handled at three levels:
+- every request has a timeout, and a 429, a 5xx, a timeout or a connection
+  error is retried after a jittered exponential backoff (or the Retry-After
+  of the response);
+- an AdaptiveLimiter bounds the requests in flight, growing the bound by one
+  per round of healthy responses and halving it on an error or a response
+  slower than the latency target (AIMD);
+- a CircuitBreaker stops all requests for a while after consecutive failures,
+  so that a blocked crawler fails its batch fast instead of hammering the site.
+"""
+import os
+import time
+import random
+import threading
+
+from . import metrics
+from .cache import ResponseCache, DEFAULT_MAX_AGE
+
+# maximum requests per second toward boxofficemojo, 0 means unlimited
+RATE_LIMIT = float(os.environ.get("crawler_rate_limit", "5"))
+# number of keep-alive connections kept in the session's pool
+POOL_SIZE = int(os.environ.get("crawler_pool_size", "16"))
+# directory of the response cache, disabled when not set
+CACHE_DIR = os.environ.get("crawler_cache_dir")
+CACHE_MAX_BYTES = int(os.environ.get("crawler_cache_max_bytes", str(256 * 2**20)))
+# seconds to connect and then between bytes of the response
+TIMEOUT = float(os.environ.get("crawler_timeout", "10"))
+# retries of a throttled or failed request, and the backoff before them
+RETRIES = int(os.environ.get("crawler_retries", "4"))
+BACKOFF_BASE = float(os.environ.get("crawler_backoff_base", "0.5"))
+BACKOFF_MAX = float(os.environ.get("crawler_backoff_max", "30"))
+# requests in flight: starting bound, and ceiling of the adaptive bound
+INITIAL_CONCURRENCY = int(os.environ.get("crawler_initial_concurrency", "4"))
+MAX_CONCURRENCY = int(os.environ.get("crawler_max_concurrency", str(POOL_SIZE)))
+# a response slower than this is a sign of congestion, in seconds
+LATENCY_TARGET = float(os.environ.get("crawler_latency_target", "3"))
+# consecutive failures opening the circuit, and seconds before a new trial
+BREAKER_THRESHOLD = int(os.environ.get("crawler_breaker_threshold", "10"))
+BREAKER_RESET = float(os.environ.get("crawler_breaker_reset", "60"))
+
+
+class FetchError(Exception):
+    """A page could not be downloaded
+    Args:
+        url: the page.
+        status: status code of the last response, None if there was none.
+    """
+
+    def __init__(self, url: str, status: int = None, reason: str = None):
+        super().__init__(f"failed fetching {url}, {status=}, {reason=}")
+        self.url = url
+        self.status = status
+
+
+class CircuitOpenError(FetchError):
+    """No request was sent, the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Token bucket rate limiter, safe to share between threads
+    Args:
+        rate: tokens added per second.
+        capacity: maximum tokens, i.e. the allowed burst. Defaults to rate.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """Block until tokens are available, then take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Bound of the requests in flight adjusted by AIMD, safe to share between
+    threads
+    Args:
+        initial, minimum, maximum: the bound at start and its limits.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        # bumped at every decrease, the requests started before it do not
+        # decrease the bound again: one cut per round of requests
+        self.epoch = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """Block until a request may start
+        Returns:
+            The epoch to pass to release().
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    def release(self, epoch: int, healthy: bool):
+        """End a request started at epoch, healthy if it was neither throttled,
+        failed nor slow
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if healthy:
+                # +1 once every request of a full round succeeded
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif epoch == self.epoch:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.epoch += 1
+                metrics.count("crawl.concurrency_decreased")
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """Fail fast after threshold consecutive failures, for reset_seconds,
+    then let a single trial request through: its success closes the circuit
+    and its failure opens it again
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None  # None when closed
+        self.trial = False  # a trial request is in flight
+        self.lock = threading.Lock()
+
+    def allow(self, url: str):
+        """Raises:
+        CircuitOpenError if the request must not be sent.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError(url, reason="circuit open")
+            self.trial = True
+
+    def record(self, healthy: bool):
+        with self.lock:
+            self.trial = False
+            if healthy:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    metrics.count("crawl.circuit_opened")
+                self.opened_at = time.monotonic()
+
+
+def backoff(attempt: int, retry_after: str = None) -> float:
+    """Seconds to wait before retry number attempt (from 0): the Retry-After
+    of the response when given in seconds, else a random delay up to an
+    exponential bound ("full jitter")
+    """
+    if retry_after is not None and retry_after.strip().isdigit():
+        return min(BACKOFF_MAX, float(retry_after))
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+_session = None
+_session_lock = threading.Lock()
+_limiter = TokenBucket(RATE_LIMIT) if RATE_LIMIT > 0 else None
+_concurrency = AdaptiveLimiter(INITIAL_CONCURRENCY, 1, MAX_CONCURRENCY)
+_breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+_cache = None
+
+
+def get_session() -> "requests.Session":
+    """The process wide session, created on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # requests is most of the import time of the handlers, keep it
+                # out of the cold start until a page is actually downloaded
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_cache() -> ResponseCache:
+    """The process wide response cache, None if caching is disabled"""
+    global _cache
+    if _cache is None and CACHE_DIR:
+        with _session_lock:
+            if _cache is None:
+                _cache = ResponseCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return _cache
+
+
+def fetch(url: str, limiter: TokenBucket = None, max_age=DEFAULT_MAX_AGE) -> str:
+    """GET url and return the page text
+    Args:
+        url: target url.
+        limiter: rate limiter to wait on, defaults to the module limiter
+            configured by env "crawler_rate_limit".
+        max_age: seconds a cached page is served without asking the server,
+            None if the page never changes.
+    Raises:
+        FetchError if the page is not found, or still failing after the
+        retries. CircuitOpenError when too many requests failed recently.
+    """
+    cache = get_cache()
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and entry.is_fresh(max_age):
+        body = cache.read(entry)
+        if body is not None:
+            return body
+        # evicted by another thread since the lookup, a miss
+        entry = None
+
+    limiter = limiter if limiter is not None else _limiter
+    headers = entry.validators() if entry is not None else None
+    r = get(url, headers, limiter)
+
+    if r.status_code == 304 and entry is not None:
+        body = cache.read(entry)
+        if body is not None:
+            cache.revalidated(entry)
+            return body
+        # evicted in between, the page is downloaded without the validators
+        r = get(url, None, limiter)
+
+    if cache is not None and r.status_code == 200:
+        cache.store(
+            url,
+            r.text,
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+        )
+    return r.text
+
+
+def get(url: str, headers: dict, limiter: TokenBucket):
+    """GET url, retried while it is throttled or failing
+    Returns:
+        The response, 2xx or 304.
+    """
+    import requests
+
+    session = get_session()
+    for attempt in range(RETRIES + 1):
+        _breaker.allow(url)
+        # the slot and the breaker are released whatever happens to the
+        # request, a leaked slot blocks every later fetch of the container
+        r, reason, epoch, started = None, None, None, time.monotonic()
+        try:
+            if limiter is not None:
+                limiter.acquire()
+            epoch = _concurrency.acquire()
+            started = time.monotonic()
+            r = session.get(url, headers=headers, timeout=TIMEOUT)
+        except requests.RequestException as err:
+            reason = type(err).__name__
+        finally:
+            failed = r is None or r.status_code == 429 or r.status_code >= 500
+            if epoch is not None:
+                elapsed = time.monotonic() - started
+                _concurrency.release(epoch, not failed and elapsed < LATENCY_TARGET)
+            _breaker.record(not failed)
+
+        if not failed:
+            if r.status_code >= 400:
+                # the site is fine, the page is not there: no retry
+                raise FetchError(url, r.status_code, r.reason)
+            return r
+
+        status = r.status_code if r is not None else None
+        if attempt == RETRIES:
+            raise FetchError(url, status, reason or r.reason)
+        metrics.count("crawl.retries")
+        if status == 429:
+            metrics.count("crawl.throttled")
+        retry_after = r.headers.get("Retry-After") if r is not None else None
+        time.sleep(backoff(attempt, retry_after))
@@ -0,0 +1,185 @@
+""" Secondary indexes of the stored movies, by title, distributor and date.
+
+A single json object holds the indexed fields of every movie and the sorted
+lists built from them, so that readers only bisect:
+    {
+        "movies": {id: [title, distributor, release_date]},
+        "titles": [[casefolded title, id], ...],
+        "releases": [[release_date, id], ...],
+        "distributors": {name: [[release_date, id], ...]}
+    }
+
+movie_handler updates it after every batch, with a conditional PUT retried on
+conflicts like the manifest. rebuild() recreates it from the stored movies.
+"""
+import json
+import bisect
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from src.record import Movie
+from src.backends import ObjectStore, get_if_changed, conditional_update
+from src.encoders import get_encoder_for_key
+
+# movies decoded at the same time by rebuild()
+REBUILD_WORKERS = 16
+
+
+@dataclass
+class IndexEntry:
+    title: str
+    distributor: str = None
+    release_date: str = None  # isoformat
+
+    @classmethod
+    def of(cls, movie: Movie) -> "IndexEntry":
+        release_date = movie.release_date.isoformat() if movie.release_date else None
+        return cls(movie.title, movie.distributor, release_date)
+
+
+def normalize(title: str) -> str:
+    return " ".join(title.casefold().split())
+
+
+def build(movies: dict[str, IndexEntry]) -> dict:
+    """The index document of movies"""
+    titles = sorted([normalize(entry.title), id] for id, entry in movies.items())
+    releases, distributors = [], dict()
+    for id, entry in movies.items():
+        if entry.release_date is None:
+            continue
+        releases.append([entry.release_date, id])
+        if entry.distributor is not None:
+            distributors.setdefault(entry.distributor, []).append(
+                [entry.release_date, id]
+            )
+    return {
+        "movies": {
+            id: [entry.title, entry.distributor, entry.release_date]
+            for id, entry in sorted(movies.items())
+        },
+        "titles": titles,
+        "releases": sorted(releases),
+        "distributors": {name: sorted(ids) for name, ids in distributors.items()},
+    }
+
+
+def between(rows: list, start: str = None, end: str = None) -> list[str]:
+    """Ids of the [key, id] rows sorted by key with start <= key <= end"""
+    lo = 0 if start is None else bisect.bisect_left(rows, [start])
+    hi = len(rows) if end is None else bisect.bisect_left(rows, [end, "\uffff"])
+    return [id for _, id in rows[lo:hi]]
+
+
+class MovieIndex:
+    """The index object at key, kept in memory and refreshed like the manifest"""
+
+    def __init__(self, storage: ObjectStore, key: str):
+        self.storage = storage
+        self.key = key
+
+        self.document = build(dict())
+        self.etag = None  # etag of the index object when loaded, None if absent
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Load the index, a no-op 304 when it did not change since last time"""
+        loaded = get_if_changed(
+            self.storage, self.key, self.etag if self.loaded else None
+        )
+        if loaded is None:
+            return
+
+        body, etag = loaded
+        document = json.loads(body) if body else build(dict())
+        with self.lock:
+            self.document, self.etag, self.loaded = document, etag, True
+
+    def entries(self) -> dict[str, IndexEntry]:
+        return {id: IndexEntry(*row) for id, row in self.document["movies"].items()}
+
+    def get(self, movie_id: str) -> IndexEntry:
+        """Return the entry of movie_id, None if the movie is not indexed"""
+        row = self.document["movies"].get(movie_id)
+        return IndexEntry(*row) if row is not None else None
+
+    def update(self, changes: dict[str, IndexEntry]):
+        """Write changes into the index, only if an entry differs
+
+        The PUT is conditional on the index not being modified since it was
+        loaded. On a conflict, the index is reloaded and changes re-applied.
+        """
+
+        def load(conflict: bool) -> tuple[dict, str]:
+            if conflict or not self.loaded:
+                self.refresh()
+            with self.lock:
+                return self.document, self.etag
+
+        document = None
+
+        def mutate(current: dict) -> bytes:
+            nonlocal document
+            rows = current["movies"]
+            if all(
+                id in rows and IndexEntry(*rows[id]) == entry
+                for id, entry in changes.items()
+            ):
+                return None
+            movies = {id: IndexEntry(*row) for id, row in rows.items()}
+            movies.update(changes)
+            document = build(movies)
+            return json.dumps(document, separators=(",", ":")).encode("utf-8")
+
+        etag = conditional_update(self.storage, self.key, mutate, load)
+        if etag is not None:
+            with self.lock:
+                self.document, self.etag = document, etag
+
+    def by_title(self, title: str) -> list[str]:
+        """Ids of the movies titled title, whatever the case and spacing"""
+        title = normalize(title)
+        return between(self.document["titles"], title, title)
+
+    def title_prefix(self, prefix: str, limit: int = None) -> list[tuple[str, str]]:
+        """(title, id) of the movies whose title starts with prefix, by title"""
+        rows = self.document["titles"]
+        prefix = normalize(prefix)
+        lo = bisect.bisect_left(rows, [prefix])
+        hi = bisect.bisect_left(rows, [prefix + "\uffff"])
+        ids = [id for _, id in rows[lo:hi][:limit]]
+        return [(self.document["movies"][id][0], id) for id in ids]
+
+    def released_between(self, start: str = None, end: str = None) -> list[str]:
+        """Ids of the movies released from start to end (isoformat, inclusive),
+        by release date
+        """
+        return between(self.document["releases"], start, end)
+
+    def by_distributor(
+        self, distributor: str, start: str = None, end: str = None
+    ) -> list[str]:
+        """Ids of the releases of distributor, optionally from start to end"""
+        rows = self.document["distributors"].get(distributor, [])
+        return between(rows, start, end)
+
+
+def rebuild(storage: ObjectStore, movies_prefix: str, key: str) -> int:
+    """Recreate the index at key from every movie under movies_prefix
+    Returns:
+        The number of movies indexed.
+    """
+
+    def read(movie_key: str) -> Movie:
+        body = storage.get(movie_key).body
+        return get_encoder_for_key(movie_key).decode_movie(body)
+
+    keys = storage.list_keys(f"{movies_prefix}/")
+    with ThreadPoolExecutor(max_workers=REBUILD_WORKERS) as executor:
+        movies = {movie.id: IndexEntry.of(movie) for movie in executor.map(read, keys)}
+
+    writable = json.dumps(build(movies), separators=(",", ":")).encode("utf-8")
+    storage.put(key, writable)
+    return len(movies)
@@ -0,0 +1,83 @@
+""" Manifest of the stored movies.
+
+A single json object maps every movie id to what the handlers need to know
+about {MOVIES_FOLDER}/{id}.{FILE_EXTENSION} without touching it:
+    {"movies": {id: {"newest_nth_day": 28, "release_date": "2023-07-21", ...}}}
+
+The manifest is kept in memory by the warm Lambda container, refreshed with
+a conditional GET, and updated with a conditional PUT so that concurrent
+writers retry instead of overwriting each other.
+"""
+import json
+import threading
+from dataclasses import dataclass, asdict
+
+from src.backends import ObjectStore, get_if_changed, conditional_update
+
+
+@dataclass
+class ManifestEntry:
+    newest_nth_day: int
+    release_date: str = None  # isoformat
+    etag: str = None  # etag of the movie object
+
+
+class Manifest:
+    def __init__(self, storage: ObjectStore, key: str):
+        self.storage = storage
+        self.key = key
+
+        self.entries: dict[str, ManifestEntry] = dict()
+        self.etag = None  # etag of the manifest object when loaded, None if absent
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Load the manifest, a no-op 304 when it did not change since last time"""
+        loaded = get_if_changed(
+            self.storage, self.key, self.etag if self.loaded else None
+        )
+        if loaded is None:
+            return
+
+        body, etag = loaded
+        document = json.loads(body) if body else {"movies": dict()}
+        entries = {
+            movie_id: ManifestEntry(**entry)
+            for movie_id, entry in document["movies"].items()
+        }
+        with self.lock:
+            self.entries, self.etag, self.loaded = entries, etag, True
+
+    def get(self, movie_id: str) -> ManifestEntry:
+        """Return the entry of movie_id, None if the movie is not in the manifest"""
+        return self.entries.get(movie_id)
+
+    def update(self, changes: dict[str, ManifestEntry]):
+        """Write changes into the manifest
+
+        The PUT is conditional on the manifest not being modified since it was
+        loaded. On a conflict, the manifest is reloaded and changes re-applied.
+        """
+        if len(changes) == 0:
+            return
+
+        def load(conflict: bool) -> tuple[dict, str]:
+            if conflict or not self.loaded:
+                self.refresh()
+            with self.lock:
+                return dict(self.entries), self.etag
+
+        entries = None
+
+        def mutate(current: dict) -> bytes:
+            nonlocal entries
+            entries = current
+            entries.update(changes)
+            return json.dumps(
+                {"movies": {k: asdict(v) for k, v in entries.items()}}
+            ).encode("utf-8")
+
+        etag = conditional_update(self.storage, self.key, mutate, load)
+        with self.lock:
+            self.entries, self.etag = entries, etag
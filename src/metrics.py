@@ -0,0 +1,177 @@
+""" Per-invocation timings and counters of the handlers.
+
+Stages are timed with spans and sizes are added up with counters:
+
+    with metrics.span("fetch"):
+        html = fetch(url)
+    metrics.count("fetch.bytes", len(html), "Bytes")
+
+Everything recorded during an invocation, from any thread, is printed once it
+ends as CloudWatch Embedded Metric Format (EMF) json lines, so CloudWatch
+turns the log into metrics: every span is a Milliseconds metric carrying all
+its values (CloudWatch builds the latency percentiles from them) and every
+counter a single value. Each line also carries a plain "summary" of the spans
+(count, p50, p90, p99, max) for Logs Insights.
+
+env "metrics_namespace" sets the CloudWatch namespace, env "metrics_enabled"
+set to false disables the output.
+"""
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("metrics_namespace", "MovieEtl")
+ENABLED = os.environ.get("metrics_enabled", "true").lower() not in ("0", "false")
+
+# EMF accepts at most 100 values per metric in one document
+MAX_VALUES = 100
+
+
+class Recorder:
+    """Spans and counters of one invocation, safe to share between threads"""
+
+    def __init__(self, handler: str = None):
+        self.handler = handler
+        self.timings: dict[str, list[float]] = dict()
+        self.counters: dict[str, float] = dict()
+        self.units: dict[str, str] = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, milliseconds: float):
+        with self.lock:
+            self.timings.setdefault(name, []).append(milliseconds)
+
+    def count(self, name: str, value: float = 1, unit: str = "Count"):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.units[name] = unit
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the body of the with statement as one value of name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
+    def summary(self) -> dict:
+        summary = dict()
+        for name, values in self.timings.items():
+            ordered = sorted(values)
+            summary[name] = {
+                "count": len(ordered),
+                "sum": round(sum(ordered), 3),
+                "p50": round(percentile(ordered, 50), 3),
+                "p90": round(percentile(ordered, 90), 3),
+                "p99": round(percentile(ordered, 99), 3),
+                "max": round(ordered[-1], 3),
+            }
+        return summary
+
+    def documents(self, timestamp: int = None) -> list[dict]:
+        """The EMF documents of everything recorded, split so that no metric
+        has more than MAX_VALUES values in one document
+        """
+        timestamp = timestamp if timestamp is not None else int(time.time() * 1000)
+        longest = max((len(v) for v in self.timings.values()), default=0)
+        chunks = max(1, -(-longest // MAX_VALUES))
+
+        documents = []
+        for n in range(chunks):
+            metrics, values = [], dict()
+            for name, timings in self.timings.items():
+                chunk = timings[n * MAX_VALUES : (n + 1) * MAX_VALUES]
+                if len(chunk) > 0:
+                    metrics.append({"Name": name, "Unit": "Milliseconds"})
+                    values[name] = [round(t, 3) for t in chunk]
+            # counters are totals, they go into the first document only
+            if n == 0:
+                for name, value in self.counters.items():
+                    metrics.append({"Name": name, "Unit": self.units[name]})
+                    values[name] = value
+
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": NAMESPACE,
+                            "Dimensions": [["handler"]],
+                            "Metrics": metrics,
+                        }
+                    ],
+                },
+                "handler": self.handler,
+                **values,
+            }
+            if n == 0:
+                document["summary"] = self.summary()
+            documents.append(document)
+        return documents
+
+
+def percentile(ordered: list[float], p: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    index = max(0, -(-len(ordered) * p // 100) - 1)
+    return ordered[int(index)]
+
+
+# the recorder of the running invocation, Lambda runs one at a time
+_recorder = Recorder()
+
+
+def current() -> Recorder:
+    return _recorder
+
+
+def span(name: str):
+    return _recorder.span(name)
+
+
+def count(name: str, value: float = 1, unit: str = "Count"):
+    _recorder.count(name, value, unit)
+
+
+def observe(name: str, milliseconds: float):
+    _recorder.observe(name, milliseconds)
+
+
+def timed(name: str):
+    """Decorate a function to time every call as a span of name"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _recorder.span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def invocation(handler: str):
+    """Decorate a lambda_handler to record its invocations with a fresh
+    Recorder, timed as "invocation" and printed as EMF when it returns or raises
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global _recorder
+            _recorder = Recorder(handler)
+            try:
+                with _recorder.span("invocation"):
+                    return fn(*args, **kwargs)
+            finally:
+                if ENABLED:
+                    for document in _recorder.documents():
+                        print(json.dumps(document))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,85 @@
+""" Parser backends that turn a boxofficemojo page into Movie records.
+
+Every backend module exposes the same two functions:
+    parse_daily_ranking(html: str, d: date) -> list[Movie]
+    parse_movie_detail(html: str, id: str, since_nth_day: int = None) -> Movie
+
+The backend is picked by the environment variable "parser_backend".
+"""
+import os
+import re
+import importlib
+from datetime import datetime
+
+__all__ = ["soup_parser", "stream_parser"]
+
+# backend name => module name, modules are imported on first use so that
+# bs4 is never loaded when the streaming backend is selected.
+PARSERS = {
+    "soup": "soup_parser",
+    "stream": "stream_parser",
+}
+
+DEFAULT_PARSER = "stream"
+
+# used to extract the movie id from a link like "/release/rl1077904129/?ref_=..."
+ID_PATTERN = r"/release/(\w+)/\?ref_"
+
+
+def get_parser(name: str = None):
+    """Return the parser backend module
+    Args:
+        name: one of PARSERS, defaults to env "parser_backend".
+    """
+    if name is None:
+        name = os.environ.get("parser_backend", DEFAULT_PARSER)
+    if name not in PARSERS:
+        raise ValueError(
+            f"unknown parser backend {name}, expect one of {list(PARSERS)}"
+        )
+    return importlib.import_module(f".{PARSERS[name]}", __name__)
+
+
+def string_to_number(value: str):
+    """Convert the dollar value into an integer
+    E.g. "$3,875,483" => 3875483
+    """
+    number = value.replace("$", "").replace(",", "")
+
+    # Just in case
+    try:
+        # convert the string to an integer
+        number = int(number)
+        return number
+    except ValueError:
+        raise ValueError(f"value {value} failed to convert to an integer")
+
+
+def is_number(value: str) -> bool:
+    """True if value is a (comma separated) number, E.g. "4,178" but not "-" """
+    return value.strip().replace(",", "").isnumeric()
+
+
+def to_rank(value: str) -> int:
+    """A day without ranking is marked as "-", make -1 be no information"""
+    return string_to_number(value) if is_number(value) else -1
+
+
+def parse_summaries(summaries: dict[str, str]):
+    """Extract (distributor, num_of_theaters, release_date) from the summary
+    block of a release page, shared by all backends.
+    """
+    distributor = summaries["Distributor"].replace("See full company information", "")
+    num_of_theaters = string_to_number(
+        re.findall(r"\d+", summaries["Widest Release"].replace(",", ""))[0]
+    )
+
+    # handle special conditions for "release_date"
+    release_date = None
+    for key in summaries:
+        if key.startswith("Release Date"):
+            release_date = datetime.strptime(
+                summaries[key][:12].strip(), "%b %d, %Y"
+            ).date()
+
+    return distributor, num_of_theaters, release_date
@@ -0,0 +1,375 @@
+""" Streaming parser backend, built on the standard library html.parser.
+
+Instead of building a tree of the whole page, the page is fed to an event
+based parser that only materializes the <tr> rows under #table, the title
+and the summary block, and stops as soon as the table is closed.
+Field of interest are the same as documented in soup_parser.
+"""
+import re
+from html.parser import HTMLParser
+from datetime import date, timedelta
+
+from src.record import Movie, DailyRecord
+from src.parsers import (
+    ID_PATTERN,
+    string_to_number,
+    is_number,
+    to_rank,
+    parse_summaries,
+)
+
+
+class Cell:
+    """A <td>/<th> of a row, with the href and text of every <a> inside"""
+
+    __slots__ = ("classes", "text", "anchors")
+
+    def __init__(self, classes: list[str]):
+        self.classes = classes
+        self.text = []  # joined into a string when the cell is closed
+        self.anchors = []  # list of [href, text]
+
+
+class StopParsing(Exception):
+    """Raised from inside the handlers once everything needed is extracted"""
+
+
+class PageExtractor(HTMLParser):
+    def __init__(self, need_header: bool = False):
+        super().__init__(convert_charrefs=True)
+        # whether title and summary must be seen before stopping
+        self.need_header = need_header
+
+        self.title = None
+        self.summaries: list[list[str]] = []  # span texts of each summary entry
+        self.rows: list[list[Cell]] = []
+        self.found_table = False
+
+        # state of #table
+        self._table_tag = None
+        self._table_depth = 0
+        self._row = None
+        self._cell = None
+        self._anchor = None
+
+        # state of the summary block, depth counts nested <div>
+        self._summary_done = False
+        self._summary_depth = 0
+        self._entry = None
+        self._open_spans = []
+
+        # state of the title
+        self._title_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._table_depth:
+            if tag == self._table_tag:
+                self._table_depth += 1
+            if tag == "tr":
+                self._close_row()
+                self._row = []
+            elif (tag == "td" or tag == "th") and self._row is not None:
+                self._close_cell()
+                self._cell = Cell(_classes(attrs))
+            elif tag == "a" and self._cell is not None:
+                self._anchor = [_attr(attrs, "href"), []]
+                self._cell.anchors.append(self._anchor)
+            return
+
+        if self._summary_depth:
+            if tag == "div":
+                self._summary_depth += 1
+                if self._summary_depth == 2:
+                    # a direct child of the summary block is an entry
+                    self._entry = []
+                    self.summaries.append(self._entry)
+            elif tag == "span" and self._entry is not None:
+                self._entry.append([])
+                self._open_spans.append(len(self._entry) - 1)
+            return
+
+        if not self.found_table and _attr(attrs, "id") == "table":
+            self.found_table = True
+            self._table_tag = tag
+            self._table_depth = 1
+        elif tag == "div" and not self._summary_done:
+            if "mojo-summary-values" in _classes(attrs):
+                self._summary_depth = 1
+        elif tag == "h1" and self.title is None and self._title_parts is None:
+            if "a-size-extra-large" in _classes(attrs):
+                self._title_parts = []
+
+    def handle_endtag(self, tag):
+        if self._table_depth:
+            if tag == "a":
+                self._anchor = None
+            elif tag == "td" or tag == "th":
+                self._close_cell()
+            elif tag == "tr":
+                self._close_row()
+
+            if tag == self._table_tag:
+                self._table_depth -= 1
+                if self._table_depth == 0:
+                    self._close_row()
+                    if not self.need_header or self._summary_done:
+                        raise StopParsing()
+            return
+
+        if self._summary_depth:
+            if tag == "div":
+                self._summary_depth -= 1
+                if self._summary_depth == 1:
+                    self._entry = None
+                    self._open_spans = []
+                elif self._summary_depth == 0:
+                    self._summary_done = True
+            elif tag == "span" and self._open_spans:
+                self._open_spans.pop()
+            return
+
+        if tag == "h1" and self._title_parts is not None:
+            self.title = "".join(self._title_parts)
+            self._title_parts = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.text.append(data)
+            if self._anchor is not None:
+                self._anchor[1].append(data)
+        elif self._open_spans:
+            for i in self._open_spans:
+                self._entry[i].append(data)
+        elif self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def _close_cell(self):
+        if self._cell is not None:
+            cell = self._cell
+            cell.text = "".join(cell.text)
+            for anchor in cell.anchors:
+                anchor[1] = "".join(anchor[1])
+            self._row.append(cell)
+            self._cell = None
+            self._anchor = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+
+def _attr(attrs: list[tuple], name: str):
+    for key, value in attrs:
+        if key == name:
+            return value
+    return None
+
+
+def _classes(attrs: list[tuple]) -> list[str]:
+    value = _attr(attrs, "class")
+    return value.split() if value else []
+
+
+def _find(row: list[Cell], class_: str) -> Cell:
+    for cell in row:
+        if class_ in cell.classes:
+            return cell
+    return None
+
+
+def _find_all(row: list[Cell], class_: str) -> list[Cell]:
+    return [cell for cell in row if class_ in cell.classes]
+
+
+def extract(html: str, start_marker: str, need_header: bool = False):
+    """Run the PageExtractor over html
+
+    Parsing starts at the tag containing start_marker (the whole page if it
+    is not found), skipping the <head>, scripts and navigation in front of it.
+    """
+    extractor = PageExtractor(need_header=need_header)
+
+    start = html.find(start_marker)
+    start = html.rfind("<", 0, start) if start > 0 else 0
+
+    try:
+        extractor.feed(html[max(start, 0) :])
+        extractor.close()
+    except StopParsing:
+        pass
+
+    if not extractor.found_table:
+        raise ValueError("page does not contain a #table")
+    return extractor
+
+
+def parse_daily_ranking(html: str, d: date) -> list[Movie]:
+    """Parse daily ranking
+    Args:
+        html: the raw page of /date/{d}.
+        d: the date of the page.
+    Returns:
+        A list of parsed movie record.
+
+    """
+    extractor = extract(html, start_marker='id="table"')
+
+    movies: list[Movie] = []
+    # ignore the header row
+    for row in extractor.rows[1:]:
+        rank: int = string_to_number(
+            _find(row, "mojo-field-type-rank").text.strip()
+        )
+        href, title = _find(row, "mojo-field-type-release").anchors[0]
+        href: str = re.findall(ID_PATTERN, href)[0]
+
+        daily_gross: int = string_to_number(
+            _find(row, "mojo-field-type-money").text.strip()
+        )
+
+        numbers = _find_all(row, "mojo-field-type-positive_integer")
+        num_of_theaters: int = (
+            string_to_number(numbers[1].text) if is_number(numbers[1].text) else 0
+        )
+        num_of_days_in_theater: int = string_to_number(numbers[2].text)
+
+        # because num_of_days_in_theater starts with 1, substract 1
+        release_date = d - timedelta(days=num_of_days_in_theater - 1)
+
+        # special case: somtimes a row does not have a "studio" column, simply marked as "None"
+        studios = _find(row, "mojo-field-type-release_studios").anchors
+        distributor = studios[0][1].strip() if studios else "None"
+
+        movies.append(
+            Movie(
+                id=href,
+                title=title.strip(),
+                release_date=release_date,
+                revenues={num_of_days_in_theater: DailyRecord(rank, daily_gross)},
+                num_of_theaters=num_of_theaters,
+                distributor=distributor,
+            )
+        )
+    return movies
+
+
+def extract_header(html: str) -> PageExtractor:
+    """Run the PageExtractor over the title and summary in front of #table"""
+    table = html.find('id="table"')
+    if table < 0:
+        raise ValueError("page does not contain a #table")
+
+    start = max(html.find("<h1"), 0)
+    extractor = PageExtractor(need_header=True)
+    extractor.feed(html[start : html.rfind("<", 0, table)])
+    extractor.close()
+    return extractor
+
+
+def _parse_row(fragment: str) -> list[Cell]:
+    """Parse the html of a single <tr> of #table"""
+    extractor = PageExtractor()
+    try:
+        extractor.feed(f'<table id="table">{fragment}</table>')
+        extractor.close()
+    except StopParsing:
+        pass
+    return extractor.rows[0]
+
+
+def _detail_record(row: list[Cell]) -> tuple[int, DailyRecord]:
+    """(nth day, DailyRecord) of a row of the release page table"""
+    rank: int = to_rank(_find(row, "mojo-field-type-rank").text.strip())
+
+    daily_gross: int = string_to_number(
+        _find(row, "mojo-field-type-money").text.strip()
+    )
+
+    numbers = _find_all(row, "mojo-field-type-positive_integer")
+    num_of_days_in_theater: int = string_to_number(numbers[1].text)
+
+    return num_of_days_in_theater, DailyRecord(rank, daily_gross)
+
+
+def _records_after(html: str, since_nth_day: int) -> dict[int, DailyRecord]:
+    """Records of the days after since_nth_day, read from the last row of #table
+    backward until a known day. The rows are located by plain string search,
+    only the new ones go through the html parser.
+    Returns:
+        The records, None if the rows are not in ascending day order.
+    """
+    table = html.find('id="table"')
+    header = html.find("<tr", table)
+    end = html.find("</table>", table)
+    if table < 0 or header < 0 or end < 0:
+        return None
+
+    # the first row has the lowest day when the rows are in ascending order
+    first = html.find("<tr", header + 1, end)
+    if first < 0:
+        return dict()
+    second = html.find("<tr", first + 1, end)
+    second = second if second >= 0 else end
+    first_nth_day, _ = _detail_record(_parse_row(html[first:second]))
+
+    records = dict()
+    previous = None
+    while True:
+        start = html.rfind("<tr", header + 1, end)
+        if start < 0:
+            break
+
+        nth_day, record = _detail_record(_parse_row(html[start:end]))
+        if nth_day < first_nth_day or (previous is not None and nth_day >= previous):
+            return None
+        if nth_day <= since_nth_day:
+            break
+
+        records[nth_day] = record
+        previous, end = nth_day, start
+
+    return dict(sorted(records.items()))
+
+
+def parse_movie_detail(html: str, id: str, since_nth_day: int = None) -> Movie:
+    """Parse the release page of a movie
+    Args:
+        html: the raw page of /release/{id}.
+        id: the movie id.
+        since_nth_day: only parse the records after this nth day, e.g. the
+            newest day already stored.
+    Returns:
+        The parsed movie with its full revenue history, or only the records
+        after since_nth_day.
+
+    """
+    revenues = None
+    if since_nth_day is not None:
+        extractor = extract_header(html)
+        revenues = _records_after(html, since_nth_day)
+
+    if revenues is None:
+        extractor = extract(html, start_marker="<h1", need_header=True)
+        # ignore the header row
+        revenues = dict(_detail_record(row) for row in extractor.rows[1:])
+        if since_nth_day is not None:
+            revenues = {n: r for n, r in revenues.items() if n > since_nth_day}
+
+    title = extractor.title.strip()
+
+    summaries = dict()
+    for spans in extractor.summaries:
+        summaries["".join(spans[0]).strip()] = "".join(spans[1]).strip()
+
+    distributor, num_of_theaters, release_date = parse_summaries(summaries)
+
+    return Movie(
+        id=id,
+        title=title,
+        release_date=release_date,
+        revenues=revenues,
+        num_of_theaters=num_of_theaters,
+        distributor=distributor,
+    )
@@ -0,0 +1,168 @@
+""" Bulk crawls with the download and the parsing in separate stages.
+
+crawl_daily_rankings() downloads and parses each page in the same thread, so
+on a long backfill the parsing holds the GIL while the downloads wait. Here
+the pages are downloaded by a thread pool (I/O bound) and handed to a process
+pool that parses them (CPU bound), on every core:
+
+    fetch threads --html--> parse processes --Movie--> in order to the caller
+
+At most `window` pages are in flight, downloaded or parsed, and the oldest is
+always yielded first. A slow consumer stops new downloads instead of letting
+parsed pages pile up, so memory stays flat however long the range is.
+
+Process pools need the POSIX semaphores of /dev/shm, which AWS Lambda does
+not provide: use parse_workers=0 there to parse in the fetch threads.
+"""
+import os
+import time
+from collections import deque
+from datetime import date, timedelta
+from typing import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import crawler, metrics
+from .record import Movie
+from .parsers import get_parser, DEFAULT_PARSER
+from .fetcher import TokenBucket
+from .cache import max_age_for
+
+
+def parse_ranking(parser: str, html: str, d: date) -> tuple[list[Movie], float]:
+    """Parse a ranking page in a worker process
+    Returns:
+        (movies, parse time in milliseconds), spans recorded in the worker are
+        lost so the parent records the time.
+    """
+    started = time.perf_counter()
+    movies = get_parser(parser).parse_daily_ranking(html, d)
+    return movies, (time.perf_counter() - started) * 1000
+
+
+def parse_movie(parser: str, html: str, id: str) -> tuple[Movie, float]:
+    """Parse a release page in a worker process, see parse_ranking()"""
+    started = time.perf_counter()
+    movie = get_parser(parser).parse_movie_detail(html, id)
+    return movie, (time.perf_counter() - started) * 1000
+
+
+def pipeline_daily_rankings(
+    start: date,
+    end: date,
+    fetch_concurrency: int = 4,
+    parse_workers: int = None,
+    window: int = None,
+    rate: float = None,
+) -> Iterator[tuple[date, list[Movie]]]:
+    """Crawl daily rankings of every date from start to end (both inclusive)
+    Args:
+        start, end: the date range, end may be before start to crawl backward.
+        fetch_concurrency: number of pages downloaded at the same time.
+        parse_workers: number of parsing processes, defaults to the CPU count,
+            0 parses in the fetch threads.
+        window: maximum pages in flight, defaults to twice the workers.
+        rate: maximum requests per second, defaults to the shared limiter.
+    Yields:
+        (date, list[Movie]) in the order of the range.
+    """
+    step = 1 if end >= start else -1
+    dates = (
+        start + timedelta(days=i) for i in range(0, (end - start).days + step, step)
+    )
+
+    def fetch_page(d: date) -> str:
+        url = f"{crawler.BASE_URL}/date/{d.isoformat()}"
+        with metrics.span("crawl.fetch_ranking"):
+            return crawler.fetch(url, limiter=limiter, max_age=max_age_for(d))
+
+    limiter = TokenBucket(rate) if rate else None
+    yield from run_pipeline(
+        dates,
+        fetch_page,
+        parse_ranking,
+        "crawl.parse_ranking",
+        fetch_concurrency,
+        parse_workers,
+        window,
+    )
+
+
+def pipeline_movie_details(
+    ids: Iterable[str],
+    fetch_concurrency: int = 4,
+    parse_workers: int = None,
+    window: int = None,
+) -> Iterator[tuple[str, Movie]]:
+    """Crawl the release pages of ids, see pipeline_daily_rankings()
+    Yields:
+        (id, Movie) in the order of ids.
+    """
+
+    def fetch_page(id: str) -> str:
+        with metrics.span("crawl.fetch_movie"):
+            return crawler.fetch(f"{crawler.BASE_URL}/release/{id}")
+
+    yield from run_pipeline(
+        ids,
+        fetch_page,
+        parse_movie,
+        "crawl.parse_movie",
+        fetch_concurrency,
+        parse_workers,
+        window,
+    )
+
+
+def run_pipeline(
+    keys: Iterable,
+    fetch_page,
+    parse,
+    parse_metric: str,
+    fetch_concurrency: int,
+    parse_workers: int = None,
+    window: int = None,
+) -> Iterator[tuple]:
+    """Download fetch_page(key) in threads and parse(parser, html, key) in
+    processes, yielding (key, parsed) in the order of keys
+    """
+    parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+    window = window or 2 * (fetch_concurrency + parse_workers)
+    # resolved here, the workers do not necessarily share our environment
+    parser = os.environ.get("parser_backend", DEFAULT_PARSER)
+
+    fetchers = ThreadPoolExecutor(max_workers=fetch_concurrency)
+    parsers = ProcessPoolExecutor(parse_workers) if parse_workers > 0 else None
+
+    def fetch_and_submit(key) -> Future:
+        html = fetch_page(key)
+        metrics.count("crawl.bytes", len(html), "Bytes")
+        if parsers is None:
+            future = Future()
+            future.set_result(parse(parser, html, key))
+            return future
+        # hand the page over without waiting, the thread goes on downloading
+        return parsers.submit(parse, parser, html, key)
+
+    # (key, future of the future parse), oldest first
+    in_flight = deque()
+    try:
+        for key in keys:
+            in_flight.append((key, fetchers.submit(fetch_and_submit, key)))
+            if len(in_flight) >= window:
+                yield finish(in_flight.popleft(), parse_metric)
+        while in_flight:
+            yield finish(in_flight.popleft(), parse_metric)
+    finally:
+        # the consumer may stop early, drop what was not started
+        for _, future in in_flight:
+            future.cancel()
+        fetchers.shutdown(wait=True)
+        if parsers is not None:
+            parsers.shutdown(wait=True, cancel_futures=True)
+
+
+def finish(item: tuple[object, Future], parse_metric: str) -> tuple:
+    key, fetched = item
+    parsed, milliseconds = fetched.result().result()
+    metrics.observe(parse_metric, milliseconds)
+    return key, parsed
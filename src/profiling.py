@@ -0,0 +1,122 @@
+""" Opt-in CPU and allocation profiles of handler invocations.
+
+An invocation is profiled when one of its SQS records has "profile": true in
+its body, or else with a probability of 1 / env "profile_sample_rate" (0, the
+default, never samples). The invocation then runs under cProfile and
+tracemalloc, and two objects are written to the storage backend:
+
+    {PROFILING_PREFIX}/{handler}/{timestamp}-{id}.prof  pstats file, open it
+                                                        with pstats or snakeviz
+    {PROFILING_PREFIX}/{handler}/{timestamp}-{id}.txt   top functions by
+                                                        cumulative time and top
+                                                        allocation sites
+
+cProfile only sees the thread running the handler, time spent in worker
+threads shows up as waiting on them. tracemalloc sees every thread. The
+profilers are only imported by the invocations using them.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import random
+import functools
+
+from src import metrics
+from src.backends import ObjectStore
+
+SAMPLE_RATE = int(os.environ.get("profile_sample_rate", "0"))
+PROFILING_PREFIX = os.environ.get("profiling_prefix", "profiles")
+# number of functions and allocation sites in the text report
+TOP = int(os.environ.get("profile_top", "30"))
+
+
+def requested(event: dict) -> bool:
+    """True if a record of the event asks for a profile"""
+    for record in event.get("Records", []):
+        try:
+            body = json.loads(record["body"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if isinstance(body, dict) and body.get("profile") is True:
+            return True
+    return False
+
+
+def sampled(rate: int = None) -> bool:
+    rate = rate if rate is not None else SAMPLE_RATE
+    return rate > 0 and random.randrange(rate) == 0
+
+
+def report(profiler, snapshot, peak: int) -> str:
+    """Top functions of the cProfile.Profile profiler by cumulative time, and
+    top allocation sites of the tracemalloc.Snapshot snapshot
+    """
+    import pstats
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(TOP)
+
+    out.write(f"\nallocations, peak {peak / 1024:.1f} KiB\n")
+    for stat in snapshot.statistics("lineno")[:TOP]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+
+def save(storage: ObjectStore, handler: str, profiler, snapshot, peak) -> str:
+    """Write the profile and its report
+    Returns:
+        The key of the .prof object, the report is next to it.
+    """
+    import marshal
+
+    base = f"{PROFILING_PREFIX}/{handler}/{time.strftime('%Y%m%dT%H%M%S')}"
+    base = f"{base}-{uuid.uuid4().hex[:8]}"
+
+    # same content as Profile.dump_stats(), without a local file
+    profiler.create_stats()
+    storage.put(f"{base}.prof", marshal.dumps(profiler.stats))
+    text = report(profiler, snapshot, peak)
+    storage.put(f"{base}.txt", text.encode("utf-8"))
+    return f"{base}.prof"
+
+
+def profiled(handler: str, storage: ObjectStore):
+    """Decorate a lambda_handler to profile the invocations that are
+    requested() or sampled(), saving the results in storage
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            if not (requested(event) or sampled()):
+                return fn(event, context)
+
+            import cProfile
+            import tracemalloc
+
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(fn, event, context)
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if not tracing:
+                    tracemalloc.stop()
+
+                metrics.count("profiles")
+                # a failed upload must not fail the invocation
+                try:
+                    key = save(storage, handler, profiler, snapshot, peak)
+                    print(f"Profile saved as {key}")
+                except Exception as err:
+                    print(f"Failed to save the profile, {err=}")
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,250 @@
+""" Read path of the stored rankings and movies.
+
+QueryService answers "ranking of date D", "movie X with its revenue series"
+and "rankings from D1 to D2" on top of any ObjectStore. Single objects go
+through an ObjectCache of decoded objects:
+
+- LRU, bounded by the size of the stored bodies (max_bytes).
+- An entry younger than revalidate_seconds is served as is; older ones are
+  revalidated by a conditional GET on their ETag, a 304 keeps the decoded
+  object.
+- Concurrent reads of the same key share one GET and one decode.
+
+In "delta" mode (movie_update_mode, see src/deltas.py) a movie is its base
+object combined with the deltas not compacted yet, listed on every read. The
+delta objects are cached like the base, and the ETag of the movie covers the
+delta keys so that a new delta changes it.
+
+Ranges are read from the ranking archive (see src/archive.py), a few ranged
+reads per shard, and are not cached.
+
+src/server.py serves it over HTTP.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from datetime import date, timedelta
+from typing import Any, Callable
+
+from src import archive, deltas
+from src.record import Movie
+from src.backends import ObjectStore, NoSuchKey, NotModified
+from src.encoders import get_encoder, get_encoder_for_key
+
+
+@dataclass
+class CachedObject:
+    value: Any  # the decoded object
+    etag: str
+    size: int  # size of the stored body
+    checked_at: float  # last time the etag was confirmed by the storage
+
+
+class ObjectCache:
+    """Decoded objects of storage by key, see the module docstring
+    Args:
+        max_bytes: bound of the total size of the stored bodies cached.
+        revalidate_seconds: age after which an entry is revalidated.
+    """
+
+    def __init__(
+        self, storage: ObjectStore, max_bytes: int, revalidate_seconds: float = 30
+    ):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+
+        self.entries: OrderedDict[str, CachedObject] = OrderedDict()
+        self.total_bytes = 0
+        self.loading: dict[str, Future] = dict()  # key => read in progress
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "coalesced": 0}
+        self.lock = threading.Lock()
+
+    def get(self, key: str, decode: Callable[[bytes], Any]) -> tuple[Any, str]:
+        """The decoded object at key, shared by every reader: not to be modified
+        Returns:
+            (decode(body), etag)
+        Raises:
+            NoSuchKey.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if time.time() - entry.checked_at < self.revalidate_seconds:
+                    self.stats["hits"] += 1
+                    return entry.value, entry.etag
+
+            # the first reader of the key reads it, the others wait for it
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._load(key, entry, decode)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def _load(self, key: str, entry: CachedObject, decode) -> tuple[Any, str]:
+        try:
+            obj = self.storage.get(
+                key, if_none_match=entry.etag if entry is not None else None
+            )
+        except NotModified:
+            with self.lock:
+                entry.checked_at = time.time()
+                self.stats["revalidated"] += 1
+            return entry.value, entry.etag
+        except NoSuchKey:
+            self.discard(key)
+            raise
+
+        value = decode(obj.body)
+        with self.lock:
+            self.stats["misses"] += 1
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            size = len(obj.body)
+            self.entries[key] = CachedObject(value, obj.etag, size, time.time())
+            self.total_bytes += size
+            # the least recently used first
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+        return value, obj.etag
+
+    def discard(self, key: str):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+
+
+class QueryService:
+    """Rankings and movies as stored by the handlers
+    Args:
+        ranking_prefix, movies_prefix, archive_prefix: folders of the daily
+            rankings, the movies and the ranking shards.
+        extension: file extension of the stored rankings and movies.
+        cache: the ObjectCache of storage, defaults to 64 MiB.
+        deltas_prefix: folder of the revenue deltas, None when movies are
+            updated in place.
+    """
+
+    def __init__(
+        self,
+        storage: ObjectStore,
+        ranking_prefix: str,
+        movies_prefix: str,
+        archive_prefix: str,
+        extension: str,
+        cache: ObjectCache = None,
+        deltas_prefix: str = None,
+    ):
+        self.storage = storage
+        self.ranking_prefix = ranking_prefix
+        self.movies_prefix = movies_prefix
+        self.archive_prefix = archive_prefix
+        self.extension = extension
+        self.encoder = get_encoder(extension)
+        self.cache = cache if cache is not None else ObjectCache(storage, 64 << 20)
+        self.deltas_prefix = deltas_prefix
+
+    def ranking(self, d: date) -> tuple[list[Movie], str]:
+        """(ranking of d, etag)
+        Raises:
+            NoSuchKey if d is not stored.
+        """
+        key = f"{self.ranking_prefix}/{d.isoformat()}.{self.extension}"
+        return self.cache.get(key, self.encoder.decode_ranking)
+
+    def movie(self, movie_id: str) -> tuple[Movie, str]:
+        """(movie, etag)
+        Raises:
+            NoSuchKey if the movie is not stored.
+        """
+        key = f"{self.movies_prefix}/{movie_id}.{self.extension}"
+        movie, etag = self.cache.get(key, self.encoder.decode_movie)
+        if self.deltas_prefix is None:
+            return movie, etag
+
+        keys = deltas.list_deltas(self.storage, self.deltas_prefix, movie_id)
+        if len(keys) == 0:
+            return movie, etag
+        # the cached movie is shared, the deltas go into a copy of it
+        movie = replace(movie, revenues=dict(movie.revenues))
+        for delta_key in keys:
+            encoder = get_encoder_for_key(delta_key)
+            days, _ = self.cache.get(delta_key, encoder.decode_ranking)
+            for day in days:
+                movie.merge_records(day.revenues)
+        # delta keys are never rewritten, the keys identify their content
+        writable = "\n".join([etag] + keys).encode("utf-8")
+        return movie, f'"{hashlib.blake2b(writable, digest_size=16).hexdigest()}"'
+
+    def rankings(self, start: date, end: date) -> list[tuple[date, list[Movie]]]:
+        """Rankings of the stored dates from start to end, in date order"""
+        return list(
+            archive.read_rankings(
+                self.storage, self.ranking_prefix, self.archive_prefix, start, end
+            )
+        )
+
+
+def ranking_to_dict(d: date, movies: list[Movie]) -> dict:
+    rows = []
+    for movie in movies:
+        for nth_day, record in movie.revenues.items():
+            rows.append(
+                {
+                    "id": movie.id,
+                    "title": movie.title,
+                    "nth_day": nth_day,
+                    "ranking": record.ranking,
+                    "revenue": record.revenue,
+                }
+            )
+    return {"date": d.isoformat(), "movies": rows}
+
+
+def movie_to_dict(movie: Movie) -> dict:
+    """The movie with its revenue series, the nth day 1 is the release date"""
+    series = []
+    for nth_day in sorted(movie.revenues):
+        record = movie.revenues[nth_day]
+        day = None
+        if movie.release_date is not None:
+            day = (movie.release_date + timedelta(days=nth_day - 1)).isoformat()
+        series.append(
+            {
+                "nth_day": nth_day,
+                "date": day,
+                "ranking": record.ranking,
+                "revenue": record.revenue,
+            }
+        )
+    return {
+        "id": movie.id,
+        "title": movie.title,
+        "release_date": movie.release_date.isoformat() if movie.release_date else None,
+        "distributor": movie.distributor,
+        "num_of_theaters": movie.num_of_theaters,
+        "gross": movie.gross_revenue(),
+        "revenues": series,
+    }
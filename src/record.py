@@ -1,3 +1,5 @@
+import json
+import hashlib
 from dataclasses import dataclass, field
 from datetime import date
 
@@ -21,6 +23,10 @@ class Movie:
     num_of_theaters: int = field(default=-1)  # make -1 be no information
     distributor: str = field(default=None)
 
+    def __post_init__(self):
+        # nth day keys come back as strings from json, always keep them as int
+        self.revenues = {int(k): v for k, v in self.revenues.items()}
+
     def gross_revenue(self):
         # if (max(self.revenues.keys()) != len(self.revenues)):
         #     raise ValueError("Not enough data")
@@ -29,7 +35,27 @@ class Movie:
     def merge_records(self, revenues: dict[DailyRecord]):
         """Usage: add revenues from other day's to this"""
         for nth_day, revenue in revenues.items():
-            self.revenues[nth_day] = revenue
+            self.revenues[int(nth_day)] = revenue
 
     def newest_nth_day(self):
         return max(self.revenues.keys())
+
+
+def content_hash(movies: list[Movie]) -> str:
+    """Digest of the parsed rows of movies, independent of the file format
+    and of the order of the revenues. Stored as object metadata "content-hash"
+    to skip writing objects that did not change.
+    """
+    rows = [
+        [
+            movie.id,
+            movie.title,
+            movie.release_date.isoformat() if movie.release_date else None,
+            movie.num_of_theaters,
+            movie.distributor,
+            sorted([n, r.ranking, r.revenue] for n, r in movie.revenues.items()),
+        ]
+        for movie in movies
+    ]
+    writable = json.dumps(rows, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(writable, digest_size=16).hexdigest()
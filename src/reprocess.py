@@ -0,0 +1,307 @@
+""" Offline rebuild of the movie objects from the stored rankings.
+
+Every daily ranking has the id, title, nth day, ranking and revenue of each
+movie in the chart that day, so the movies can be rebuilt without a single
+request to the site, e.g. after a parser fix or a change of the movie codec:
+
+    read_rankings --rows--> spill file per shard --> process pool --> bulk PUTs
+
+The rankings are streamed from the archive (see src/archive.py) in a single
+pass, and their rows appended to a spill file per shard, picked by a stable
+hash of the movie id so that each movie is rebuilt by exactly one worker.
+Only the ids of each shard stay in memory. A worker reads the rows of its
+shard, merges them into the stored movies with merge_records and encodes only
+the movies whose content hash changed. The parent does the I/O: the stored
+movies are read and the results written by a thread pool, and the manifest
+and the index are updated once at the end.
+
+Only the revenues are rebuilt. A movie ranked but not stored is left alone,
+a ranking row lacks its distributor and widest release: its id is returned
+to be crawled by movie_handler. With fresh=True the revenues are rebuilt from
+the rankings only, the days known from the release page alone are lost.
+"""
+import os
+import zlib
+import pickle
+import tempfile
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from src import archive, metrics
+from src.record import DailyRecord, content_hash
+from src.backends import ObjectStore, NoSuchKey, PreconditionFailed
+from src.encoders import get_encoder
+from src.encoders.compression import compress, content_encoding, COMPRESSION
+from src.manifest import Manifest, ManifestEntry
+from src.indexes import MovieIndex, IndexEntry
+
+# stored movies read and rebuilt movies written at the same time
+IO_WORKERS = 16
+
+
+@dataclass
+class Rebuilt:
+    movie_id: str
+    writable: bytes  # None when the stored object has the same rows already
+    digest: str
+    entry: ManifestEntry  # etag of the stored object, set again once written
+    index: IndexEntry
+
+
+def shard_of(movie_id: str, shards: int) -> int:
+    """Stable across processes, unlike hash()"""
+    return zlib.crc32(movie_id.encode("utf-8")) % shards
+
+
+def read_rows(path: str):
+    """Rows (id, nth_day, ranking, revenue, release_date) of a spill file"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
+
+def rebuild_shard(
+    extension: str,
+    encoding: str,
+    path: str,
+    stored: dict[str, tuple[bytes, str, str]],
+    fresh: bool = False,
+) -> list[Rebuilt]:
+    """Rebuild the stored movies of one shard, in a worker process
+    Args:
+        extension, encoding: codec and compression of the written objects,
+            resolved by the parent.
+        path: spill file of the rows of the shard, in date order.
+        stored: movie id => (body, content hash, etag) of the stored movies,
+            the rows of other movies are ignored.
+        fresh: ignore the stored revenues.
+    Returns:
+        A Rebuilt per stored movie.
+    """
+    encoder = get_encoder(extension)
+    movies = dict()
+    for id, nth_day, ranking, revenue, release_date in read_rows(path):
+        if id not in stored:
+            continue
+        movie = movies.get(id)
+        if movie is None:
+            movie = movies[id] = encoder.decode_movie(stored[id][0])
+            if fresh:
+                movie.revenues = dict()
+            if movie.release_date is None:
+                movie.release_date = release_date
+        movie.merge_records({nth_day: DailyRecord(ranking, revenue)})
+
+    rebuilt = []
+    for movie_id, movie in movies.items():
+        digest = content_hash([movie])
+        _, stored_digest, etag = stored.get(movie_id, (None, None, None))
+        writable = None
+        if digest != stored_digest:
+            writable = compress(encoder.encode_movie(movie), encoding)
+        entry = ManifestEntry(
+            newest_nth_day=movie.newest_nth_day(),
+            release_date=movie.release_date.isoformat(),
+            etag=etag,
+        )
+        rebuilt.append(
+            Rebuilt(movie_id, writable, digest, entry, IndexEntry.of(movie))
+        )
+    return rebuilt
+
+
+def reprocess_movies(
+    storage: ObjectStore,
+    ranking_prefix: str,
+    archive_prefix: str,
+    movies_prefix: str,
+    extension: str,
+    start: date,
+    end: date,
+    manifest: Manifest = None,
+    index: MovieIndex = None,
+    shards: int = 64,
+    workers: int = None,
+    fresh: bool = False,
+    spill_dir: str = None,
+) -> tuple[dict[str, int], list[str]]:
+    """Rebuild every stored movie ranked from start to end from the rankings
+    Args:
+        manifest, index: updated with the rebuilt movies when given.
+        shards: number of groups of movies, each rebuilt by one worker. More
+            shards keep fewer stored movies in memory at a time.
+        workers: number of processes, defaults to the CPU count, 0 rebuilds in
+            this process.
+        fresh: rebuild the revenues from the rankings only.
+        spill_dir: where the rows are spilled, defaults to a temporary
+            directory. Needs about the size of the rankings decoded.
+    Returns:
+        (counts of the movies "stored", "unchanged" and "failed",
+         ids of the movies ranked but not stored)
+    """
+    workers = os.cpu_count() if workers is None else workers
+    with tempfile.TemporaryDirectory(dir=spill_dir) as directory:
+        paths = [os.path.join(directory, f"{n}.rows") for n in range(shards)]
+        ids = spill(storage, ranking_prefix, archive_prefix, start, end, paths)
+        return rebuild_shards(
+            storage,
+            movies_prefix,
+            extension,
+            paths,
+            ids,
+            manifest,
+            index,
+            workers,
+            fresh,
+        )
+
+
+def spill(
+    storage: ObjectStore,
+    ranking_prefix: str,
+    archive_prefix: str,
+    start: date,
+    end: date,
+    paths: list[str],
+) -> list[set[str]]:
+    """Append the rows of every ranking to the spill file of their shard
+    Returns:
+        The ids of every shard.
+    """
+    shards = len(paths)
+    ids = [set() for _ in range(shards)]
+    files = [open(path, "ab") for path in paths]
+    try:
+        for d, movies in archive.read_rankings(
+            storage, ranking_prefix, archive_prefix, start, end
+        ):
+            rows = [[] for _ in range(shards)]
+            for movie in movies:
+                shard = shard_of(movie.id, shards)
+                ids[shard].add(movie.id)
+                for nth_day, r in movie.revenues.items():
+                    # the columnar ranking has no release date, nth day 1 is it
+                    released = movie.release_date or d - timedelta(days=nth_day - 1)
+                    rows[shard].append(
+                        (movie.id, nth_day, r.ranking, r.revenue, released)
+                    )
+            for shard, shard_rows in enumerate(rows):
+                if shard_rows:
+                    pickle.dump(shard_rows, files[shard])
+            metrics.count("reprocess.rankings")
+    finally:
+        for f in files:
+            f.close()
+    return ids
+
+
+def rebuild_shards(
+    storage: ObjectStore,
+    movies_prefix: str,
+    extension: str,
+    paths: list[str],
+    ids: list[set[str]],
+    manifest: Manifest,
+    index: MovieIndex,
+    workers: int,
+    fresh: bool,
+) -> tuple[dict[str, int], list[str]]:
+    """Rebuild the spilled shards, see reprocess_movies()"""
+    io = ThreadPoolExecutor(max_workers=IO_WORKERS)
+    processes = ProcessPoolExecutor(workers) if workers > 0 else None
+
+    def read(movie_id: str) -> tuple[str, tuple]:
+        try:
+            obj = storage.get(f"{movies_prefix}/{movie_id}.{extension}")
+        except NoSuchKey:
+            return movie_id, None
+        return movie_id, (obj.body, obj.metadata.get("content-hash"), obj.etag)
+
+    missing = []
+
+    def submit(path: str, shard_ids: set[str]) -> Future:
+        stored = dict()
+        for id, found in io.map(read, sorted(shard_ids)):
+            if found is None:
+                missing.append(id)
+            else:
+                stored[id] = found
+        args = (extension, COMPRESSION, path, stored, fresh)
+        if processes is None:
+            future = Future()
+            future.set_result(rebuild_shard(*args))
+            return future
+        return processes.submit(rebuild_shard, *args)
+
+    def write(rebuilt: Rebuilt) -> bool:
+        # conditional on the object read, a concurrent merge by the handlers
+        # fails the movie instead of being overwritten
+        try:
+            rebuilt.entry.etag = storage.put(
+                f"{movies_prefix}/{rebuilt.movie_id}.{extension}",
+                rebuilt.writable,
+                metadata={
+                    "newest-nth-day": str(rebuilt.entry.newest_nth_day),
+                    "content-hash": rebuilt.digest,
+                },
+                content_encoding=content_encoding(),
+                if_match=rebuilt.entry.etag,
+                if_none_match="*" if rebuilt.entry.etag is None else None,
+            )
+        except PreconditionFailed:
+            print(f"{rebuilt.movie_id} changed while rebuilding it, skipped")
+            return False
+        return True
+
+    counts = {"stored": 0, "unchanged": 0, "failed": 0}
+    manifest_changes, index_changes = dict(), dict()
+
+    def finish(future: Future):
+        rebuilt = future.result()
+        done = [r for r in rebuilt if r.writable is None]
+        changed = [r for r in rebuilt if r.writable is not None]
+        counts["unchanged"] += len(done)
+        for r, written in zip(changed, io.map(write, changed)):
+            if written:
+                counts["stored"] += 1
+                done.append(r)
+            else:
+                counts["failed"] += 1
+        # failed movies keep their manifest entry, the handler that changed
+        # them wrote its own
+        for r in done:
+            manifest_changes[r.movie_id] = r.entry
+            index_changes[r.movie_id] = r.index
+
+    # rebuilt shards in flight, the stored movies of the next ones are read
+    # while the oldest is rebuilt
+    in_flight = deque()
+    try:
+        for path, shard_ids in zip(paths, ids):
+            if len(shard_ids) == 0:
+                continue
+            in_flight.append(submit(path, shard_ids))
+            if len(in_flight) > max(workers, 1):
+                finish(in_flight.popleft())
+        while in_flight:
+            finish(in_flight.popleft())
+    finally:
+        io.shutdown(wait=True)
+        if processes is not None:
+            processes.shutdown(wait=True, cancel_futures=True)
+
+    if manifest is not None:
+        manifest.update(manifest_changes)
+    if index is not None:
+        index.update(index_changes)
+
+    metrics.count("reprocess.stored", counts["stored"])
+    metrics.count("reprocess.unchanged", counts["unchanged"])
+    metrics.count("reprocess.missing", len(missing))
+    return counts, sorted(missing)
+
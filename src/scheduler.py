@@ -0,0 +1,212 @@
+""" Backfill scheduler of the daily rankings.
+
+Instead of every ranking message asking for the day before it, the missing
+dates are computed from the ranking files already stored and handed out as
+date-range work units:
+    {"start": "2023-08-01", "end": "2023-08-07"}
+
+Units are planned newest first, never cross a stored date and span at most
+chunk_days days. At most `concurrency` units are in flight at any time, each
+one recorded as a lease in a checkpoint object:
+    {"leases": {"2023-08-01": {"end": "2023-08-07", "at": 1692000000}}}
+
+The checkpoint is written with a conditional PUT, so schedulers running in
+several containers never hand out the same dates twice. A lease is released
+once all its dates are stored, or when it expires (e.g. the message went to
+the dead letter queue), making its dates schedulable again.
+
+A date whose page is missing or cannot be parsed is never stored. The
+consumer records it in the checkpoint instead, which releases the lease too:
+    {"failed": {"2023-08-03": {"attempts": 1, "at": 1692000100}}}
+It is planned again until it failed max_attempts times, then left out of the
+backfill for good, unless its ranking gets stored some other way.
+"""
+import re
+import json
+import time
+from datetime import date, timedelta
+
+from src.backends import ObjectStore, get_if_changed, conditional_update
+
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})\.\w+$")
+
+
+def plan_ranges(
+    missing: list[date], chunk_days: int, limit: int = None
+) -> list[tuple[date, date]]:
+    """Group missing dates into (start, end) ranges of consecutive dates
+    Args:
+        missing: dates to crawl, newest first.
+        chunk_days: maximum number of days of a range.
+        limit: maximum number of ranges.
+    Returns:
+        The ranges, newest first, start <= end.
+    """
+    ranges = []
+    end = start = None
+    for d in missing:
+        if end is not None and d == start - timedelta(days=1):
+            if (end - d).days < chunk_days:
+                start = d
+                continue
+        if end is not None:
+            ranges.append((start, end))
+            if limit is not None and len(ranges) >= limit:
+                return ranges
+        end = start = d
+
+    if end is not None and (limit is None or len(ranges) < limit):
+        ranges.append((start, end))
+    return ranges
+
+
+class BackfillScheduler:
+    """Hands out the missing ranking dates as leased work units
+    Args:
+        storage: where the rankings and the checkpoint are stored.
+        prefix: folder of the ranking files, {prefix}/{date}.{extension}.
+        checkpoint_key: key of the checkpoint object.
+        earliest: oldest date of the backfill.
+        chunk_days: maximum days of a work unit.
+        concurrency: maximum work units in flight.
+        lease_seconds: after this long, an unfinished unit is handed out again.
+        max_attempts: failures of a date before it is left out of the backfill.
+    """
+
+    def __init__(
+        self,
+        storage: ObjectStore,
+        prefix: str,
+        checkpoint_key: str,
+        earliest: date,
+        chunk_days: int = 7,
+        concurrency: int = 4,
+        lease_seconds: int = 3600,
+        max_attempts: int = 3,
+    ):
+        self.storage = storage
+        self.prefix = prefix
+        self.checkpoint_key = checkpoint_key
+        self.earliest = earliest
+        self.chunk_days = chunk_days
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def stored_dates(self) -> set[date]:
+        dates = set()
+        for key in self.storage.list_keys(f"{self.prefix}/"):
+            match = DATE_PATTERN.search(key)
+            if match:
+                dates.add(date.fromisoformat(match.group(1)))
+        return dates
+
+    def load(self) -> tuple[dict, str]:
+        """Returns (checkpoint, etag of the checkpoint or None if absent)"""
+        body, etag = get_if_changed(self.storage, self.checkpoint_key)
+        checkpoint = json.loads(body) if body else dict()
+        checkpoint.setdefault("leases", dict())
+        checkpoint.setdefault("failed", dict())
+        return checkpoint, etag
+
+    def schedule(self, today: date = None, now: float = None) -> list[tuple]:
+        """Lease the next work units, up to the free concurrency
+        Args:
+            today: the backfill covers the dates before today.
+            now: current unix time.
+        Returns:
+            The new (start, end) units, newest first.
+        """
+        today = today if today is not None else date.today()
+        now = now if now is not None else time.time()
+
+        units = []
+
+        def mutate(checkpoint: dict) -> bytes:
+            # planned again on the leases of another scheduler after a conflict
+            nonlocal units
+            units = []
+            stored = self.stored_dates()
+            # dates stored since they failed are fine after all
+            failed = {
+                d: failure
+                for d, failure in checkpoint["failed"].items()
+                if date.fromisoformat(d) not in stored
+            }
+            # expired leases are dropped, their missing dates are planned again
+            leases = {
+                start: lease
+                for start, lease in checkpoint["leases"].items()
+                if now - lease["at"] < self.lease_seconds
+            }
+            # leases whose dates are all stored, or failed since, are done
+            leases = {
+                start: lease
+                for start, lease in leases.items()
+                if not self._is_done(start, lease, stored, failed)
+            }
+
+            free = self.concurrency - len(leases)
+            if free <= 0:
+                return None
+
+            leased = set()
+            for start, lease in leases.items():
+                leased.update(self._dates(start, lease["end"]))
+            given_up = {
+                date.fromisoformat(d)
+                for d, failure in failed.items()
+                if failure["attempts"] >= self.max_attempts
+            }
+
+            missing = [
+                d
+                for d in self._dates(self.earliest, today - timedelta(days=1))[::-1]
+                if d not in stored and d not in leased and d not in given_up
+            ]
+            units = plan_ranges(missing, self.chunk_days, limit=free)
+            if len(units) == 0:
+                return None
+
+            for start, end in units:
+                leases[start.isoformat()] = {"end": end.isoformat(), "at": now}
+            checkpoint = {"leases": leases, "failed": failed}
+            return json.dumps(checkpoint, sort_keys=True).encode("utf-8")
+
+        conditional_update(
+            self.storage, self.checkpoint_key, mutate, lambda conflict: self.load()
+        )
+        return units
+
+    def record_failures(self, dates: list[date], now: float = None):
+        """Record dates whose page is missing or cannot be parsed, they no
+        longer hold their lease and are planned again up to max_attempts
+        """
+        if len(dates) == 0:
+            return
+        now = now if now is not None else time.time()
+
+        def mutate(checkpoint: dict) -> bytes:
+            for d in dates:
+                failure = checkpoint["failed"].get(d.isoformat(), {"attempts": 0})
+                checkpoint["failed"][d.isoformat()] = {
+                    "attempts": failure["attempts"] + 1,
+                    "at": now,
+                }
+            return json.dumps(checkpoint, sort_keys=True).encode("utf-8")
+
+        conditional_update(
+            self.storage, self.checkpoint_key, mutate, lambda conflict: self.load()
+        )
+
+    def _dates(self, start, end) -> list[date]:
+        start = date.fromisoformat(start) if isinstance(start, str) else start
+        end = date.fromisoformat(end) if isinstance(end, str) else end
+        return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    def _is_done(self, start: str, lease: dict, stored: set, failed: dict) -> bool:
+        for d in self._dates(start, lease["end"]):
+            failure = failed.get(d.isoformat())
+            if d not in stored and (failure is None or failure["at"] < lease["at"]):
+                return False
+        return True
@@ -0,0 +1,94 @@
+""" Local HTTP front end of the QueryService, json in and out.
+
+    GET /rankings/2023-08-17                    ranking of a date
+    GET /rankings?start=2023-08-01&end=...      rankings of a date range
+    GET /movies/rl1077904129                    movie with its revenue series
+
+Single objects carry the ETag of the stored object and a request with a
+matching If-None-Match gets a 304. Run it with `python run_local.py serve`.
+"""
+import re
+import json
+from datetime import date
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.backends import NoSuchKey
+from src.query import QueryService, ranking_to_dict, movie_to_dict
+
+# longest range served by /rankings
+MAX_RANGE_DAYS = 366
+
+RANKING_PATH = re.compile(r"^/rankings/(\d{4}-\d{2}-\d{2})$")
+MOVIE_PATH = re.compile(r"^/movies/(\w+)$")
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: QueryService):
+        super().__init__(address, QueryHandler)
+        self.service = service
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        service = self.server.service
+        try:
+            match = RANKING_PATH.match(url.path)
+            if match:
+                d = date.fromisoformat(match.group(1))
+                movies, etag = service.ranking(d)
+                return self.respond(200, lambda: ranking_to_dict(d, movies), etag)
+
+            match = MOVIE_PATH.match(url.path)
+            if match:
+                movie, etag = service.movie(match.group(1))
+                return self.respond(200, lambda: movie_to_dict(movie), etag)
+
+            if url.path == "/rankings":
+                query = parse_qs(url.query)
+                start = date.fromisoformat(query["start"][0])
+                end = date.fromisoformat(query["end"][0])
+                if not 0 <= (end - start).days < MAX_RANGE_DAYS:
+                    raise ValueError(
+                        f"expect start <= end within {MAX_RANGE_DAYS} days"
+                    )
+                rankings = service.rankings(start, end)
+                return self.respond(
+                    200,
+                    lambda: {"rankings": [ranking_to_dict(*r) for r in rankings]},
+                )
+        except NoSuchKey:
+            return self.respond(404, lambda: {"error": "not found"})
+        except (KeyError, ValueError) as err:
+            return self.respond(400, lambda: {"error": str(err)})
+
+        return self.respond(404, lambda: {"error": f"no route {url.path}"})
+
+    def respond(self, status: int, document, etag: str = None):
+        """Send document() as json, or a 304 if the client has etag already"""
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = json.dumps(document()).encode("utf-8")
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service: QueryService, host: str = "127.0.0.1", port: int = 8080):
+    return QueryServer((host, port), service)
@@ -0,0 +1,96 @@
+import re
+import hashlib
+import pytest
+import pathlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+class StubSite(ThreadingHTTPServer):
+    """A local stand-in of boxofficemojo serving the pages in tests/fixtures.
+
+    Every /date/{d} is answered with the 2023-08-17 ranking page, and every
+    /release/{id} with its saved release page. Pages carry an ETag and
+    conditional GETs are answered with 304. Requested paths, response
+    status codes and client addresses are recorded for assertions.
+
+    Statuses appended to `errors` are served first, one per request, with an
+    error page, e.g. [503, 429] for a site that is failing then throttling.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.paths = []
+        self.statuses = []
+        self.clients = set()
+        self.errors = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def page(self, path: str):
+        if re.search(r"/date/\d{4}-\d{2}-\d{2}", path):
+            return (FIXTURES / "date_2023-08-17.html").read_bytes()
+        match = re.search(r"/release/(\w+)", path)
+        if match and (FIXTURES / f"release_{match.group(1)}.html").exists():
+            return (FIXTURES / f"release_{match.group(1)}.html").read_bytes()
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.paths.append(self.path)
+            self.server.clients.add(self.client_address)
+
+        with self.server.lock:
+            error = self.server.errors.pop(0) if self.server.errors else None
+
+        body = self.server.page(self.path)
+        etag = None
+        if error is not None:
+            status, body = error, b"<html>try again later</html>"
+        elif body is None:
+            status, body = 404, b"not found"
+        else:
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            status = 304 if self.headers.get("If-None-Match") == etag else 200
+
+        with self.server.lock:
+            self.server.statuses.append(status)
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_site(monkeypatch):
+    """Start a StubSite and point the crawler at it"""
+    server = StubSite()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr("src.crawler.BASE_URL", server.base_url)
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,59 @@
+import pytest
+from datetime import date
+
+from src.record import DailyRecord, Movie
+from src.encoders import get_encoder, get_encoder_for_key
+from src.encoders import json_encoder, columnar_encoder
+
+
+def make_ranking() -> list[Movie]:
+    return [
+        Movie(id="rl1", title="Barbie", revenues={28: DailyRecord(1, 3875483)}),
+        Movie(id="rl2", title="Oppenheimer", revenues={28: DailyRecord(2, 2571115)}),
+        Movie(id="rl3", title="Amélie", revenues={3: DailyRecord(-1, 0)}),
+    ]
+
+
+def make_movie() -> Movie:
+    return Movie(
+        id="1",
+        title="Mock",
+        release_date=date.fromisoformat("2023-08-17"),
+        revenues={1: DailyRecord(1, 1000), 2: DailyRecord(3, 700)},
+        num_of_theaters=1,
+        distributor=None,
+    )
+
+
+def test_ranking_round_trip():
+    movies = make_ranking()
+
+    expected = json_encoder.decode_ranking(json_encoder.encode_ranking(movies))
+    actual = columnar_encoder.decode_ranking(columnar_encoder.encode_ranking(movies))
+
+    assert actual == expected
+
+
+def test_movie_round_trip():
+    movie = make_movie()
+
+    expected = json_encoder.decode_movie(json_encoder.encode_movie(movie))
+    actual = columnar_encoder.decode_movie(columnar_encoder.encode_movie(movie))
+
+    assert actual == expected == movie
+
+
+def test_decode_wrong_kind():
+    writable = columnar_encoder.encode_movie(make_movie())
+
+    with pytest.raises(ValueError):
+        columnar_encoder.decode_ranking(writable)
+
+
+def test_registry():
+    assert get_encoder("json") is json_encoder
+    assert get_encoder("col") is columnar_encoder
+    assert get_encoder_for_key("movies/rl1.col") is columnar_encoder
+
+    with pytest.raises(ValueError):
+        get_encoder("parquet")
@@ -0,0 +1,60 @@
+import pytest
+from datetime import date
+
+from src.record import DailyRecord, Movie
+from src.encoders import json_encoder, columnar_encoder
+from src.encoders.compression import (
+    compress,
+    decompress,
+    content_encoding,
+)
+
+
+def make_movie() -> Movie:
+    return Movie(
+        id="1",
+        title="Mock",
+        release_date=date.fromisoformat("2023-08-17"),
+        revenues={n: DailyRecord(n, 1000 * n) for n in range(1, 60)},
+        num_of_theaters=1,
+        distributor=None,
+    )
+
+
+@pytest.mark.parametrize("encoder", [json_encoder, columnar_encoder])
+def test_decoders_accept_gzip(encoder):
+    movie = make_movie()
+    writable = encoder.encode_movie(movie)
+
+    compressed = compress(writable, "gzip", level=9)
+
+    assert len(compressed) < len(writable)
+    assert encoder.decode_movie(compressed) == movie
+    assert encoder.decode_movie(writable) == movie
+
+
+def test_gzip_is_deterministic():
+    data = json_encoder.encode_movie(make_movie())
+
+    assert compress(data, "gzip") == compress(data, "gzip")
+
+
+def test_identity():
+    data = b'{"id": "1"}'
+
+    assert compress(data, "identity") == data
+    assert decompress(data) == data
+    assert content_encoding("identity") is None
+    assert content_encoding("gzip") == "gzip"
+
+
+def test_zstd():
+    pytest.importorskip("zstandard")
+    data = json_encoder.encode_movie(make_movie())
+
+    assert decompress(compress(data, "zstd")) == data
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        compress(b"", "brotli")
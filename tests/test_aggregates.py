@@ -0,0 +1,76 @@
+from datetime import date
+
+from src.aggregates import Aggregates
+from src.backends.memory import MemoryObjectStore
+from src.record import DailyRecord, Movie
+
+AUG_17, AUG_18, SEP_1 = date(2023, 8, 17), date(2023, 8, 18), date(2023, 9, 1)
+
+
+def ranking(*rows) -> list[Movie]:
+    """rows of (id, distributor, revenue)"""
+    return [
+        Movie(
+            id=id,
+            title=id.title(),
+            revenues={10: DailyRecord(n + 1, revenue)},
+            distributor=distributor,
+        )
+        for n, (id, distributor, revenue) in enumerate(rows)
+    ]
+
+
+def test_ingest_aggregates():
+    aggregates = Aggregates(MemoryObjectStore(), "aggregates", top_n=2)
+
+    updated = aggregates.ingest(
+        {
+            AUG_17: ranking(("barbie", "wb", 300), ("oppenheimer", "uni", 200)),
+            AUG_18: ranking(("oppenheimer", "uni", 250), ("barbie", "wb", 150)),
+            SEP_1: ranking(("nun", "wb", 500), ("blue", None, 10), ("red", "None", 5)),
+        }
+    )
+
+    assert updated == [2023]
+    assert [(m["id"], m["gross"]) for m in aggregates.top(2023)] == [
+        ("nun", 500),
+        ("barbie", 450),
+    ]
+    assert aggregates.distributor_totals(2023) == {
+        "wb": 950,
+        "uni": 450,
+        "unknown": 15,
+    }
+    assert aggregates.distributor_totals(2023, 8) == {"wb": 450, "uni": 450}
+    assert aggregates.market_share(2023, 8) == {"wb": 0.5, "uni": 0.5}
+    assert aggregates.movie_gross("oppenheimer", [2023, 2024]) == 450
+
+
+def test_ingest_is_idempotent():
+    storage = MemoryObjectStore()
+    aggregates = Aggregates(storage, "aggregates")
+    aggregates.ingest({AUG_17: ranking(("barbie", "wb", 300))})
+    etag = storage.head("aggregates/2023.json").etag
+
+    # the same ranking again changes nothing
+    assert aggregates.ingest({AUG_17: ranking(("barbie", "wb", 300))}) == []
+    assert storage.head("aggregates/2023.json").etag == etag
+
+    # a corrected ranking replaces the day instead of adding to it
+    aggregates.ingest({AUG_17: ranking(("oppenheimer", "uni", 280))})
+    assert [(m["id"], m["gross"]) for m in aggregates.top(2023)] == [
+        ("oppenheimer", 280)
+    ]
+    assert aggregates.distributor_totals(2023) == {"uni": 280}
+
+
+def test_concurrent_ingests_are_merged():
+    storage = MemoryObjectStore()
+    first, second = Aggregates(storage, "aggregates"), Aggregates(storage, "aggregates")
+    first.ingest({AUG_17: ranking(("barbie", "wb", 300))})
+    second.ingest({AUG_18: ranking(("barbie", "wb", 150))})
+
+    # first's cached copy is outdated, the conditional GET refreshes it
+    first.ingest({SEP_1: ranking(("barbie", "wb", 50))})
+
+    assert second.movie_gross("barbie", [2023]) == 500
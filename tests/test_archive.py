@@ -0,0 +1,124 @@
+import pytest
+import pathlib
+from datetime import date, timedelta
+
+from src import archive
+from src.archive import read_rankings, pack_closed, invalidate, shard_key
+from src.backends.memory import MemoryObjectStore
+from src.encoders import get_encoder
+from src.parsers import get_parser
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+TODAY = date(2024, 1, 15)
+
+
+class CountingStore(MemoryObjectStore):
+    def __init__(self):
+        super().__init__()
+        self.gets = []
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        self.gets.append(key)
+        return super().get(key, if_none_match=if_none_match, byte_range=byte_range)
+
+
+def days(start: str, end: str) -> list[date]:
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+@pytest.fixture
+def storage():
+    """Daily rankings of 2023-11-01 to 2024-01-10, every other file in col"""
+    storage = CountingStore()
+    html = (FIXTURES / "date_2023-08-17.html").read_text(encoding="utf-8")
+    movies = get_parser().parse_daily_ranking(html, date(2023, 8, 17))
+    for n, d in enumerate(days("2023-11-01", "2024-01-10")):
+        extension = "col" if n % 2 else "json"
+        writable = get_encoder(extension).encode_ranking(movies)
+        storage.put(f"ranking/{d.isoformat()}.{extension}", writable)
+    return storage
+
+
+def expected(storage, d: date):
+    """The ranking of d decoded from its daily file"""
+    (key,) = storage.list_keys(f"ranking/{d.isoformat()}.")
+    body = MemoryObjectStore.get(storage, key).body
+    return get_encoder(key.rsplit(".", 1)[-1]).decode_ranking(body)
+
+
+def test_pack_closed_periods(storage):
+    assert pack_closed(storage, "ranking", "archive", TODAY) == [
+        "2023",
+        "2023-11",
+        "2023-12",
+    ]
+    # packed periods are not packed again
+    assert pack_closed(storage, "ranking", "archive", TODAY) == []
+
+    invalidate(storage, "archive", date(2023, 12, 5))
+    assert storage.list_keys("archive/") == ["archive/2023-11.shard"]
+    assert pack_closed(storage, "ranking", "archive", TODAY) == ["2023", "2023-12"]
+
+
+def test_day_rewritten_while_packing(storage, monkeypatch):
+    d = date(2023, 11, 6)
+    (key,) = storage.list_keys(f"ranking/{d.isoformat()}.")
+    rewritten = expected(storage, d)
+    rewritten[0].title = "Corrected"
+    get = storage.get
+
+    def racing_get(k, **kwargs):
+        obj = get(k, **kwargs)
+        if k == key:
+            # store_ranking rewrites the day and invalidates, no shard yet
+            storage.put(key, get_encoder("col").encode_ranking(rewritten))
+            invalidate(storage, "archive", d)
+        return obj
+
+    monkeypatch.setattr(storage, "get", racing_get)
+    assert archive.pack(storage, "ranking", "archive", "2023-11") is False
+    assert storage.list_keys("archive/") == []
+
+    # packed again with the new day
+    monkeypatch.setattr(storage, "get", get)
+    pack_closed(storage, "ranking", "archive", TODAY)
+    (_, movies), *_ = read_rankings(storage, "ranking", "archive", d, d)
+    assert movies[0].title == "Corrected"
+
+
+def test_read_rankings_with_ranged_reads(storage):
+    pack_closed(storage, "ranking", "archive", TODAY)
+    storage.gets.clear()
+
+    rankings = list(
+        read_rankings(storage, "ranking", "archive", date(2023, 11, 20), TODAY)
+    )
+
+    assert [d for d, _ in rankings] == days("2023-11-20", "2024-01-10")
+    assert all(movies == expected(storage, d) for d, movies in rankings)
+    # index and days of the 2023 shard, then the daily files of 2024 as its
+    # month is not packed
+    assert storage.gets.count(shard_key("archive", "2023")) == 2
+    assert len(storage.gets) == 2 + 1 + 10
+
+
+def test_read_rankings_within_a_month(storage, monkeypatch):
+    pack_closed(storage, "ranking", "archive", TODAY)
+    # the first read does not even hold the whole index
+    monkeypatch.setattr(archive, "HEAD_BYTES", 64)
+    storage.gets.clear()
+
+    start, end = date(2023, 12, 30), date(2024, 1, 1)
+    rankings = dict(read_rankings(storage, "ranking", "archive", start, end))
+
+    assert sorted(rankings) == days("2023-12-30", "2024-01-01")
+    assert rankings[date(2023, 12, 31)] == expected(storage, date(2023, 12, 31))
+    assert storage.gets.count(shard_key("archive", "2023-12")) == 3
+
+
+def test_read_rankings_without_shards(storage):
+    start, end = date(2023, 10, 30), date(2023, 11, 2)
+    rankings = list(read_rankings(storage, "ranking", "archive", start, end))
+
+    assert [d for d, _ in rankings] == days("2023-11-01", "2023-11-02")
@@ -0,0 +1,158 @@
+import pytest
+
+from src.backends import (
+    ObjectStore,
+    MessageQueue,
+    get_storage,
+    conditional_update,
+    NoSuchKey,
+    NotModified,
+    PreconditionFailed,
+)
+from src.backends.local import LocalObjectStore, LocalQueue
+from src.backends.memory import MemoryObjectStore, MemoryQueue
+
+
+@pytest.fixture(params=["memory", "local"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        return MemoryObjectStore()
+    return LocalObjectStore(str(tmp_path))
+
+
+@pytest.fixture(params=["memory", "local"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        return MemoryQueue()
+    return LocalQueue(str(tmp_path))
+
+
+def test_put_get_head(storage):
+    etag = storage.put(
+        "movies/rl1.json",
+        b"{}",
+        metadata={"newest-nth-day": "3"},
+        content_encoding="gzip",
+    )
+
+    obj = storage.get("movies/rl1.json")
+    assert obj.body == b"{}"
+    assert obj.etag == etag
+    assert obj.size == 2
+
+    head = storage.head("movies/rl1.json")
+    assert head.body is None
+    assert head.etag == etag
+    assert head.metadata == {"newest-nth-day": "3"}
+    assert head.content_encoding == "gzip"
+
+
+def test_missing_key(storage):
+    with pytest.raises(NoSuchKey):
+        storage.get("movies/missing.json")
+    with pytest.raises(NoSuchKey):
+        storage.head("movies/missing.json")
+
+
+def test_ranged_get(storage):
+    storage.put("archive/2023-08.shard", b"0123456789")
+
+    obj = storage.get("archive/2023-08.shard", byte_range=(2, 5))
+    assert obj.body == b"2345"
+    assert obj.size == 10
+    # the range is clamped to the end of the object
+    assert storage.get("archive/2023-08.shard", byte_range=(8, 20)).body == b"89"
+    assert storage.get("archive/2023-08.shard").body == b"0123456789"
+
+
+def test_conditional_get(storage):
+    etag = storage.put("manifest.json", b"1")
+    with pytest.raises(NotModified):
+        storage.get("manifest.json", if_none_match=etag)
+
+    storage.put("manifest.json", b"2")
+    assert storage.get("manifest.json", if_none_match=etag).body == b"2"
+
+
+def test_conditional_put(storage):
+    etag = storage.put("manifest.json", b"1", if_none_match="*")
+    with pytest.raises(PreconditionFailed):
+        storage.put("manifest.json", b"2", if_none_match="*")
+
+    new_etag = storage.put("manifest.json", b"2", if_match=etag)
+    with pytest.raises(PreconditionFailed):
+        storage.put("manifest.json", b"3", if_match=etag)
+    assert storage.get("manifest.json").etag == new_etag
+
+
+def test_conditional_update(storage):
+    def increment(body):
+        return str(int(body or b"0") + 1).encode("utf-8")
+
+    etag = conditional_update(storage, "counter", increment)
+    assert storage.get("counter").etag == etag
+
+    # the first PUT loses against a concurrent writer, increment is applied again
+    def load(conflict):
+        obj = storage.get("counter")
+        if not conflict:
+            storage.put("counter", b"10")
+        return obj.body, obj.etag
+
+    conditional_update(storage, "counter", increment, load)
+    assert storage.get("counter").body == b"11"
+
+    assert conditional_update(storage, "counter", lambda body: None) is None
+    assert storage.get("counter").body == b"11"
+
+
+def test_list_and_delete(storage):
+    for key in ["deltas/rl2/b.json", "deltas/rl1/a.json", "movies/rl1.json"]:
+        storage.put(key, b"x")
+
+    assert storage.list_keys("deltas/") == ["deltas/rl1/a.json", "deltas/rl2/b.json"]
+    assert storage.list_prefixes("deltas/") == ["deltas/rl1/", "deltas/rl2/"]
+
+    storage.delete(["deltas/rl1/a.json", "deltas/missing.json"])
+    assert storage.list_keys("deltas/") == ["deltas/rl2/b.json"]
+
+
+def test_queue_send_receive_delete(queue):
+    url = "local://queues/movies"
+    failed = queue.send_batch(
+        url, [{"Id": str(n), "MessageBody": f'{{"id": "rl{n}"}}'} for n in range(3)]
+    )
+    assert failed == []
+
+    records = queue.receive(url, max_messages=2)
+    assert [record["body"] for record in records] == ['{"id": "rl0"}', '{"id": "rl1"}']
+
+    queue.delete_batch(
+        url,
+        [{"Id": r["messageId"], "ReceiptHandle": r["receiptHandle"]} for r in records],
+    )
+    assert [record["body"] for record in queue.receive(url)] == ['{"id": "rl2"}']
+    assert queue.receive("local://queues/other") == []
+
+
+def test_incomplete_backends_fail_at_instantiation():
+    class NoDelete(ObjectStore):
+        put = get = head = list_keys = MemoryObjectStore.put
+
+    class NoReceive(MessageQueue):
+        send_batch = delete_batch = MemoryQueue.send_batch
+
+    with pytest.raises(TypeError, match="delete"):
+        NoDelete()
+    with pytest.raises(TypeError, match="receive"):
+        NoReceive()
+
+
+def test_get_storage(monkeypatch, tmp_path):
+    monkeypatch.setenv("storage_backend", "local")
+    monkeypatch.setenv("local_storage_dir", str(tmp_path))
+    assert isinstance(get_storage(), LocalObjectStore)
+    assert get_storage("memory") is get_storage("memory")
+
+    with pytest.raises(ValueError):
+        get_storage("ftp")
@@ -0,0 +1,38 @@
+import sys
+import pytest
+
+import src.backends
+from benchmarks import bench_suite
+
+
+@pytest.fixture
+def handler_env(monkeypatch):
+    for name, value in bench_suite.HANDLER_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(src.backends, "_memory_storage", None)
+    monkeypatch.setattr(src.backends, "_memory_queue", None)
+    monkeypatch.setattr(bench_suite, "MIN_RUN_SECONDS", 0)
+    yield
+    for name in ["ranking_handler", "movie_handler"]:
+        sys.modules.pop(name, None)
+
+
+def test_every_case_runs_offline(handler_env):
+    results = bench_suite.run(repeat=1)
+
+    assert set(results) == set(bench_suite.make_cases())
+    assert "parse/stream/ranking_2023-08-10" in results
+    assert "handler/ranking" in results
+    assert all(result["median_ms"] > 0 for result in results.values())
+
+
+def test_compare():
+    baseline = {"a": {"median_ms": 1.0}, "b": {"median_ms": 1.0}}
+    results = {
+        "a": {"median_ms": 1.5},
+        "b": {"median_ms": 0.5},
+        "c": {"median_ms": 1.0},
+    }
+    rows = bench_suite.compare(baseline, results, threshold=1.25)
+    assert [row["status"] for row in rows] == ["slower", "faster", "new"]
+    assert rows[0]["ratio"] == 1.5
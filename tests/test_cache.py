@@ -0,0 +1,101 @@
+import os
+import pytest
+from datetime import date, timedelta
+
+from src import fetcher
+from src.cache import ResponseCache, max_age_for
+
+
+def test_store_and_lookup(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=2**20)
+    cache.store("http://a/1", "<html>1</html>", etag='"x"')
+
+    entry = cache.lookup("http://a/1")
+    assert entry.etag == '"x"'
+    assert entry.validators() == {"If-None-Match": '"x"'}
+    assert cache.read(entry) == "<html>1</html>"
+    assert cache.lookup("http://a/2") is None
+
+
+def test_identical_bodies_are_stored_once(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=2**20)
+    cache.store("http://a/1", "same")
+    cache.store("http://a/2", "same")
+
+    assert len(os.listdir(tmp_path / "objects")) == 1
+    assert cache.total_bytes == len("same")
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=300)
+    for i in range(3):
+        cache.store(f"http://a/{i}", str(i) * 100)
+        # entry mtime is the last access, keep them apart
+        os.utime(cache._entry_path(f"http://a/{i}"), (i, i))
+
+    # reading 0 makes 1 the least recently used
+    cache.read(cache.lookup("http://a/0"))
+    cache.max_bytes = 250
+    cache.evict()
+
+    assert cache.lookup("http://a/1") is None
+    assert cache.lookup("http://a/0") is not None
+    assert cache.lookup("http://a/2") is not None
+    assert cache.total_bytes <= 250
+
+
+def test_max_age_policy():
+    today = date.fromisoformat("2023-09-01")
+
+    assert max_age_for(today - timedelta(days=365), today) is None
+    assert max_age_for(today, today) is not None
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), max_bytes=2**24)
+    monkeypatch.setattr(fetcher, "_cache", cache)
+    return cache
+
+
+def test_fetch_immutable_page_once(stub_site, response_cache):
+    url = f"{stub_site.base_url}date/2020-01-01"
+
+    first = fetcher.fetch(url, max_age=None)
+    second = fetcher.fetch(url, max_age=None)
+
+    assert first == second
+    assert len(stub_site.paths) == 1
+
+
+def test_fetch_revalidates_stale_page(stub_site, response_cache):
+    url = f"{stub_site.base_url}release/rl1077904129"
+
+    first = fetcher.fetch(url, max_age=0)
+    second = fetcher.fetch(url, max_age=0)
+
+    assert first == second
+    assert stub_site.statuses == [200, 304]
+
+
+def test_page_evicted_after_lookup(stub_site, response_cache, monkeypatch):
+    url = f"{stub_site.base_url}release/rl1077904129"
+    first = fetcher.fetch(url, max_age=None)
+    etag = response_cache.lookup(url).etag
+
+    # another thread evicts the body between lookup() and read()
+    lookup = response_cache.lookup
+
+    def evicting_lookup(url):
+        entry = lookup(url)
+        os.remove(response_cache._object_path(entry.digest))
+        return entry
+
+    monkeypatch.setattr(response_cache, "lookup", evicting_lookup)
+    assert response_cache.read(response_cache.lookup(url)) is None
+    response_cache.store(url, first, etag=etag)
+
+    # a fresh entry is a miss, a revalidated one is downloaded in full
+    assert fetcher.fetch(url, max_age=None) == first
+    assert fetcher.fetch(url, max_age=0) == first
+    assert stub_site.statuses == [200, 200, 304, 200]
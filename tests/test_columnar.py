@@ -0,0 +1,69 @@
+import pytest
+from datetime import date
+
+from src.record import DailyRecord, Movie
+from src.columnar import MovieColumns, gross_revenues
+
+
+def make_movie(days: dict[int, int]) -> Movie:
+    return Movie(
+        id="rl1",
+        title="Mock",
+        release_date=date.fromisoformat("2023-07-21"),
+        revenues={n: DailyRecord(n, revenue) for n, revenue in days.items()},
+        num_of_theaters=4337,
+        distributor="Warner Bros.",
+    )
+
+
+def test_round_trip():
+    movie = make_movie({1: 100, 2: 80, 5: 40})
+    movie.revenues[3] = DailyRecord(-1, 0)
+
+    columns = MovieColumns.from_movie(movie)
+
+    assert len(columns) == 4
+    assert columns.to_movie() == movie
+
+
+def test_aggregates():
+    movie = make_movie({n: 100 * n for n in range(1, 16)})
+    columns = MovieColumns.from_movie(movie)
+
+    assert columns.gross_revenue() == movie.gross_revenue()
+    assert columns.newest_nth_day() == movie.newest_nth_day() == 15
+    assert list(columns.cumulative_revenues())[:3] == [100, 300, 600]
+
+    drops = columns.week_over_week_drop()
+    assert drops[:7] == [None] * 7
+    assert drops[7] == pytest.approx((800 - 100) / 100)
+    assert len(drops) == 15
+
+
+def test_week_over_week_drop_absent_day():
+    columns = MovieColumns.from_movie(make_movie({1: 100, 9: 50}))
+
+    # day 2 is absent, day 8 is absent
+    assert columns.week_over_week_drop()[8] is None
+
+
+def test_merge():
+    columns = MovieColumns.from_movie(make_movie({1: 100, 2: 80}))
+
+    sparse = MovieColumns.from_movie(make_movie({2: 90, 4: 60}))
+    columns.merge(sparse)
+
+    expected = make_movie({1: 100, 2: 80})
+    expected.merge_records(make_movie({2: 90, 4: 60}).revenues)
+    assert columns.to_movie() == expected
+
+    dense = MovieColumns.from_movie(make_movie({1: 1, 2: 2}))
+    columns.merge(dense)
+    assert columns.to_movie().revenues[1] == DailyRecord(1, 1)
+    assert columns.to_movie().revenues[4] == DailyRecord(4, 60)
+
+
+def test_gross_revenues():
+    movies = [MovieColumns.from_movie(make_movie({1: 100, 2: 80}))]
+
+    assert gross_revenues(movies) == {"rl1": 180}
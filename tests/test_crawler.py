@@ -1,7 +1,7 @@
 import pytest
 from datetime import date, timedelta, datetime
 
-from src.crawler import crawl_movie_detail, crawl_daily_ranking
+from src.crawler import crawl_movie_detail, crawl_daily_ranking, crawl_daily_rankings
 
 @pytest.mark.parametrize("datestring", ["2023-08-17", # basic testing
                                         "2023-08-10", # "num_of_theaters is missing"
@@ -12,3 +12,28 @@ def test_crawl_ranking(datestring):
     ranking = crawl_daily_ranking(d) 
     
     assert ranking != None
+
+
+def test_crawl_rankings_range(stub_site):
+    start = date.fromisoformat("2023-08-01")
+    end = date.fromisoformat("2023-08-20")
+
+    seen = dict()
+    for d, movies in crawl_daily_rankings(start, end, concurrency=4, rate=100):
+        seen[d] = movies
+
+    assert sorted(seen) == [start + timedelta(days=i) for i in range(20)]
+    assert all(len(movies) > 0 for movies in seen.values())
+    # release date is derived from the requested date
+    assert seen[end][0].release_date == end - timedelta(days=27)
+    # connections are reused between pages
+    assert len(stub_site.clients) <= 4
+
+
+def test_crawl_rankings_backward(stub_site):
+    start = date.fromisoformat("2023-08-10")
+    end = date.fromisoformat("2023-08-08")
+
+    dates = [d for d, _ in crawl_daily_rankings(start, end, concurrency=2)]
+
+    assert sorted(dates) == [end, end + timedelta(days=1), start]
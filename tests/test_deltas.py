@@ -0,0 +1,77 @@
+import pytest
+from datetime import date
+
+from src.backends import PreconditionFailed
+from src.backends.memory import MemoryObjectStore
+from src.deltas import (
+    new_batch_id,
+    write_delta,
+    list_movies_with_deltas,
+    load_movie,
+    compact_movie,
+)
+from src.encoders import get_encoder
+from src.record import DailyRecord, Movie, content_hash
+
+MOVIE_KEY = "movies/rl1.json"
+
+
+def make_storage() -> MemoryObjectStore:
+    storage = MemoryObjectStore()
+    movie = Movie(
+        id="rl1",
+        title="Mock",
+        release_date=date.fromisoformat("2023-08-17"),
+        revenues={1: DailyRecord(1, 100), 2: DailyRecord(2, 200)},
+    )
+    storage.put(MOVIE_KEY, get_encoder("json").encode_movie(movie))
+    return storage
+
+
+def write(storage, revenues: dict):
+    movie = Movie(id="rl1", title="Mock", revenues=revenues)
+    return write_delta(storage, "deltas", "json", movie, new_batch_id())
+
+
+def test_load_movie_applies_deltas_in_order():
+    storage = make_storage()
+    write(storage, {2: DailyRecord(2, 250), 3: DailyRecord(1, 300)})
+    write(storage, {3: DailyRecord(1, 350)})
+
+    movie = load_movie(storage, MOVIE_KEY, "deltas", "rl1")
+    assert {n: r.revenue for n, r in movie.revenues.items()} == {1: 100, 2: 250, 3: 350}
+    assert list_movies_with_deltas(storage, "deltas") == ["rl1"]
+
+
+def test_compact_movie():
+    storage = make_storage()
+    write(storage, {3: DailyRecord(1, 300)})
+
+    movie, etag = compact_movie(storage, MOVIE_KEY, "deltas", "rl1")
+    assert movie.newest_nth_day() == 3
+    assert storage.head(MOVIE_KEY).etag == etag
+    assert storage.head(MOVIE_KEY).metadata == {
+        "newest-nth-day": "3",
+        "content-hash": content_hash([movie]),
+    }
+    assert list_movies_with_deltas(storage, "deltas") == []
+    assert compact_movie(storage, MOVIE_KEY, "deltas", "rl1") == (None, None)
+
+
+def test_compact_movie_loses_against_a_concurrent_write():
+    storage = make_storage()
+    key = write(storage, {3: DailyRecord(1, 300)})
+
+    get = storage.get
+
+    def get_then_rewrite(k, **kwargs):
+        obj = get(k, **kwargs)
+        if k == MOVIE_KEY:
+            storage.put(MOVIE_KEY, obj.body + b" ")
+        return obj
+
+    storage.get = get_then_rewrite
+    with pytest.raises(PreconditionFailed):
+        compact_movie(storage, MOVIE_KEY, "deltas", "rl1")
+    # the delta is kept for the next compaction
+    assert storage.list_keys("deltas/") == [key]
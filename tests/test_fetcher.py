@@ -0,0 +1,134 @@
+import time
+import pytest
+
+from src import fetcher
+from src.fetcher import (
+    TokenBucket,
+    AdaptiveLimiter,
+    CircuitBreaker,
+    FetchError,
+    CircuitOpenError,
+)
+
+
+def test_token_bucket_limits_rate():
+    limiter = TokenBucket(rate=50, capacity=1)
+
+    started = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    elapsed = time.monotonic() - started
+
+    # the first token is available right away, the other 10 take 1/50 s each
+    assert elapsed >= 0.18
+
+
+def test_token_bucket_burst():
+    limiter = TokenBucket(rate=1, capacity=5)
+
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+
+    assert time.monotonic() - started < 0.1
+
+
+@pytest.fixture
+def fetch_state(monkeypatch):
+    """Fresh adaptive bound and circuit breaker, and short backoffs"""
+    concurrency = AdaptiveLimiter(4, 1, 16)
+    breaker = CircuitBreaker(threshold=3, reset_seconds=0.1)
+    monkeypatch.setattr(fetcher, "_concurrency", concurrency)
+    monkeypatch.setattr(fetcher, "_breaker", breaker)
+    monkeypatch.setattr(fetcher, "BACKOFF_BASE", 0.01)
+    return concurrency, breaker
+
+
+def fetch(stub_site) -> str:
+    url = f"{stub_site.base_url}date/2023-08-17"
+    return fetcher.fetch(url, limiter=TokenBucket(100))
+
+
+def test_fetch_retries_throttled_requests(stub_site, fetch_state):
+    concurrency, _ = fetch_state
+    stub_site.errors.extend([503, 429])
+
+    assert 'id="table"' in fetch(stub_site)
+    assert stub_site.statuses == [503, 429, 200]
+    # halved twice, each failure being in a new round, then increased
+    assert concurrency.limit == 2
+
+
+def test_fetch_gives_up(stub_site, fetch_state, monkeypatch):
+    monkeypatch.setattr(fetcher, "RETRIES", 1)
+    stub_site.errors.extend([503, 503])
+
+    with pytest.raises(FetchError) as info:
+        fetch(stub_site)
+    assert info.value.status == 503
+
+    # a missing page is not retried
+    with pytest.raises(FetchError) as info:
+        fetcher.fetch(f"{stub_site.base_url}release/rl0", limiter=TokenBucket(100))
+    assert info.value.status == 404
+    assert stub_site.statuses == [503, 503, 404]
+
+
+def test_circuit_breaker(stub_site, fetch_state, monkeypatch):
+    monkeypatch.setattr(fetcher, "RETRIES", 2)
+    stub_site.errors.extend([503, 503, 503])
+
+    with pytest.raises(FetchError):
+        fetch(stub_site)
+    # open: no request is sent
+    with pytest.raises(CircuitOpenError):
+        fetch(stub_site)
+    assert len(stub_site.statuses) == 3
+
+    # after reset_seconds a trial request goes through and closes it
+    time.sleep(0.1)
+    assert 'id="table"' in fetch(stub_site)
+    assert 'id="table"' in fetch(stub_site)
+
+
+def test_request_errors_release_the_slot_and_breaker(fetch_state, monkeypatch):
+    import requests
+
+    concurrency, breaker = fetch_state
+    monkeypatch.setattr(fetcher, "RETRIES", 1)
+
+    class BrokenSession:
+        def get(self, url, **kwargs):
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+    monkeypatch.setattr(fetcher, "get_session", lambda: BrokenSession())
+
+    with pytest.raises(FetchError, match="ChunkedEncodingError"):
+        fetcher.fetch("http://127.0.0.1:1/date/2023-08-17", limiter=TokenBucket(100))
+    assert concurrency.in_flight == 0
+    assert breaker.failures == 2
+
+    # a failed half-open trial opens the circuit again instead of sticking
+    breaker.opened_at = time.monotonic() - breaker.reset_seconds
+    with pytest.raises(FetchError):
+        fetcher.fetch("http://127.0.0.1:1/date/2023-08-17", limiter=TokenBucket(100))
+    assert breaker.trial is False and concurrency.in_flight == 0
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=5)
+
+    # requests of the same round fail together, the bound is cut once
+    epochs = [limiter.acquire() for _ in range(4)]
+    for epoch in epochs:
+        limiter.release(epoch, healthy=False)
+    assert limiter.limit == 2
+
+    # a round of healthy requests adds about one, 1/2 + 1/2.5
+    for _ in range(2):
+        limiter.release(limiter.acquire(), healthy=True)
+    assert limiter.limit == pytest.approx(2.9)
+
+    for _ in range(100):
+        limiter.release(limiter.acquire(), healthy=True)
+    assert limiter.limit == 5
@@ -0,0 +1,494 @@
+import os
+import sys
+import json
+import pytest
+import pathlib
+import importlib
+import subprocess
+from datetime import date
+
+import src.backends
+from src.backends import NoSuchKey, StoredObject
+from src.record import DailyRecord, Movie
+from src.manifest import ManifestEntry
+from src.deltas import write_delta, new_batch_id
+
+EXAMPLE_INPUT = pathlib.Path(__file__).parent.parent / "example_input.json"
+MOVIE_ID = "rl1077904129"
+
+ENV = {
+    "storage_backend": "memory",
+    "ranking_folder_prefix": "ranking",
+    "movies_folder_prefix": "movies",
+    "sqs_ranking_queue_url": "memory://ranking",
+    "sqs_movies_queue_url": "memory://movies",
+    "file_extension": "json",
+    "uuid_ns_base": "6ba7b810-9dad-11d1-80b4-00c04fd430c8",
+}
+
+
+@pytest.fixture
+def handlers(monkeypatch, stub_site):
+    """Import the handlers against a fresh in-memory backend"""
+    for name, value in ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(src.backends, "_memory_storage", None)
+    monkeypatch.setattr(src.backends, "_memory_queue", None)
+
+    modules = []
+    for name in ["ranking_handler", "movie_handler"]:
+        sys.modules.pop(name, None)
+        modules.append(importlib.import_module(name))
+    yield modules
+
+    for name in ["ranking_handler", "movie_handler"]:
+        sys.modules.pop(name, None)
+
+
+def test_handlers_end_to_end(handlers, capsys):
+    ranking_handler, movie_handler = handlers
+    storage = src.backends.get_storage()
+    event = json.loads(EXAMPLE_INPUT.read_text())
+
+    assert ranking_handler.lambda_handler(event, None) == {"statusCode": 200}
+    days = [json.loads(r["body"])["date"] for r in event["Records"]]
+    assert storage.list_keys("ranking/") == sorted(
+        f"ranking/{d}.json" for d in days
+    )
+    # the invocation ends with its metrics as EMF
+    document = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert document["handler"] == "ranking_handler"
+    assert len(document["crawl.fetch_ranking"]) == len(days)
+    assert document["movies.new"] > 0
+    # the yearly aggregates are up to date with the rankings
+    top = ranking_handler.aggregates.top(2023, 1)
+    assert top[0]["gross"] == ranking_handler.aggregates.movie_gross(
+        top[0]["id"], [2023]
+    )
+
+    record = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    assert movie_handler.lambda_handler({"Records": [record]}, None) == {
+        "statusCode": 200,
+        "batchItemFailures": [],
+    }
+    movie = storage.head(f"movies/{MOVIE_ID}.json")
+    assert movie.metadata["newest-nth-day"] == "126"
+    assert movie_handler.index.by_title("barbie") == [MOVIE_ID]
+
+    # the stored movie is found through the manifest on the next ranking batch
+    ranking_handler.manifest.refresh()
+    assert ranking_handler.manifest.get(MOVIE_ID).etag == movie.etag
+
+
+@pytest.mark.parametrize(
+    "handler", ["ranking_handler", "movie_handler", "compaction_handler"]
+)
+def test_cold_start_skips_heavy_imports(handler):
+    env = {**os.environ, **ENV, "storage_backend": "s3", "bucket_name": "movie-etl"}
+    code = f"import sys, json, {handler}; print(json.dumps(list(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=EXAMPLE_INPUT.parent,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = json.loads(result.stdout)
+    for heavy in ["requests", "boto3", "botocore", "bs4"]:
+        assert heavy not in modules
+
+
+def test_movie_handler_reports_failed_records(handlers, stub_site):
+    _, movie_handler = handlers
+    storage = src.backends.get_storage()
+    movie = f'{{"id": "{MOVIE_ID}"}}'
+    bodies = [movie, '{"id": "rl0"}', movie, "{"]
+    records = [
+        {"messageId": str(n), "receiptHandle": str(n), "body": body}
+        for n, body in enumerate(bodies)
+    ]
+
+    response = movie_handler.lambda_handler({"Records": records}, None)
+
+    # rl0 is not found, the last body is not json
+    failed = sorted(item["itemIdentifier"] for item in response["batchItemFailures"])
+    assert failed == ["1", "3"]
+    assert storage.list_keys("movies/") == [f"movies/{MOVIE_ID}.json"]
+    # the movie requested twice is crawled once
+    assert stub_site.paths.count(f"/release/{MOVIE_ID}") == 1
+
+
+def test_movie_handler_refreshes_stored_movies(handlers, stub_site):
+    _, movie_handler = handlers
+    storage = src.backends.get_storage()
+    record = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+
+    # store the first 100 days only, as if crawled a while ago
+    movie_handler.lambda_handler({"Records": [record]}, None)
+    key = f"movies/{MOVIE_ID}.json"
+    movie = movie_handler.encoder.decode_movie(storage.get(key).body)
+    movie.revenues = {n: r for n, r in movie.revenues.items() if n <= 100}
+    etag = storage.put(key, movie_handler.encoder.encode_movie(movie))
+    movie_handler.manifest.update(
+        {MOVIE_ID: ManifestEntry(newest_nth_day=100, etag=etag)}
+    )
+
+    movie_handler.lambda_handler({"Records": [record]}, None)
+    refreshed = movie_handler.encoder.decode_movie(storage.get(key).body)
+    assert sorted(refreshed.revenues) == list(range(1, 127))
+    assert movie_handler.manifest.get(MOVIE_ID).newest_nth_day == 126
+
+    # nothing new, the object is left as it is
+    etag = storage.head(key).etag
+    movie_handler.lambda_handler({"Records": [record]}, None)
+    assert storage.head(key).etag == etag
+
+
+def test_ranking_handler_crawls_backfill_ranges(handlers, stub_site):
+    ranking_handler, _ = handlers
+    storage = src.backends.get_storage()
+    queue = src.backends.get_queue()
+    body = '{"start": "2023-08-15", "end": "2023-08-17"}'
+    record = {"messageId": "1", "receiptHandle": "1", "body": body}
+
+    ranking_handler.lambda_handler({"Records": [record]}, None)
+
+    assert storage.list_keys("ranking/") == [
+        f"ranking/2023-08-{day}.json" for day in [15, 16, 17]
+    ]
+    # the next work units are leased and sent, newest first
+    sent = [json.loads(m["body"]) for m in queue.messages["memory://ranking"]]
+    assert len(sent) == ranking_handler.BACKFILL_CONCURRENCY
+    checkpoint, _ = ranking_handler.scheduler.load()
+    assert sorted(checkpoint["leases"]) == sorted(unit["start"] for unit in sent)
+
+
+def test_backfill_records_dates_not_found(handlers, stub_site, monkeypatch):
+    ranking_handler, _ = handlers
+    storage = src.backends.get_storage()
+    page = stub_site.page
+    monkeypatch.setattr(
+        stub_site, "page", lambda path: None if "2023-08-16" in path else page(path)
+    )
+    body = '{"start": "2023-08-15", "end": "2023-08-17"}'
+    record = {"messageId": "1", "receiptHandle": "1", "body": body}
+
+    # the rest of the unit is stored, the batch does not fail
+    ranking_handler.lambda_handler({"Records": [record]}, None)
+
+    assert storage.list_keys("ranking/") == [
+        "ranking/2023-08-15.json",
+        "ranking/2023-08-17.json",
+    ]
+    checkpoint, _ = ranking_handler.scheduler.load()
+    assert checkpoint["failed"]["2023-08-16"]["attempts"] == 1
+
+
+def test_unchanged_objects_are_not_written_again(handlers, stub_site, monkeypatch):
+    ranking_handler, movie_handler = handlers
+    ranking = {"messageId": "1", "receiptHandle": "1", "body": '{"date": "2023-08-17"}'}
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    full = {**movie, "body": f'{{"id": "{MOVIE_ID}", "full": true}}'}
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+
+    written = []
+    for handler in [ranking_handler, movie_handler]:
+        put = handler.storage.put
+        monkeypatch.setattr(
+            handler.storage,
+            "put",
+            lambda key, *args, put=put, **kwargs: written.append(key)
+            or put(key, *args, **kwargs),
+        )
+
+    # settled rankings and movies crawled again cost the fetch only
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    movie_handler.lambda_handler({"Records": [full]}, None)
+    assert [key for key in written if key.startswith(("ranking/", "movies/"))] == []
+
+
+def test_redelivered_ranking_is_merged(handlers, stub_site, monkeypatch):
+    ranking_handler, movie_handler = handlers
+    storage = src.backends.get_storage()
+    key = f"movies/{MOVIE_ID}.json"
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    ranking = {"messageId": "2", "receiptHandle": "2", "body": '{"date": "2023-08-17"}'}
+
+    # stored up to day 27, the day before 2023-08-17
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+    stored = movie_handler.encoder.decode_movie(storage.get(key).body)
+    stored.revenues = {n: r for n, r in stored.revenues.items() if n <= 27}
+    etag = storage.put(key, movie_handler.encoder.encode_movie(stored))
+    movie_handler.manifest.update(
+        {MOVIE_ID: ManifestEntry(newest_nth_day=27, etag=etag)}
+    )
+
+    # the invocation dies once the ranking is stored, SQS redelivers it
+    ingest = ranking_handler.aggregates.ingest
+    monkeypatch.setattr(ranking_handler.aggregates, "ingest", lambda *args: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    monkeypatch.setattr(ranking_handler.aggregates, "ingest", ingest)
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+
+    merged = movie_handler.encoder.decode_movie(storage.get(key).body)
+    assert max(merged.revenues) == 28
+
+
+def test_failed_merge_keeps_the_messages(handlers, stub_site, monkeypatch):
+    ranking_handler, movie_handler = handlers
+    storage = src.backends.get_storage()
+    key = f"movies/{MOVIE_ID}.json"
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    ranking = {"messageId": "2", "receiptHandle": "2", "body": '{"date": "2023-08-17"}'}
+
+    # stored up to day 27, the day before 2023-08-17
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+    stored = movie_handler.encoder.decode_movie(storage.get(key).body)
+    stored.revenues = {n: r for n, r in stored.revenues.items() if n <= 27}
+    etag = storage.put(key, movie_handler.encoder.encode_movie(stored))
+    movie_handler.manifest.update(
+        {MOVIE_ID: ManifestEntry(newest_nth_day=27, etag=etag)}
+    )
+
+    deleted = []
+    monkeypatch.setattr(
+        ranking_handler.queue,
+        "delete_batch",
+        lambda url, entries: deleted.extend(entries),
+    )
+    get = ranking_handler.storage.get
+
+    def failing_get(k, *args, **kwargs):
+        if k == key:
+            raise ConnectionError("connection reset")
+        return get(k, *args, **kwargs)
+
+    # the batch fails and stays in the queue, SQS redelivers it
+    monkeypatch.setattr(ranking_handler.storage, "get", failing_get)
+    with pytest.raises(RuntimeError, match=MOVIE_ID):
+        ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    assert deleted == []
+
+    monkeypatch.setattr(ranking_handler.storage, "get", get)
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    assert len(deleted) == 1
+    merged = movie_handler.encoder.decode_movie(storage.get(key).body)
+    assert max(merged.revenues) == 28
+
+
+def test_merge_does_not_overwrite_a_concurrent_refresh(
+    handlers, stub_site, monkeypatch
+):
+    ranking_handler, movie_handler = handlers
+    storage = src.backends.get_storage()
+    key = f"movies/{MOVIE_ID}.json"
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    ranking = {"messageId": "2", "receiptHandle": "2", "body": '{"date": "2023-08-17"}'}
+
+    # stored up to day 27, the day before 2023-08-17
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+    stored = movie_handler.encoder.decode_movie(storage.get(key).body)
+    stored.revenues = {n: r for n, r in stored.revenues.items() if n <= 27}
+    etag = storage.put(key, movie_handler.encoder.encode_movie(stored))
+    movie_handler.manifest.update(
+        {MOVIE_ID: ManifestEntry(newest_nth_day=27, etag=etag)}
+    )
+
+    # movie_handler refreshes the movie between the read and the write of the
+    # merge of ranking_handler
+    get = ranking_handler.storage.get
+    refreshed = []
+
+    def racing_get(k, *args, **kwargs):
+        obj = get(k, *args, **kwargs)
+        if k == key and not refreshed:
+            refreshed.append(movie_handler.lambda_handler({"Records": [movie]}, None))
+        return obj
+
+    monkeypatch.setattr(ranking_handler.storage, "get", racing_get)
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+
+    assert refreshed
+    merged = movie_handler.encoder.decode_movie(storage.get(key).body)
+    assert sorted(merged.revenues) == list(range(1, 127))
+    ranking_handler.manifest.refresh()
+    assert ranking_handler.manifest.get(MOVIE_ID).newest_nth_day == 126
+
+
+def test_ranking_handler_invalidates_shards(handlers, stub_site):
+    ranking_handler, _ = handlers
+    storage = src.backends.get_storage()
+    storage.put("archive/2023-08.shard", b"")
+    storage.put("archive/2023.shard", b"")
+    record = {"messageId": "1", "receiptHandle": "1", "body": '{"date": "2023-08-17"}'}
+
+    ranking_handler.lambda_handler({"Records": [record]}, None)
+
+    # packed again from the daily files by compaction_handler
+    assert storage.list_keys("archive/") == []
+
+
+@pytest.fixture
+def delta_handlers(monkeypatch, stub_site):
+    """The three handlers with movie_update_mode=delta"""
+    for name, value in {**ENV, "movie_update_mode": "delta"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(src.backends, "_memory_storage", None)
+    monkeypatch.setattr(src.backends, "_memory_queue", None)
+
+    names = ["ranking_handler", "movie_handler", "compaction_handler"]
+    modules = []
+    for name in names:
+        sys.modules.pop(name, None)
+        modules.append(importlib.import_module(name))
+    yield modules
+
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+def test_delta_mode_appends_and_compaction_folds(delta_handlers):
+    ranking_handler, movie_handler, compaction_handler = delta_handlers
+    storage = src.backends.get_storage()
+    key = f"movies/{MOVIE_ID}.json"
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    ranking = {"messageId": "2", "receiptHandle": "2", "body": '{"date": "2023-08-17"}'}
+
+    # stored up to day 27, the day before 2023-08-17
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+    stored = movie_handler.encoder.decode_movie(storage.get(key).body)
+    stored.revenues = {n: r for n, r in stored.revenues.items() if n <= 27}
+    etag = storage.put(key, movie_handler.encoder.encode_movie(stored))
+    movie_handler.manifest.update(
+        {MOVIE_ID: ManifestEntry(newest_nth_day=27, etag=etag)}
+    )
+
+    # the new day is a delta, the base object is left as it is
+    ranking_handler.lambda_handler({"Records": [ranking]}, None)
+    assert len(storage.list_keys(f"deltas/{MOVIE_ID}/")) == 1
+    assert storage.head(key).etag == etag
+    ranking_handler.manifest.refresh()
+    assert ranking_handler.manifest.get(MOVIE_ID).newest_nth_day == 28
+
+    compaction_handler.lambda_handler({}, None)
+    compacted = movie_handler.encoder.decode_movie(storage.get(key).body)
+    assert max(compacted.revenues) == 28
+    assert storage.list_keys("deltas/") == []
+    compaction_handler.manifest.refresh()
+    entry = compaction_handler.manifest.get(MOVIE_ID)
+    assert entry.newest_nth_day == 28 and entry.etag == storage.head(key).etag
+
+
+def test_compaction_skips_movies_rewritten_meanwhile(delta_handlers, monkeypatch):
+    _, movie_handler, compaction_handler = delta_handlers
+    storage = src.backends.get_storage()
+    key = f"movies/{MOVIE_ID}.json"
+    movie = {"messageId": "1", "receiptHandle": "1", "body": f'{{"id": "{MOVIE_ID}"}}'}
+    movie_handler.lambda_handler({"Records": [movie]}, None)
+    stored = movie_handler.encoder.decode_movie(storage.get(key).body)
+    write_delta(storage, "deltas", "json", stored, new_batch_id())
+    compaction_handler.manifest.refresh()
+    entry = compaction_handler.manifest.get(MOVIE_ID)
+
+    # the movie is rewritten between the read and the write of the compaction
+    get = compaction_handler.storage.get
+
+    def racing_get(k, *args, **kwargs):
+        obj = get(k, *args, **kwargs)
+        if k == key:
+            storage.put(key, obj.body + b" ")
+        return obj
+
+    monkeypatch.setattr(compaction_handler.storage, "get", racing_get)
+    assert compaction_handler.lambda_handler({}, None) == {"statusCode": 200}
+
+    # left for the next compaction, the manifest is untouched
+    assert len(storage.list_keys(f"deltas/{MOVIE_ID}/")) == 1
+    compaction_handler.manifest.refresh()
+    assert compaction_handler.manifest.get(MOVIE_ID) == entry
+
+
+class StubStorage:
+    """Movie bodies by key, other keys raise NoSuchKey and reading the key
+    `error` raises a RuntimeError
+    """
+
+    def __init__(self, movies: dict, error: str = None):
+        self.movies = movies
+        self.error = error
+        self.gets, self.puts = [], []
+
+    def head(self, key):
+        if key not in self.movies:
+            raise NoSuchKey(key)
+        metadata = {"newest-nth-day": "27"}
+        return StoredObject(key, etag='"old"', size=0, metadata=metadata)
+
+    def get(self, key, **kwargs):
+        self.gets.append(key)
+        if key == self.error:
+            raise RuntimeError("connection reset")
+        if key not in self.movies:
+            raise NoSuchKey(key)
+        body = self.movies[key]
+        return StoredObject(key, etag='"old"', size=len(body), body=body)
+
+    def put(self, key, body, **kwargs):
+        self.puts.append(key)
+        return '"new"'
+
+
+def test_reconcile_movie(handlers, monkeypatch):
+    ranking_handler, _ = handlers
+    encoder = ranking_handler.encoder
+    crawled = {
+        id: Movie(id=id, title=id, revenues={28: DailyRecord(1, 100)})
+        for id in ["new", "settled", "broken", "behind"]
+    }
+    stored = Movie(
+        id="behind",
+        title="behind",
+        release_date=date(2023, 7, 21),
+        revenues={27: DailyRecord(1, 90)},
+    )
+    stub = StubStorage(
+        {
+            "movies/settled.json": b"",
+            "movies/broken.json": b"",
+            "movies/behind.json": encoder.encode_movie(stored),
+        },
+        error="movies/broken.json",
+    )
+    monkeypatch.setattr(ranking_handler, "storage", stub)
+    ranking_handler.manifest.entries = {
+        "settled": ManifestEntry(newest_nth_day=28),
+        "broken": ManifestEntry(newest_nth_day=27),
+    }
+    ranking_handler.manifest.loaded = True
+
+    def reconcile(id):
+        return ranking_handler.reconcile_movie(crawled[id], batch_id="1")
+
+    # not stored: a request to crawl its details
+    request, entry, _, ok = reconcile("new")
+    assert request["Id"] == "new" and entry is None and ok
+
+    # up to date in the manifest: nothing is read
+    assert reconcile("settled") == (None, None, [], True)
+    assert "movies/settled.json" not in stub.gets
+
+    # a failing movie is logged and reported, other movies go on
+    request, entry, logs, ok = reconcile("broken")
+    assert (request, entry, ok) == (None, None, False)
+    assert "connection reset" in logs[0]
+
+    # found through the object header, merged and put back
+    request, entry, _, ok = reconcile("behind")
+    assert request is None and ok
+    assert entry == ManifestEntry(
+        newest_nth_day=28, release_date="2023-07-21", etag='"new"'
+    )
+    assert stub.puts == ["movies/behind.json"]
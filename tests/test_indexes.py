@@ -0,0 +1,78 @@
+from datetime import date
+
+from src.backends.memory import MemoryObjectStore
+from src.encoders import get_encoder
+from src.indexes import MovieIndex, IndexEntry, rebuild
+from src.record import Movie
+
+ENTRIES = {
+    "rl1": IndexEntry("Barbie", "Warner Bros.", "2023-07-21"),
+    "rl2": IndexEntry("Oppenheimer", "Universal Pictures", "2023-07-21"),
+    "rl3": IndexEntry("Barbie  2", "Warner Bros.", "2025-07-01"),
+    "rl4": IndexEntry("The Nun II", "Warner Bros.", "2023-09-08"),
+    "rl5": IndexEntry("Unreleased", None, None),
+}
+
+
+def make_index(storage=None) -> MovieIndex:
+    index = MovieIndex(storage or MemoryObjectStore(), "indexes/movies.json")
+    index.update(ENTRIES)
+    return index
+
+
+def test_lookups():
+    index = make_index()
+
+    assert index.by_title("barbie") == ["rl1"]
+    assert index.by_title("BARBIE 2") == ["rl3"]
+    assert index.title_prefix("bar") == [("Barbie", "rl1"), ("Barbie  2", "rl3")]
+    assert index.title_prefix("bar", limit=1) == [("Barbie", "rl1")]
+    assert index.title_prefix("x") == []
+
+    assert index.released_between("2023-07-21", "2023-09-08") == ["rl1", "rl2", "rl4"]
+    assert index.released_between(start="2024-01-01") == ["rl3"]
+    assert index.by_distributor("Warner Bros.") == ["rl1", "rl4", "rl3"]
+    assert index.by_distributor("Warner Bros.", "2023-08-01", "2023-12-31") == ["rl4"]
+    assert index.by_distributor("A24") == []
+
+
+def test_update_is_shared_through_storage():
+    storage = MemoryObjectStore()
+    first, second = make_index(storage), MovieIndex(storage, "indexes/movies.json")
+    etag = first.etag
+
+    # unchanged entries are not written again
+    first.update({"rl1": ENTRIES["rl1"]})
+    assert first.etag == etag
+
+    second.update({"rl6": IndexEntry("Talk to Me", "A24", "2023-07-28")})
+    # first is outdated, its conditional put is retried on top of second's
+    first.update({"rl1": IndexEntry("Barbie", "Warner Bros.", "2023-07-20")})
+
+    second.refresh()
+    assert second.by_distributor("A24") == ["rl6"]
+    assert second.get("rl1").release_date == "2023-07-20"
+
+
+def test_rebuild():
+    storage = MemoryObjectStore()
+    encoder = get_encoder("json")
+    for id, entry in list(ENTRIES.items())[:4]:
+        movie = Movie(
+            id=id,
+            title=entry.title,
+            release_date=date.fromisoformat(entry.release_date),
+            distributor=entry.distributor,
+        )
+        storage.put(f"movies/{id}.json", encoder.encode_movie(movie))
+
+    assert rebuild(storage, "movies", "indexes/movies.json") == 4
+
+    index = MovieIndex(storage, "indexes/movies.json")
+    index.refresh()
+    assert index.title_prefix("") == [
+        ("Barbie", "rl1"),
+        ("Barbie  2", "rl3"),
+        ("Oppenheimer", "rl2"),
+        ("The Nun II", "rl4"),
+    ]
@@ -0,0 +1,90 @@
+import pytest
+
+from src.backends import PreconditionFailed
+from src.backends.memory import MemoryObjectStore
+from src.manifest import Manifest, ManifestEntry
+
+
+def test_update_and_refresh():
+    storage = MemoryObjectStore()
+    manifest = Manifest(storage, "manifest.json")
+    manifest.refresh()
+    assert manifest.get("rl1") is None
+
+    manifest.update({"rl1": ManifestEntry(newest_nth_day=3, etag='"a"')})
+
+    other = Manifest(storage, "manifest.json")
+    other.refresh()
+    assert other.get("rl1") == ManifestEntry(newest_nth_day=3, etag='"a"')
+
+
+def test_concurrent_updates_are_not_lost():
+    storage = MemoryObjectStore()
+    first = Manifest(storage, "manifest.json")
+    second = Manifest(storage, "manifest.json")
+    first.refresh()
+    second.refresh()
+
+    # second writes with a stale etag, has to reload and retry
+    first.update({"rl1": ManifestEntry(newest_nth_day=1)})
+    second.update({"rl2": ManifestEntry(newest_nth_day=2)})
+
+    manifest = Manifest(storage, "manifest.json")
+    manifest.refresh()
+    assert manifest.get("rl1").newest_nth_day == 1
+    assert manifest.get("rl2").newest_nth_day == 2
+
+
+class CountingStore(MemoryObjectStore):
+    def __init__(self):
+        super().__init__()
+        self.bodies_read = 0
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        obj = super().get(key, if_none_match=if_none_match, byte_range=byte_range)
+        self.bodies_read += 1
+        return obj
+
+
+def test_refresh_is_conditional():
+    storage = CountingStore()
+    Manifest(storage, "manifest.json").update({"rl1": ManifestEntry(1)})
+    manifest = Manifest(storage, "manifest.json")
+
+    manifest.refresh()
+    manifest.refresh()
+    # the second refresh is a 304, the body is read once
+    assert storage.bodies_read == 1
+    assert manifest.get("rl1").newest_nth_day == 1
+
+    Manifest(storage, "manifest.json").update({"rl2": ManifestEntry(2)})
+    manifest.refresh()
+    assert manifest.get("rl2").newest_nth_day == 2
+
+
+def test_first_writers_do_not_overwrite_each_other():
+    storage = MemoryObjectStore()
+    first = Manifest(storage, "manifest.json")
+    second = Manifest(storage, "manifest.json")
+    first.refresh()
+    second.refresh()
+
+    # both saw no manifest, the second create fails on If-None-Match: *
+    first.update({"rl1": ManifestEntry(1)})
+    second.update({"rl2": ManifestEntry(2)})
+
+    manifest = Manifest(storage, "manifest.json")
+    manifest.refresh()
+    assert sorted(manifest.entries) == ["rl1", "rl2"]
+
+
+def test_update_gives_up_after_retries(monkeypatch):
+    storage = MemoryObjectStore()
+    manifest = Manifest(storage, "manifest.json")
+
+    def conflicting_put(key, body, **kwargs):
+        raise PreconditionFailed(key)
+
+    monkeypatch.setattr(storage, "put", conflicting_put)
+    with pytest.raises(RuntimeError):
+        manifest.update({"rl1": ManifestEntry(1)})
@@ -0,0 +1,67 @@
+import json
+
+from src import metrics
+from src.backends.memory import MemoryObjectStore, MemoryQueue
+from src.backends.metered import MeteredObjectStore, MeteredQueue
+
+
+def test_spans_and_counters():
+    recorder = metrics.Recorder("test")
+    for _ in range(3):
+        with recorder.span("fetch"):
+            pass
+    recorder.count("bytes", 10, "Bytes")
+    recorder.count("bytes", 5, "Bytes")
+
+    [document] = recorder.documents(timestamp=1)
+    definition = document["_aws"]["CloudWatchMetrics"][0]
+    assert document["_aws"]["Timestamp"] == 1
+    assert definition["Dimensions"] == [["handler"]]
+    assert {"Name": "fetch", "Unit": "Milliseconds"} in definition["Metrics"]
+    assert {"Name": "bytes", "Unit": "Bytes"} in definition["Metrics"]
+    assert document["handler"] == "test"
+    assert len(document["fetch"]) == 3
+    assert document["bytes"] == 15
+    assert document["summary"]["fetch"]["count"] == 3
+
+
+def test_values_are_split_across_documents():
+    recorder = metrics.Recorder("test")
+    for n in range(250):
+        recorder.observe("get", n)
+    recorder.count("movies.merged")
+
+    documents = recorder.documents()
+    assert [len(d["get"]) for d in documents] == [100, 100, 50]
+    assert "movies.merged" in documents[0] and "movies.merged" not in documents[1]
+    assert documents[0]["summary"]["get"]["p50"] == 124
+    assert documents[0]["summary"]["get"]["max"] == 249
+
+
+def test_invocation_prints_emf(capsys):
+    @metrics.invocation("handler")
+    def handler(event, context):
+        with metrics.span("stage"):
+            metrics.count("items", 2)
+        return {"statusCode": 200}
+
+    assert handler({}, None) == {"statusCode": 200}
+    document = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert document["handler"] == "handler"
+    assert document["items"] == 2
+    assert set(document["summary"]) == {"stage", "invocation"}
+
+
+def test_metered_backends():
+    recorder = metrics.current()
+    storage = MeteredObjectStore(MemoryObjectStore())
+    queue = MeteredQueue(MemoryQueue())
+
+    storage.put("a", b"12345")
+    storage.get("a")
+    queue.send_batch("q", [{"Id": "1", "MessageBody": "{}"}])
+
+    assert recorder.counters["storage.bytes_written"] >= 5
+    assert recorder.counters["storage.bytes_read"] >= 5
+    assert recorder.counters["queue.messages_sent"] >= 1
+    assert "storage.put" in recorder.timings and "queue.send" in recorder.timings
@@ -0,0 +1,109 @@
+import pytest
+import pathlib
+from datetime import date
+
+from src.parsers import get_parser
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def read_fixture(name: str) -> str:
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("datestring", ["2023-08-17", # basic testing
+                                        "2023-08-10", # "num_of_theaters is missing"
+                                        ])
+def test_ranking_parity(datestring):
+    d = date.fromisoformat(datestring)
+    html = read_fixture(f"date_{datestring}.html")
+
+    expected = get_parser("soup").parse_daily_ranking(html, d)
+    actual = get_parser("stream").parse_daily_ranking(html, d)
+
+    assert len(expected) > 0
+    assert actual == expected
+
+
+@pytest.mark.parametrize("id", ["rl1077904129", # basic testing
+                                "rl1592820481", # "Release Date (Wide)"
+                                "rl1930593025", # single digit day in release date
+                                ])
+def test_movie_detail_parity(id):
+    html = read_fixture(f"release_{id}.html")
+
+    expected = get_parser("soup").parse_movie_detail(html, id)
+    actual = get_parser("stream").parse_movie_detail(html, id)
+
+    assert expected.release_date is not None
+    assert len(expected.revenues) > 0
+    assert actual == expected
+
+
+def test_ranking_edge_cases():
+    html = read_fixture("date_2023-08-10.html")
+    movies = get_parser("stream").parse_daily_ranking(html, date(2023, 8, 10))
+
+    barbie = movies[0]
+    assert barbie.title == "Barbie"
+    assert barbie.revenues[28].ranking == 1
+    assert barbie.release_date == date(2023, 7, 14)
+    # theater counts above 999 are comma separated
+    assert barbie.num_of_theaters > 999
+
+    assert movies[31].num_of_theaters == 0
+    assert movies[35].distributor == "None"
+
+
+def test_movie_detail_release_date():
+    html = read_fixture("release_rl1592820481.html")
+    movie = get_parser("stream").parse_movie_detail(html, "rl1592820481")
+
+    assert movie.release_date == date(2023, 12, 25)
+    assert movie.distributor == "Amazon MGM Studios"
+    assert movie.num_of_theaters == 4337
+
+
+@pytest.mark.parametrize("parser", ["soup", "stream"])
+@pytest.mark.parametrize("since_nth_day", [0, 60, 125, 126, 200])
+def test_movie_detail_since_nth_day(parser, since_nth_day):
+    html = read_fixture("release_rl1077904129.html")
+    full = get_parser("stream").parse_movie_detail(html, "rl1077904129")
+
+    movie = get_parser(parser).parse_movie_detail(html, "rl1077904129", since_nth_day)
+
+    assert movie.revenues == {
+        n: r for n, r in full.revenues.items() if n > since_nth_day
+    }
+    assert movie.title == full.title
+    assert movie.release_date == full.release_date
+    assert movie.num_of_theaters == full.num_of_theaters
+
+
+def test_movie_detail_since_nth_day_unordered_rows():
+    # rows newest first cannot be cut short, every row is parsed instead
+    html = read_fixture("release_rl1930593025.html")
+    head, table = html.split('<div id="table"', 1)
+    table, tail = table.split("</table>", 1)
+    prefix, header, *rows = table.split("<tr")
+    html = "<tr".join([head + '<div id="table"' + prefix, header] + rows[::-1])
+    html += "</table>" + tail
+
+    parser = get_parser("stream")
+    movie = parser.parse_movie_detail(html, "rl1930593025", since_nth_day=40)
+    assert sorted(movie.revenues) == [41, 42]
+
+
+def test_unknown_parser():
+    with pytest.raises(ValueError):
+        get_parser("lxml")
+
+
+@pytest.mark.parametrize("parser", ["soup", "stream"])
+def test_page_without_table(parser):
+    html = "<html><body><h1>Service Unavailable</h1></body></html>"
+
+    with pytest.raises(ValueError, match="#table"):
+        get_parser(parser).parse_daily_ranking(html, date(2023, 8, 17))
+    with pytest.raises(ValueError, match="#table"):
+        get_parser(parser).parse_movie_detail(html, "rl1077904129")
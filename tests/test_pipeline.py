@@ -0,0 +1,54 @@
+import pytest
+from datetime import date, timedelta
+
+from src.crawler import crawl_daily_ranking
+from src.pipeline import pipeline_daily_rankings, pipeline_movie_details
+
+MOVIE_IDS = ["rl1077904129", "rl1592820481", "rl1930593025"]
+
+
+@pytest.mark.parametrize("parse_workers", [0, 2])
+def test_pipeline_rankings_in_order(stub_site, parse_workers):
+    start = date.fromisoformat("2023-08-10")
+    end = date.fromisoformat("2023-08-01")
+
+    rankings = list(
+        pipeline_daily_rankings(
+            start, end, parse_workers=parse_workers, window=3, rate=100
+        )
+    )
+
+    assert [d for d, _ in rankings] == [start - timedelta(days=i) for i in range(10)]
+    # same records as the single threaded crawl
+    assert rankings[0][1] == crawl_daily_ranking(start)
+
+
+def test_pipeline_movie_details(stub_site):
+    movies = list(pipeline_movie_details(MOVIE_IDS, parse_workers=2))
+
+    assert [id for id, _ in movies] == MOVIE_IDS
+    assert all(movie.id == id and len(movie.revenues) > 0 for id, movie in movies)
+
+
+def test_pipeline_bounds_pages_in_flight(stub_site):
+    start = date.fromisoformat("2023-01-01")
+    end = date.fromisoformat("2023-12-31")
+
+    rankings = pipeline_daily_rankings(start, end, parse_workers=0, window=4, rate=100)
+    for _ in zip(range(3), rankings):
+        pass
+    rankings.close()
+
+    # a consumer that stops early leaves at most the window downloaded
+    assert len(stub_site.paths) <= 3 + 4
+
+
+def test_pipeline_raises_fetch_errors(stub_site):
+    with pytest.raises(Exception):
+        list(pipeline_movie_details(["rl0"], parse_workers=0))
+
+
+def test_pipeline_parses_with_the_configured_backend(monkeypatch, stub_site):
+    monkeypatch.setenv("parser_backend", "unknown")
+    with pytest.raises(ValueError):
+        list(pipeline_movie_details(MOVIE_IDS[:1], parse_workers=0))
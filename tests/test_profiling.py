@@ -0,0 +1,50 @@
+import json
+import pstats
+
+from src import profiling
+from src.backends.memory import MemoryObjectStore
+
+
+def make_event(*bodies):
+    return {"Records": [{"body": json.dumps(body)} for body in bodies]}
+
+
+def work(event, context):
+    return {"statusCode": 200, "total": sum(range(10000))}
+
+
+def test_requested():
+    assert profiling.requested(make_event({"date": "2023-08-17"}, {"profile": True}))
+    assert not profiling.requested(make_event({"date": "2023-08-17"}))
+    assert not profiling.requested({"Records": [{"body": "not json"}]})
+    assert not profiling.requested({})
+
+
+def test_sampled():
+    assert not profiling.sampled(0)
+    assert profiling.sampled(1)
+    assert sum(profiling.sampled(4) for _ in range(2000)) in range(350, 650)
+
+
+def test_profiled_invocation_is_saved(tmp_path):
+    storage = MemoryObjectStore()
+    handler = profiling.profiled("handler", storage)(work)
+
+    assert handler(make_event({"id": "rl1", "profile": True}), None)["total"] > 0
+    prof, txt = storage.list_keys("profiles/handler/")
+    assert prof.endswith(".prof") and txt.endswith(".txt")
+
+    path = tmp_path / "handler.prof"
+    path.write_bytes(storage.get(prof).body)
+    functions = [f[2] for f in pstats.Stats(str(path)).stats]
+    assert "work" in functions
+    assert "allocations, peak" in storage.get(txt).body.decode("utf-8")
+
+
+def test_unprofiled_invocation(monkeypatch):
+    monkeypatch.setattr(profiling, "SAMPLE_RATE", 0)
+    storage = MemoryObjectStore()
+    handler = profiling.profiled("handler", storage)(work)
+
+    assert handler(make_event({"id": "rl1"}), None)["statusCode"] == 200
+    assert storage.list_keys("profiles/") == []
@@ -0,0 +1,155 @@
+import time
+import pytest
+import pathlib
+import requests
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+from src.backends import NoSuchKey
+from src.backends.memory import MemoryObjectStore
+from src.deltas import write_delta, new_batch_id
+from src.record import DailyRecord, Movie
+from src.encoders import get_encoder
+from src.parsers import get_parser
+from src.query import ObjectCache, QueryService
+from src.server import make_server
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+AUG_17 = date(2023, 8, 17)
+
+
+class BlockingStore(MemoryObjectStore):
+    """Counts the GETs, which wait for release to be set"""
+
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+        self.release = threading.Event()
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        self.gets += 1
+        self.release.wait(timeout=5)
+        return super().get(key, if_none_match=if_none_match, byte_range=byte_range)
+
+
+@pytest.fixture
+def service():
+    storage = MemoryObjectStore()
+    html = (FIXTURES / "date_2023-08-17.html").read_text(encoding="utf-8")
+    movies = get_parser().parse_daily_ranking(html, AUG_17)
+    encoder = get_encoder("json")
+    storage.put("ranking/2023-08-17.json", encoder.encode_ranking(movies))
+    storage.put("ranking/2023-08-18.json", encoder.encode_ranking(movies))
+    storage.put(f"movies/{movies[0].id}.json", encoder.encode_movie(movies[0]))
+    return QueryService(storage, "ranking", "movies", "archive", "json")
+
+
+def test_cache_evicts_least_recently_used():
+    storage = MemoryObjectStore()
+    for key in "abc":
+        storage.put(key, b"x" * 10)
+    cache = ObjectCache(storage, max_bytes=25)
+
+    cache.get("a", bytes.decode)
+    cache.get("b", bytes.decode)
+    cache.get("a", bytes.decode)
+    cache.get("c", bytes.decode)
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.total_bytes == 20
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 3
+
+
+def test_cache_coalesces_concurrent_reads():
+    storage = BlockingStore()
+    storage.put("a", b"body")
+    cache = ObjectCache(storage, max_bytes=100)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(cache.get, "a", bytes.decode) for _ in range(4)]
+        while cache.stats["coalesced"] < 3:
+            time.sleep(0.01)
+        storage.release.set()
+        results = [future.result() for future in futures]
+
+    assert storage.gets == 1
+    assert {value for value, _ in results} == {"body"}
+
+
+def test_cache_revalidates_with_etag():
+    storage = MemoryObjectStore()
+    storage.put("a", b"first")
+    cache = ObjectCache(storage, max_bytes=100, revalidate_seconds=0)
+
+    value, etag = cache.get("a", bytes.decode)
+    assert cache.get("a", bytes.decode) == (value, etag)
+    assert cache.stats["revalidated"] == 1
+
+    new_etag = storage.put("a", b"second")
+    assert cache.get("a", bytes.decode) == ("second", new_etag)
+
+    storage.delete(["a"])
+    with pytest.raises(NoSuchKey):
+        cache.get("a", bytes.decode)
+    assert len(cache.entries) == 0
+
+
+def test_movie_in_delta_mode(service):
+    storage = service.storage
+    (key,) = storage.list_keys("movies/")
+    movie_id = key.split("/")[1].split(".")[0]
+    service.deltas_prefix = "deltas"
+    base, base_etag = service.movie(movie_id)
+    newest = max(base.revenues)
+
+    delta = Movie(id=movie_id, title="", revenues={newest + 1: DailyRecord(1, 9)})
+    write_delta(storage, "deltas", "json", delta, new_batch_id())
+    movie, etag = service.movie(movie_id)
+    assert movie.revenues[newest + 1] == DailyRecord(1, 9)
+    assert etag != base_etag
+    # the cached base object is left as stored
+    cached, _ = service.cache.get(key, service.encoder.decode_movie)
+    assert cached is base and newest + 1 not in base.revenues
+
+    # a new delta is a new version of the movie
+    delta.revenues = {newest + 2: DailyRecord(1, 8)}
+    write_delta(storage, "deltas", "json", delta, new_batch_id())
+    movie, newer_etag = service.movie(movie_id)
+    assert sorted(movie.revenues)[-2:] == [newest + 1, newest + 2]
+    assert newer_etag not in (etag, base_etag)
+
+
+def test_http_endpoints(service):
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        response = requests.get(f"{url}/rankings/2023-08-17")
+        assert response.status_code == 200
+        ranking = response.json()
+        assert ranking["date"] == "2023-08-17"
+        assert ranking["movies"][0]["ranking"] == 1
+
+        etag = response.headers["ETag"]
+        response = requests.get(
+            f"{url}/rankings/2023-08-17", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+
+        movie_id = ranking["movies"][0]["id"]
+        movie = requests.get(f"{url}/movies/{movie_id}").json()
+        assert movie["id"] == movie_id
+        assert movie["gross"] == ranking["movies"][0]["revenue"]
+
+        response = requests.get(f"{url}/rankings?start=2023-08-16&end=2023-08-18")
+        dates = [r["date"] for r in response.json()["rankings"]]
+        assert dates == ["2023-08-17", "2023-08-18"]
+
+        assert requests.get(f"{url}/rankings/2023-08-19").status_code == 404
+        assert requests.get(f"{url}/movies/unknown").status_code == 404
+        assert requests.get(f"{url}/rankings/2023-13-01").status_code == 400
+        assert requests.get(f"{url}/rankings?start=2023-08-16").status_code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,34 @@
+import pathlib
+import pytest
+
+from src.encoders import ENCODERS, get_encoder
+from src.parsers import get_parser
+from src.record import DailyRecord, Movie, content_hash
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+MOVIE_ID = "rl1077904129"
+
+
+def test_content_hash_ignores_revenue_order():
+    movie = Movie(id="rl1", title="a", revenues={1: DailyRecord(1, 100)})
+    movie.merge_records({3: DailyRecord(2, 300), 2: DailyRecord(1, 200)})
+    ordered = Movie(
+        id="rl1",
+        title="a",
+        revenues={n: movie.revenues[n] for n in [1, 2, 3]},
+    )
+
+    assert content_hash([movie]) == content_hash([ordered])
+    ordered.revenues[3] = DailyRecord(2, 301)
+    assert content_hash([movie]) != content_hash([ordered])
+
+
+@pytest.mark.parametrize("extension", list(ENCODERS))
+def test_content_hash_survives_the_codecs(extension):
+    html = (FIXTURES / f"release_{MOVIE_ID}.html").read_text(encoding="utf-8")
+    movie = get_parser().parse_movie_detail(html, MOVIE_ID)
+    encoder = get_encoder(extension)
+
+    decoded = encoder.decode_movie(encoder.encode_movie(movie))
+
+    assert content_hash([decoded]) == content_hash([movie])
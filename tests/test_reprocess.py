@@ -0,0 +1,148 @@
+import pytest
+from datetime import date, timedelta
+
+from src.backends.memory import MemoryObjectStore
+from src.encoders import get_encoder
+from src.indexes import MovieIndex
+from src.manifest import Manifest
+from src.record import DailyRecord, Movie
+from src.reprocess import reprocess_movies
+
+AUG_1 = date(2023, 8, 1)
+encoder = get_encoder("json")
+
+
+@pytest.fixture
+def storage():
+    """Rankings of 2023-08-01 to 08-04, barbie from its 1st day and nun from
+    its 10th, every other file in col which has no release date
+    """
+    storage = MemoryObjectStore()
+    for i in range(4):
+        d = AUG_1 + timedelta(days=i)
+        movies = [
+            Movie(
+                id="barbie",
+                title="Barbie",
+                release_date=AUG_1,
+                revenues={i + 1: DailyRecord(1, 100 - i)},
+                num_of_theaters=4000,
+                distributor="wb",
+            ),
+            Movie(
+                id="nun",
+                title="The Nun",
+                release_date=AUG_1 - timedelta(days=9),
+                revenues={i + 10: DailyRecord(2, 50 - i)},
+                num_of_theaters=3000,
+                distributor="wb",
+            ),
+        ]
+        extension = "col" if i % 2 else "json"
+        writable = get_encoder(extension).encode_ranking(movies)
+        storage.put(f"ranking/{d.isoformat()}.{extension}", writable)
+    return storage
+
+
+def reprocess(storage, **kwargs) -> tuple[dict, list]:
+    return reprocess_movies(
+        storage,
+        "ranking",
+        "archive",
+        "movies",
+        "json",
+        AUG_1,
+        AUG_1 + timedelta(days=3),
+        manifest=Manifest(storage, "manifest.json"),
+        index=MovieIndex(storage, "indexes/movies.json"),
+        shards=4,
+        **kwargs,
+    )
+
+
+def store(storage, movie_id: str, title: str, release_date: date):
+    """As crawled from the release page, without the days of the rankings"""
+    movie = Movie(
+        id=movie_id,
+        title=title,
+        release_date=release_date,
+        revenues={1: DailyRecord(1, 1)},
+        num_of_theaters=4243,
+        distributor="Warner Bros.",
+    )
+    storage.put(f"movies/{movie_id}.json", encoder.encode_movie(movie))
+
+
+def stored(storage, movie_id: str) -> Movie:
+    return encoder.decode_movie(storage.get(f"movies/{movie_id}.json").body)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_reprocess_rebuilds_stored_movies(storage, workers):
+    store(storage, "barbie", "Barbie", AUG_1)
+    store(storage, "nun", "The Nun", date(2023, 7, 23))
+
+    counts, missing = reprocess(storage, workers=workers)
+    assert counts == {"stored": 2, "unchanged": 0, "failed": 0}
+    assert missing == []
+
+    nun = stored(storage, "nun")
+    assert nun.revenues == {1: DailyRecord(1, 1)} | {
+        10 + i: DailyRecord(2, 50 - i) for i in range(4)
+    }
+    assert nun.distributor == "Warner Bros." and nun.num_of_theaters == 4243
+
+    manifest = Manifest(storage, "manifest.json")
+    manifest.refresh()
+    assert manifest.get("barbie").newest_nth_day == 4
+    assert manifest.get("barbie").etag == storage.head("movies/barbie.json").etag
+    index = MovieIndex(storage, "indexes/movies.json")
+    index.refresh()
+    assert index.by_title("the nun") == ["nun"]
+
+
+def test_reprocess_leaves_movies_not_stored(storage):
+    store(storage, "barbie", "Barbie", AUG_1)
+
+    counts, missing = reprocess(storage, workers=0)
+
+    # a stub built from the rankings would never be crawled in full
+    assert missing == ["nun"]
+    assert counts["stored"] == 1
+    assert storage.list_keys("movies/") == ["movies/barbie.json"]
+    manifest = Manifest(storage, "manifest.json")
+    manifest.refresh()
+    assert manifest.get("nun") is None
+
+
+def test_reprocess_merges_into_stored_movies(storage):
+    # crawled from the release page: a day outside the rankings, a wrong one
+    barbie = Movie(
+        id="barbie",
+        title="Barbie",
+        release_date=AUG_1,
+        revenues={2: DailyRecord(1, 0), 5: DailyRecord(1, 90)},
+        num_of_theaters=4243,
+        distributor="wb",
+    )
+    storage.put("movies/barbie.json", encoder.encode_movie(barbie))
+
+    reprocess(storage, workers=0)
+    barbie = stored(storage, "barbie")
+    assert barbie.revenues[2] == DailyRecord(1, 99)
+    assert barbie.revenues[5] == DailyRecord(1, 90)
+    assert barbie.num_of_theaters == 4243
+
+    reprocess(storage, workers=0, fresh=True)
+    assert sorted(stored(storage, "barbie").revenues) == [1, 2, 3, 4]
+
+
+def test_reprocess_skips_unchanged_movies(storage):
+    store(storage, "nun", "The Nun", date(2023, 7, 23))
+    reprocess(storage, workers=0)
+    etag = storage.head("movies/nun.json").etag
+
+    counts, missing = reprocess(storage, workers=0)
+    assert counts == {"stored": 0, "unchanged": 1, "failed": 0}
+    assert missing == ["barbie"]
+    assert storage.head("movies/nun.json").etag == etag
@@ -0,0 +1,100 @@
+from datetime import date, timedelta
+
+from src.backends.memory import MemoryObjectStore
+from src.scheduler import BackfillScheduler, plan_ranges
+
+TODAY = date(2023, 9, 1)
+
+
+def days(start: str, end: str) -> list[date]:
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def make_scheduler(storage, concurrency=2) -> BackfillScheduler:
+    return BackfillScheduler(
+        storage,
+        "ranking",
+        "scheduler/checkpoint.json",
+        earliest=date(2023, 8, 1),
+        chunk_days=7,
+        concurrency=concurrency,
+        lease_seconds=60,
+    )
+
+
+def store(storage, dates):
+    for d in dates:
+        storage.put(f"ranking/{d.isoformat()}.json", b"[]")
+
+
+def test_plan_ranges():
+    missing = days("2023-08-01", "2023-08-20")[::-1]
+    missing.remove(date(2023, 8, 15))
+
+    assert plan_ranges(missing, chunk_days=7) == [
+        (date(2023, 8, 16), date(2023, 8, 20)),
+        (date(2023, 8, 8), date(2023, 8, 14)),
+        (date(2023, 8, 1), date(2023, 8, 7)),
+    ]
+    assert len(plan_ranges(missing, chunk_days=7, limit=2)) == 2
+    assert plan_ranges([], chunk_days=7) == []
+
+
+def test_schedule_skips_stored_dates():
+    storage = MemoryObjectStore()
+    store(storage, days("2023-08-25", "2023-08-31"))
+    scheduler = make_scheduler(storage)
+
+    assert scheduler.schedule(TODAY, now=0) == [
+        (date(2023, 8, 18), date(2023, 8, 24)),
+        (date(2023, 8, 11), date(2023, 8, 17)),
+    ]
+    # both slots are taken until a unit completes
+    assert scheduler.schedule(TODAY, now=1) == []
+
+    store(storage, days("2023-08-18", "2023-08-24"))
+    assert scheduler.schedule(TODAY, now=2) == [(date(2023, 8, 4), date(2023, 8, 10))]
+
+
+def test_expired_leases_are_scheduled_again():
+    storage = MemoryObjectStore()
+    store(storage, days("2023-08-08", "2023-08-31"))
+    scheduler = make_scheduler(storage)
+
+    assert scheduler.schedule(TODAY, now=0) == [(date(2023, 8, 1), date(2023, 8, 7))]
+    assert scheduler.schedule(TODAY, now=30) == []
+    assert scheduler.schedule(TODAY, now=61) == [(date(2023, 8, 1), date(2023, 8, 7))]
+
+
+def test_schedulers_never_share_dates():
+    storage = MemoryObjectStore()
+    first, second = make_scheduler(storage), make_scheduler(storage, concurrency=4)
+
+    units = first.schedule(TODAY, now=0) + second.schedule(TODAY, now=0)
+    scheduled = [d for start, end in units for d in days(str(start), str(end))]
+
+    assert len(units) == 4
+    assert len(scheduled) == len(set(scheduled)) == 28
+    assert first.schedule(TODAY, now=0) == second.schedule(TODAY, now=0) == []
+
+
+def test_failed_dates_release_their_lease():
+    storage = MemoryObjectStore()
+    store(storage, days("2023-08-08", "2023-08-31"))
+    scheduler = make_scheduler(storage)
+    scheduler.max_attempts = 2
+    aug_3 = date(2023, 8, 3)
+
+    assert scheduler.schedule(TODAY, now=0) == [(date(2023, 8, 1), date(2023, 8, 7))]
+    # every date is stored but the one whose page is not found
+    store(storage, [d for d in days("2023-08-01", "2023-08-07") if d != aug_3])
+    scheduler.record_failures([aug_3], now=10)
+
+    # planned again before the lease expires, and given up on the 2nd failure
+    assert scheduler.schedule(TODAY, now=20) == [(aug_3, aug_3)]
+    assert scheduler.schedule(TODAY, now=30) == []
+    scheduler.record_failures([aug_3], now=40)
+    assert scheduler.schedule(TODAY, now=50) == []
+    checkpoint, _ = scheduler.load()
+    assert checkpoint["failed"]["2023-08-03"]["attempts"] == 2